@@ -0,0 +1,98 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" Many arrangements in flight on one event loop.
+
+Arranges and typesets a batch of synthetic charts from a single asyncio
+event loop, two ways: wrapping the blocking generate_arrangement() in a
+thread per job, and with generate_arrangement_async(), which arranges in
+a pool of worker processes and waits on lilypond as an asyncio
+subprocess. Reports wall time, jobs per second and the most threads the
+process ran at once.
+
+    python benchmarks/bench_async.py
+    python benchmarks/bench_async.py --jobs 200 --measures 32 -j 4
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent import futures
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'src'))
+
+from leadsheets import write_leadsheet
+import generate_chordmelody
+
+async def watch_threads(peak):
+    while True:
+        peak[0] = max(peak[0], threading.active_count())
+        await asyncio.sleep(0.01)
+
+async def in_threads(paths, workers):
+    loop = asyncio.get_running_loop()
+    with futures.ThreadPoolExecutor(max_workers=len(paths)) as pool:
+        jobs = [loop.run_in_executor(pool, lambda k=k, p=p: generate_chordmelody.generate_arrangement(
+                    p, output_name=f'bench-async-{k}')) for k, p in enumerate(paths)]
+        return await asyncio.gather(*jobs)
+
+async def in_event_loop(paths, workers):
+    with futures.ProcessPoolExecutor(max_workers=workers, initializer=generate_chordmelody._warm_worker) as pool:
+        # start the workers before the clock matters
+        await asyncio.gather(*(asyncio.get_running_loop().run_in_executor(pool, time.sleep, 0.1)
+                               for _ in range(workers)))
+        start = time.perf_counter()
+        jobs = [generate_chordmelody.generate_arrangement_async(p, executor=pool, output_name=f'bench-async-{k}')
+                for k, p in enumerate(paths)]
+        lilyfiles = await asyncio.gather(*jobs)
+        return lilyfiles, time.perf_counter() - start
+
+async def timed(run, paths, workers):
+    peak = [threading.active_count()]
+    watcher = asyncio.ensure_future(watch_threads(peak))
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = await run(paths, workers)
+    seconds = time.perf_counter() - start
+    if isinstance(result, tuple):
+        result, seconds = result
+    watcher.cancel()
+    for lilyfile in result:
+        for f in (lilyfile, generate_chordmelody.pdf_path(lilyfile)):
+            os.remove(f)
+    return seconds, peak[0]
+
+def run(jobs, measures, workers):
+    # a cache would answer most of the jobs
+    for name in ('OUTPUT_CACHE', 'PARSE_CACHE', 'METRICS_LOG', 'METRICS_MEMORY', 'PROFILE_DIR'):
+        os.environ.pop(name, None)
+    os.environ['LILYPOND_PATH'] = os.path.join(here, 'fake_lilypond')
+    os.makedirs('data/output', exist_ok=True)
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = [write_leadsheet(os.path.join(tmp, f'async-{k}.mxl'), measures, seed=k) for k in range(jobs)]
+        for name, f in (('threads', in_threads), ('asyncio', in_event_loop)):
+            seconds, threads = asyncio.run(timed(f, paths, workers))
+            rows.append((name, seconds, threads))
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time many arrangements in flight on one event loop.')
+    parser.add_argument('--jobs', type=int, default=64, help='arrangements in flight')
+    parser.add_argument('--measures', type=int, default=32, help='chart length in measures')
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count() or 1,
+                        help='worker processes for generate_arrangement_async()')
+    args = parser.parse_args(argv)
+
+    rows = run(args.jobs, args.measures, args.workers)
+    print(f'{"mode":>8}{"jobs":>6}{"wall s":>9}{"jobs/s":>9}{"threads":>9}')
+    for name, seconds, threads in rows:
+        print(f'{name:>8}{args.jobs:>6}{seconds:>9.2f}{args.jobs / seconds:>9.1f}{threads:>9}')
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,111 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" LilyPond wall time with shared fret diagram tables.
+
+Arranges synthetic AABA charts, then typesets each .ly file twice with a
+real lilypond: once as written, where identical diagrams share a table,
+and once rewritten with one table per chord occurrence, as every chord
+used to get. Prints the table counts, file sizes and typesetting times.
+
+    python benchmarks/bench_fret_tables.py --lilypond /usr/bin/lilypond
+    python benchmarks/bench_fret_tables.py --tunes 4 --measures 32 64 --repeat 3
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'src'))
+
+from leadsheets import write_leadsheet
+import generate_chordmelody
+
+table_re = re.compile(r"#\(define fret-table-(\d+) \(make-fretboard-table\)\)\n\n"
+                      r"\\storePredefinedDiagram #fret-table-\d+\n(.*?)\n#guitar-tuning\n(#'.*?)\n", re.S)
+select_re = re.compile(r'predefinedDiagramTable = #fret-table-(\d+)')
+
+def unshared(text):
+    """ The same .ly text with a table of its own for every selection.
+    Returns the text and the numbers of shared and rewritten tables.
+    """
+    tables = {m.group(1): m for m in table_re.finditer(text)}
+    copies = []
+    def select(m):
+        t = tables.get(m.group(1))
+        if t is None:
+            return m.group(0)
+        i = len(copies)
+        copies.append(f'#(define fret-table-{i}-copy (make-fretboard-table))\n\n'
+                      f'\\storePredefinedDiagram #fret-table-{i}-copy\n{t.group(2)}\n#guitar-tuning\n{t.group(3)}\n')
+        return f'predefinedDiagramTable = #fret-table-{i}-copy'
+    head, sep, body = text.partition('\\score')
+    body = select_re.sub(select, body)
+    head = table_re.sub('', head).rstrip('\n') + '\n' + '\n'.join(copies)
+    return head + sep + body, len(tables), len(copies)
+
+def typeset(lilypond, lyfile, repeat):
+    # best of repeat wall times for one lilypond run
+    out = lyfile[:-len('.ly')]
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([lilypond, '-s', '-o', out, lyfile], check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        t = time.perf_counter() - start
+        best = t if best is None else min(best, t)
+    return best
+
+def default_lilypond():
+    try:
+        import lilypond
+        return str(lilypond.executable())
+    except ImportError:
+        return os.getenv('LILYPOND_PATH', 'lilypond')
+
+def run(lilypond, tunes, sizes, repeat):
+    os.makedirs('data/output', exist_ok=True)
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in sizes:
+            for k in range(tunes):
+                name = f'aaba-{n}-{k}'
+                path = write_leadsheet(os.path.join(tmp, name + '.mxl'), n, seed=k, form='AABA')
+                lilyfile = generate_chordmelody.generate_arrangement(path, output_name=name, pdf=False)
+                with open(lilyfile) as f:
+                    shared = f.read()
+                os.remove(lilyfile)
+                text, n_tables, n_chords = unshared(shared)
+                files = {}
+                for kind, content in (('shared', shared), ('per-chord', text)):
+                    files[kind] = os.path.join(tmp, f'{name}-{kind}.ly')
+                    with open(files[kind], 'w') as f:
+                        f.write(content)
+                times = {kind: typeset(lilypond, f, repeat) for kind, f in files.items()}
+                rows.append((name, n_chords, n_tables, len(text), len(shared), times['per-chord'], times['shared']))
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time LilyPond on charts with shared and per-chord fret tables.')
+    parser.add_argument('--lilypond', default=default_lilypond(), help='lilypond binary to time')
+    parser.add_argument('--tunes', type=int, default=3, help='charts per length')
+    parser.add_argument('--measures', type=int, nargs='+', default=[32, 64], help='chart lengths in measures')
+    parser.add_argument('--repeat', type=int, default=3, help='lilypond runs per file, the best one counts')
+    args = parser.parse_args(argv)
+
+    rows = run(args.lilypond, args.tunes, args.measures, args.repeat)
+    print()
+    print(f'{"chart":>12}{"chords":>8}{"tables":>8}{"per-chord KB":>14}{"shared KB":>11}'
+          f'{"per-chord s":>13}{"shared s":>10}{"change":>9}')
+    def row(name, chords, tables, size_before, size_after, before, after):
+        print(f'{name:>12}{chords:>8}{tables:>8}{size_before / 1024:>14.1f}{size_after / 1024:>11.1f}'
+              f'{before:>13.2f}{after:>10.2f}{100 * (after / before - 1):>8.1f}%')
+    for r in rows:
+        row(*r)
+    row('total', *[sum(r[k] for r in rows) for k in range(1, 7)])
+
+if __name__ == '__main__':
+    main()
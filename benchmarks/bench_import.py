@@ -0,0 +1,71 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" Cold import time of the entry points, from python -X importtime.
+
+Each module is imported in a fresh interpreter several times and the
+best cumulative time counts. Importing an entry point must not import
+music21, which is left to the first job that needs it. Exits 1 when an
+entry point takes longer than --max-ms or imports music21. music21 on
+its own is timed for comparison.
+
+    python benchmarks/bench_import.py
+    python benchmarks/bench_import.py --max-ms 150 --repeat 10
+"""
+import argparse
+import compileall
+import os
+import subprocess
+import sys
+
+here = os.path.dirname(os.path.abspath(__file__))
+src = os.path.join(here, '..', 'src')
+
+entry_points = ['generate_chordmelody', 'arrangement_server', 'validate_tools']
+
+def import_times(module):
+    """ Cumulative import time in microseconds of every module imported
+    by `import module` in a fresh interpreter.
+    """
+    env = dict(os.environ, PYTHONPATH=src)
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                          env=env, stderr=subprocess.PIPE, check=True, text=True)
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+def run(modules, repeat):
+    # bytecode is compiled once on a deployed machine, so do not time it
+    compileall.compile_dir(src, quiet=1)
+    rows = []
+    for module in modules:
+        best, music21 = None, False
+        for _ in range(repeat):
+            times = import_times(module)
+            best = times[module] if best is None else min(best, times[module])
+            music21 = music21 or 'music21' in times
+        rows.append((module, best / 1000, music21))
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time cold imports of the entry points.')
+    parser.add_argument('--max-ms', type=float, default=150, help='slowest acceptable entry point import')
+    parser.add_argument('--repeat', type=int, default=5, help='imports per module, the best one counts')
+    args = parser.parse_args(argv)
+
+    rows = run(entry_points + ['music21'], args.repeat)
+    print(f'{"module":>22}{"import ms":>11}{"music21":>9}')
+    failed = []
+    for module, ms, music21 in rows:
+        print(f'{module:>22}{ms:>11.1f}{"yes" if music21 else "no":>9}')
+        if module in entry_points and (ms > args.max_ms or music21):
+            failed.append(module)
+    for module in failed:
+        print(f'REGRESSION {module}: over {args.max_ms:g} ms or imports music21')
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
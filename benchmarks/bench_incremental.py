@@ -0,0 +1,119 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" Edit-to-.ly latency of ArrangementSession against a full arrangement.
+
+Makes a synthetic chart, arranges it once in a session, and then edits
+it over and over the way an editor user would: one chord symbol, one
+melody note, or the chords of a four measure phrase. After each edit the
+session arranges the file again, and so does generate_arrangement() from
+scratch. Both have to write the same .ly text, and the script exits 1 if
+they ever differ. Reports the median time per edit of both.
+
+    python benchmarks/bench_incremental.py
+    python benchmarks/bench_incremental.py --sizes 32 500 --edits 20
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'src'))
+
+from leadsheets import leadsheet_xml, steps
+from arrangement_session import ArrangementSession
+import generate_chordmelody
+
+edit_kinds = ['chord', 'note', 'phrase']
+chord_kinds = ['major', 'minor', 'dominant', 'major-seventh', 'minor-seventh', 'half-diminished']
+
+def edit(root, kind, rng):
+    """ Change the chart in place, as an editor user would. """
+    measures = root.find('part').findall('measure')
+    if kind == 'note':
+        pitches = [p for p in measures[rng.randrange(len(measures))].iter('pitch')]
+        if pitches:
+            rng.choice(pitches).find('step').text = rng.choice(steps)
+        return
+    start = rng.randrange(len(measures))
+    for m in measures[start:start + (4 if kind == 'phrase' else 1)]:
+        for h in m.findall('harmony'):
+            if h.find('kind').get('text') == 'N.C.':
+                continue
+            h.find('root/root-step').text = rng.choice(steps)
+            h.find('kind').text = rng.choice(chord_kinds)
+            if kind == 'chord':
+                break
+
+def timed(f, *args, **kwargs):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        lilyfile = f(*args, **kwargs)
+    seconds = time.perf_counter() - start
+    with open(lilyfile) as lf:
+        text = lf.read()
+    os.remove(lilyfile)
+    return seconds, text
+
+def run_size(tmp, n, edits, kinds, rng):
+    path = os.path.join(tmp, f'tune-{n}.xml')
+    root = ET.fromstring(leadsheet_xml(n, seed=n, form='AABA').encode())
+    ET.ElementTree(root).write(path)
+    session = ArrangementSession(output_name='bench-incremental-session', pdf=False)
+    first, _ = timed(session.arrange, path)
+    times = {kind: ([], []) for kind in kinds}
+    differ = 0
+    for k in range(edits):
+        kind = kinds[k % len(kinds)]
+        edit(root, kind, rng)
+        ET.ElementTree(root).write(path)
+        t_session, text_session = timed(session.arrange, path)
+        t_full, text_full = timed(generate_chordmelody.generate_arrangement, path,
+                                  output_name='bench-incremental-full', pdf=False)
+        times[kind][0].append(t_session)
+        times[kind][1].append(t_full)
+        differ += text_session != text_full
+    return first, times, differ
+
+def run(sizes, edits, kinds, seed):
+    # cached output or parses would hide the work being measured
+    for name in ('OUTPUT_CACHE', 'PARSE_CACHE', 'METRICS_LOG', 'METRICS_MEMORY', 'PROFILE_DIR'):
+        os.environ.pop(name, None)
+    os.environ['LILYPOND_PATH'] = os.path.join(here, 'fake_lilypond')
+    os.makedirs('data/output', exist_ok=True)
+    rng = random.Random(seed)
+    rows = []
+    differ = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in sizes:
+            first, times, d = run_size(tmp, n, edits, kinds, rng)
+            differ += d
+            for kind, (t_session, t_full) in times.items():
+                rows.append((n, kind, first, statistics.median(t_session), statistics.median(t_full)))
+    return rows, differ
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time re-arranging a chart after small edits.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[32, 125, 500], help='chart lengths in measures')
+    parser.add_argument('--edits', type=int, default=12, help='edits per chart')
+    parser.add_argument('--kinds', nargs='+', choices=edit_kinds, default=edit_kinds, help='kinds of edit, taken in turn')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    rows, differ = run(args.sizes, args.edits, args.kinds, args.seed)
+    print(f'{"measures":>9}{"edit":>8}{"first s":>9}{"session s":>11}{"full s":>9}{"speedup":>9}')
+    for n, kind, first, t_session, t_full in rows:
+        print(f'{n:>9}{kind:>8}{first:>9.3f}{t_session:>11.4f}{t_full:>9.3f}{t_full / t_session:>8.1f}x')
+    if differ:
+        print(f'{differ} edits arranged differently from a full arrangement')
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,79 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" All twelve keys in one pass against twelve transposed arrangements.
+
+Times generate_keys() writing the .ly file of every key of synthetic
+charts of increasing length, against what twelve transposed MusicXML
+files cost: parsing the chart, transposing it and running
+arrange_leadsheet() once per key. Typesetting is left out, it is the
+same either way.
+
+    python benchmarks/bench_keys.py
+    python benchmarks/bench_keys.py --sizes 32 500 --repeat 5
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'src'))
+
+from leadsheets import write_leadsheet
+from transpose_tools import transposed
+import generate_chordmelody
+
+def best(f, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = f()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+def one_pass(path):
+    results = generate_chordmelody.generate_keys(path, output_name='bench-keys', pdf=False)
+    return [r.lilyfile for r in results.values()]
+
+def per_key(path):
+    lilyfiles = []
+    for name, transposition in generate_chordmelody.leadsheet_keys(generate_chordmelody.parse_leadsheet(path)):
+        leadsheet = generate_chordmelody.parse_leadsheet(path)
+        with transposed(leadsheet, transposition):
+            lilyfiles.append(generate_chordmelody.arrange_leadsheet(leadsheet, output_name=f'bench-keys-{name}-alone',
+                                                                    pdf=False))
+    return lilyfiles
+
+def run(sizes, repeat):
+    # a cache would answer the parses
+    os.environ.pop('PARSE_CACHE', None)
+    os.environ['LILYPOND_PATH'] = os.path.join(here, 'fake_lilypond')
+    os.makedirs('data/output', exist_ok=True)
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in sizes:
+            path = write_leadsheet(os.path.join(tmp, f'keys-{n}.mxl'), n, seed=n, form='AABA')
+            separate, lilyfiles = best(lambda: per_key(path), repeat)
+            together, more = best(lambda: one_pass(path), repeat)
+            for lilyfile in lilyfiles + more:
+                os.remove(lilyfile)
+            rows.append((n, separate, together))
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time all twelve keys in one pass against one run per key.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[32, 125, 500], help='chart lengths in measures')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per chart, the best one counts')
+    args = parser.parse_args(argv)
+
+    rows = run(args.sizes, args.repeat)
+    print(f'{"measures":>9}{"per key s":>11}{"one pass s":>12}{"speedup":>9}')
+    for n, separate, together in rows:
+        print(f'{n:>9}{separate:>11.2f}{together:>12.2f}{separate / together:>8.1f}x')
+
+if __name__ == '__main__':
+    sys.exit(main())
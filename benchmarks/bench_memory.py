@@ -0,0 +1,78 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" Peak memory of an arrangement job, per stage, to size worker pools by.
+
+Arranges synthetic charts of increasing length in a warm worker process,
+the way arrangement_server runs them, and reports how much memory each
+job and each of its stages took on top of the worker's resident size.
+With --memory rss (the default) the worker samples its resident size,
+which is what JOB_MEMORY_MB is checked against; --memory trace counts
+traced Python allocations instead. The last column is the time the same
+job takes without any memory accounting.
+
+    python benchmarks/bench_memory.py
+    python benchmarks/bench_memory.py --sizes 32 500 --memory trace
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+from concurrent import futures
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'src'))
+
+from leadsheets import write_leadsheet
+from metrics_tools import Metrics, measure_job, rss_bytes
+import generate_chordmelody
+
+def arrange(path, memory):
+    """ Runs in the worker: one job, with or without memory accounting. """
+    metrics = Metrics(os.path.basename(path), memory=memory) if memory else None
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()), measure_job(path, metrics):
+        lilyfile = generate_chordmelody.generate_arrangement(path, output_name='bench-memory', pdf=False)
+    elapsed = time.perf_counter() - start
+    os.remove(lilyfile)
+    return metrics, elapsed
+
+def run(sizes, memory):
+    for name in ('OUTPUT_CACHE', 'PARSE_CACHE', 'METRICS_LOG', 'METRICS_MEMORY', 'JOB_MEMORY_MB', 'PROFILE_DIR'):
+        os.environ.pop(name, None)
+    os.environ['LILYPOND_PATH'] = os.path.join(here, 'fake_lilypond')
+    os.makedirs('data/output', exist_ok=True)
+    rows = []
+    worker = None
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in sizes:
+            path = write_leadsheet(os.path.join(tmp, f'memory-{n}.mxl'), n, seed=n)
+            # each job in a worker of its own, so it grows the worker from
+            # where a fresh one starts, as the first job after a restart does
+            with futures.ProcessPoolExecutor(max_workers=1, initializer=generate_chordmelody._warm_worker) as pool:
+                worker = pool.submit(rss_bytes).result()
+                metrics, measured = pool.submit(arrange, path, memory).result()
+            with futures.ProcessPoolExecutor(max_workers=1, initializer=generate_chordmelody._warm_worker) as pool:
+                plain = pool.submit(arrange, path, None).result()[1]
+            rows.append((n, metrics, measured, plain))
+    return worker, rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Report the peak memory of arrangement jobs per stage.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[32, 125, 500], help='chart lengths in measures')
+    parser.add_argument('--memory', choices=['rss', 'trace'], default='rss', help='how to account memory')
+    args = parser.parse_args(argv)
+
+    worker, rows = run(args.sizes, 'rss' if args.memory == 'rss' else True)
+    mb = lambda b: (b or 0) / 2**20
+    print(f'warm worker: {mb(worker):.0f} MB resident')
+    stages = list(rows[0][1].stages)
+    print(f'{"measures":>9}{"job MB":>8}' + ''.join(f'{s[:12]:>13}' for s in stages) + f'{"s":>7}{"plain s":>9}')
+    for n, metrics, measured, plain in rows:
+        peaks = ''.join(f'{mb(metrics.stages.get(s, {}).get("peak_bytes")):>13.1f}' for s in stages)
+        print(f'{n:>9}{mb(metrics.peak_bytes):>8.1f}{peaks}{measured:>7.2f}{plain:>9.2f}')
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,63 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" parse_leadsheet() with and without the parse cache.
+
+Parses synthetic charts of increasing length three ways: with
+music21's own per-path pickles turned off, as music21 does by default,
+and from a warm PARSE_CACHE.
+
+    python benchmarks/bench_parse_cache.py
+    python benchmarks/bench_parse_cache.py --sizes 32 500 --repeat 5
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'src'))
+
+from leadsheets import write_leadsheet
+import generate_chordmelody
+from music21 import converter
+
+def best(f, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def run(sizes, repeat):
+    rows = []
+    parse_file = converter.parseFile
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['PARSE_CACHE'] = os.path.join(tmp, 'cache')
+        for n in sizes:
+            path = write_leadsheet(os.path.join(tmp, f'parse-{n}.mxl'), n, seed=n)
+            read = lambda: generate_chordmelody.read_leadsheet(path, os.path.basename(path), 'music21')
+            converter.parseFile = lambda fp, **kw: parse_file(fp, forceSource=True, storePickle=False)
+            fresh = best(read, repeat)
+            converter.parseFile = parse_file
+            pickled = best(read, repeat)
+            generate_chordmelody.parse_leadsheet(path)
+            cached = best(lambda: generate_chordmelody.parse_leadsheet(path), repeat)
+            rows.append((n, fresh, pickled, cached))
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time parsing synthetic charts with and without the parse cache.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[32, 125, 500], help='chart lengths in measures')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per chart, the best one counts')
+    args = parser.parse_args(argv)
+
+    rows = run(args.sizes, args.repeat)
+    print()
+    print(f'{"measures":>9}{"fresh s":>10}{"music21 s":>11}{"cached s":>10}{"speedup":>9}')
+    for n, fresh, pickled, cached in rows:
+        print(f'{n:>9}{fresh:>10.3f}{pickled:>11.3f}{cached:>10.3f}{fresh / cached:>8.1f}x')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" Preview documents against LilyPond output, from a parsed leadsheet.
+
+Parses synthetic charts of increasing length once, then times
+arrange_leadsheet() writing the .ly file against preview_leadsheet()
+and encoding its document as JSON, the work a preview request does once
+the leadsheet is parsed (or found in PARSE_CACHE). Typesetting comes on
+top of the .ly time and is left out. Also reports the size of the JSON.
+
+    python benchmarks/bench_preview.py
+    python benchmarks/bench_preview.py --sizes 32 500 --repeat 5
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'src'))
+
+from leadsheets import write_leadsheet
+from preview_tools import encode
+import generate_chordmelody
+
+def best(f, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = f()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+def run(sizes, repeat):
+    os.environ['LILYPOND_PATH'] = os.path.join(here, 'fake_lilypond')
+    os.makedirs('data/output', exist_ok=True)
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in sizes:
+            path = write_leadsheet(os.path.join(tmp, f'preview-{n}.mxl'), n, seed=n, form='AABA')
+            leadsheet = generate_chordmelody.parse_leadsheet(path)
+            ly, lilyfile = best(lambda: generate_chordmelody.arrange_leadsheet(
+                leadsheet, output_name='bench-preview', pdf=False), repeat)
+            os.remove(lilyfile)
+            preview, body = best(lambda: encode(generate_chordmelody.preview_leadsheet(leadsheet)), repeat)
+            rows.append((n, ly, preview, len(body)))
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time preview documents against LilyPond output.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[32, 125, 500], help='chart lengths in measures')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per chart, the best one counts')
+    args = parser.parse_args(argv)
+
+    rows = run(args.sizes, args.repeat)
+    print(f'{"measures":>9}{".ly ms":>9}{"json ms":>9}{"speedup":>9}{"json KB":>9}')
+    for n, ly, preview, size in rows:
+        print(f'{n:>9}{1000 * ly:>9.1f}{1000 * preview:>9.1f}{ly / preview:>8.1f}x{size / 1024:>9.1f}')
+
+if __name__ == '__main__':
+    sys.exit(main())
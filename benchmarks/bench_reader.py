@@ -0,0 +1,113 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" The streaming MusicXML reader against converter.parseFile().
+
+First checks conformance: every leadsheet in the fixture corpus is
+arranged from both readers, with both emitters, and has to come out as
+the same .ly text or fail the same way. The corpus is synthetic charts,
+plain and with the extras a notation program exports, compressed and
+not, plus any files given on the command line. Then times both readers on longer charts
+and measures their peak memory. Exits 1 if any arrangement differs.
+
+    python benchmarks/bench_reader.py
+    python benchmarks/bench_reader.py data/*.mxl --sizes 125 500 2000
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'src'))
+
+from leadsheets import write_leadsheet
+import generate_chordmelody
+from music21 import converter
+
+readers = ['music21', 'stream']
+
+def fixture_corpus(tmp):
+    paths = []
+    for k in range(4):
+        paths.append(write_leadsheet(os.path.join(tmp, f'plain-{k}.mxl'), 16, seed=k))
+        paths.append(write_leadsheet(os.path.join(tmp, f'form-{k}.xml'), 32, seed=k, form='AABA'))
+        paths.append(write_leadsheet(os.path.join(tmp, f'extras-{k}.mxl'), 24, seed=k, form='ABAC', extras=True))
+        paths.append(write_leadsheet(os.path.join(tmp, f'extras-{k}.xml'), 16, seed=k + 4, extras=True))
+    return paths
+
+def arrangement(path, reader, emitter, out):
+    # the .ly text, or the error for a leadsheet the arranger rejects
+    name = f'reader-check-{reader}-{emitter}'
+    try:
+        leadsheet = generate_chordmelody.parse_leadsheet(path, reader=reader)
+        lilyfile = generate_chordmelody.arrange_leadsheet(leadsheet, output_name=name, emitter=emitter, pdf=False)
+    except Exception as e:
+        return f'{type(e).__name__}: {e}'
+    with open(lilyfile) as f:
+        text = f.read()
+    shutil.move(lilyfile, os.path.join(out, f'{os.path.basename(path)}-{reader}-{emitter}.ly'))
+    return text
+
+def check(paths, out):
+    """ Files whose arrangements differ between the readers. """
+    failed = []
+    for path in paths:
+        for emitter in ('direct', 'music21'):
+            texts = [arrangement(path, reader, emitter, out) for reader in readers]
+            if texts[0] != texts[1]:
+                failed.append((path, emitter))
+    return failed
+
+def measure(path, reader, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        generate_chordmelody.read_score(path, reader)
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    generate_chordmelody.read_score(path, reader)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return min(times), peak
+
+def run(extra_paths, sizes, repeat):
+    os.environ.pop('PARSE_CACHE', None)
+    os.makedirs('data/output', exist_ok=True)
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        out = os.path.join(tmp, 'out')
+        os.makedirs(out)
+        paths = fixture_corpus(tmp) + list(extra_paths)
+        failed = check(paths, out)
+        for n in sizes:
+            path = write_leadsheet(os.path.join(tmp, f'songbook-{n}.mxl'), n, seed=n, form='AABA', extras=True)
+            rows.append((n,) + measure(path, 'music21', repeat) + measure(path, 'stream', repeat))
+    return len(paths), failed, rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Check the streaming MusicXML reader against music21 and time both.')
+    parser.add_argument('paths', nargs='*', help='more leadsheets to check')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[32, 125, 500], help='chart lengths in measures to time')
+    parser.add_argument('--repeat', type=int, default=3, help='reads per chart, the best one counts')
+    args = parser.parse_args(argv)
+
+    # music21's own per-path pickles would hide its parse time
+    parse_file = converter.parseFile
+    converter.parseFile = lambda fp, **kw: parse_file(fp, forceSource=True, storePickle=False)
+
+    n, failed, rows = run(args.paths, args.sizes, args.repeat)
+    print()
+    for path, emitter in failed:
+        print(f'DIFFERS {path} ({emitter} emitter)')
+    print(f'{n - len(set(p for p, e in failed))} of {n} leadsheets arrange the same from both readers')
+    print()
+    print(f'{"measures":>9}{"music21 s":>11}{"stream s":>10}{"speedup":>9}{"music21 MB":>12}{"stream MB":>11}')
+    for size, t0, m0, t1, m1 in rows:
+        print(f'{size:>9}{t0:>11.3f}{t1:>10.3f}{t0 / t1:>8.1f}x{m0 / 2**20:>12.1f}{m1 / 2**20:>11.1f}')
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,85 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" How arrangement time grows with the length of the chart.
+
+Arranges synthetic leadsheets of increasing length with a stub lilypond
+and prints the time per measure of each stage. Per measure times that
+stay flat from the shortest to the longest chart mean linear scaling.
+
+    python benchmarks/bench_scaling.py
+    python benchmarks/bench_scaling.py --sizes 32 500 --repeat 5
+"""
+import argparse
+import collections
+import os
+import sys
+import tempfile
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'src'))
+
+from leadsheets import write_leadsheet
+import generate_chordmelody
+
+def timed(module, name, totals):
+    # accumulate the time spent in module.name under totals[name]
+    f = getattr(module, name)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return f(*args, **kwargs)
+        finally:
+            totals[name] += time.perf_counter() - start
+    setattr(module, name, wrapper)
+
+def run(sizes, repeat):
+    os.environ['LILYPOND_PATH'] = os.path.join(here, 'fake_lilypond')
+    os.makedirs('data/output', exist_ok=True)
+    totals = collections.Counter()
+    for name in ('melody_lines', 'chord_lines', 'fretboard_tables', 'tab_positions'):
+        timed(generate_chordmelody, name, totals)
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in sizes:
+            path = write_leadsheet(os.path.join(tmp, f'bench-{n}.mxl'), n, seed=n)
+            start = time.perf_counter()
+            leadsheet = generate_chordmelody.parse_leadsheet(path)
+            parse = time.perf_counter() - start
+
+            totals.clear()
+            start = time.perf_counter()
+            for _ in range(repeat):
+                lilyfile = generate_chordmelody.arrange_leadsheet(leadsheet, output_name=f'bench-{n}')
+            arrange = (time.perf_counter() - start) / repeat
+            stages = {k: v / repeat for k, v in totals.items()}
+            rows.append((n, parse, arrange, stages))
+            for f in (lilyfile, lilyfile.replace('.ly', '.pdf')):
+                if os.path.exists(f):
+                    os.remove(f)
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time arrangements of synthetic charts of increasing length.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[32, 125, 500, 2000], help='chart lengths in measures')
+    parser.add_argument('--repeat', type=int, default=3, help='arrangements timed per chart')
+    args = parser.parse_args(argv)
+
+    rows = run(args.sizes, args.repeat)
+    columns = ['parse', 'arrange', 'melody_lines', 'chord_lines', 'fretboard_tables', 'tab_positions']
+    print()
+    print('microseconds per measure')
+    print(f'{"measures":>9}' + ''.join(f'{c:>18}' for c in columns))
+    for n, parse, arrange, stages in rows:
+        values = [parse, arrange] + [stages.get(c, 0.0) for c in columns[2:]]
+        print(f'{n:>9}' + ''.join(f'{1e6 * v / n:>18.1f}' for v in values))
+
+    # growth of the per measure arrangement time from the shortest chart
+    # to the longest one; 1.0 is perfectly linear
+    first, last = rows[0], rows[-1]
+    growth = (last[2] / last[0]) / (first[2] / first[0])
+    print(f'\nper measure arrangement time grows {growth:.2f}x from {first[0]} to {last[0]} measures')
+
+if __name__ == "__main__":
+    sys.exit(main())
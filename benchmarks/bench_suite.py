@@ -0,0 +1,154 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" End-to-end and per-stage timing of generate_arrangement() over a set
+of synthetic leadsheets, against a stored baseline.
+
+Every scenario is a chart from leadsheets.py with its own length, chord
+density, chord quality mix and melody range, arranged with the stub
+lilypond so nothing is typeset for real. Each one is arranged --repeat
+times from the file, and the median end-to-end and per-stage times go
+to a JSON results file. With --baseline, the results are compared to an
+earlier results file from the same machine, and the script exits 1 when
+a scenario or a stage got slower by more than --tolerance.
+
+    python benchmarks/bench_suite.py --output bench-results.json
+    python benchmarks/bench_suite.py --baseline bench-results.json --output new.json
+    python benchmarks/bench_suite.py --scenarios standard jazz --repeat 9
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'src'))
+
+from leadsheets import write_leadsheet
+from metrics_tools import Metrics
+import generate_chordmelody
+
+jazz_mix = {'plain': 5, 'slash': 2, 'add': 1, 'altered': 2, 'nc': 1}
+
+# name: (leadsheet options, arrangement options)
+scenarios = {
+    'standard': (dict(measures=32, form='AABA'), {}),
+    'sparse': (dict(measures=64, chords_per_measure=1), {}),
+    'dense': (dict(measures=64, chords_per_measure=4), {}),
+    'jazz': (dict(measures=64, form='AABA', qualities=jazz_mix), {}),
+    'wide-melody': (dict(measures=64, melody_range=(48, 88)), dict(notation='standard')),
+    'drop3': (dict(measures=64, qualities=jazz_mix), dict(drop_type='drop3')),
+    'music21-emitter': (dict(measures=64, qualities=jazz_mix), dict(emitter='music21')),
+    'long': (dict(measures=500, form='AABA', qualities=jazz_mix), {}),
+}
+
+def arrange(path, options):
+    # time the voicing search, not the voicings memoized by an earlier run
+    generate_chordmelody.voicing_cache.clear()
+    metrics = Metrics(os.path.basename(path))
+    start = time.perf_counter()
+    lilyfile = generate_chordmelody.generate_arrangement(path, output_name='bench-suite', metrics=metrics, **options)
+    seconds = time.perf_counter() - start
+    for f in (lilyfile, lilyfile.replace('.ly', '.pdf')):
+        if os.path.exists(f):
+            os.remove(f)
+    return seconds, metrics
+
+def run_scenario(tmp, name, repeat):
+    chart, options = scenarios[name]
+    chart = dict(chart)
+    path = write_leadsheet(os.path.join(tmp, f'{name}.mxl'), chart.pop('measures'), seed=1, **chart)
+    runs = [arrange(path, options) for _ in range(repeat)]
+    stages = {}
+    for seconds, metrics in runs:
+        for stage, entry in metrics.stages.items():
+            stages.setdefault(stage, []).append(entry['seconds'])
+    return {
+        'chart': dict(scenarios[name][0]),
+        'options': options,
+        'seconds': statistics.median(seconds for seconds, metrics in runs),
+        'stages': {stage: statistics.median(times) for stage, times in stages.items()},
+        'counts': runs[-1][1].counts,
+    }
+
+def run(names, repeat):
+    # cached output or parses would hide the work being measured
+    for name in ('OUTPUT_CACHE', 'PARSE_CACHE', 'VOICING_CACHE', 'METRICS_LOG', 'METRICS_MEMORY', 'PROFILE_DIR'):
+        os.environ.pop(name, None)
+    os.environ['LILYPOND_PATH'] = os.path.join(here, 'fake_lilypond')
+    os.makedirs('data/output', exist_ok=True)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        # import music21 and start the converter outside the timings
+        arrange(write_leadsheet(os.path.join(tmp, 'warm-up.mxl'), 4), {'emitter': 'music21'})
+        for name in names:
+            results[name] = run_scenario(tmp, name, repeat)
+            print(f'{name:>16}{results[name]["seconds"]:>10.3f} s', flush=True)
+    return {
+        'python': platform.python_version(),
+        'music21': generate_chordmelody.music21_version(),
+        'machine': platform.node(),
+        'repeat': repeat,
+        'scenarios': results,
+    }
+
+def compare(results, baseline, tolerance, min_seconds):
+    """ (scenario, stage, baseline seconds, seconds) for everything that
+    got slower by more than tolerance, and by at least min_seconds.
+    The end-to-end time has stage None.
+    """
+    slower = []
+    for name, r in results['scenarios'].items():
+        b = baseline.get('scenarios', {}).get(name)
+        if b is None:
+            continue
+        pairs = [(None, b['seconds'], r['seconds'])]
+        pairs += [(stage, b['stages'][stage], t) for stage, t in r['stages'].items() if stage in b['stages']]
+        for stage, before, after in pairs:
+            if after > before * (1 + tolerance) and after - before >= min_seconds:
+                slower.append((name, stage, before, after))
+    return slower
+
+def print_comparison(results, baseline):
+    print(f'\n{"scenario":>16}{"stage":>20}{"baseline s":>12}{"now s":>10}{"change":>9}')
+    for name, r in results['scenarios'].items():
+        b = baseline.get('scenarios', {}).get(name)
+        if b is None:
+            print(f'{name:>16}{"(new)":>20}{"":>12}{r["seconds"]:>10.3f}')
+            continue
+        rows = [('total', b['seconds'], r['seconds'])]
+        rows += [(stage, b['stages'][stage], t) for stage, t in r['stages'].items() if stage in b['stages']]
+        for stage, before, after in rows:
+            change = f'{100 * (after - before) / before:+.0f}%' if before else ''
+            print(f'{name:>16}{stage:>20}{before:>12.4f}{after:>10.4f}{change:>9}')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time generate_arrangement() over synthetic leadsheets.')
+    parser.add_argument('--scenarios', nargs='+', choices=list(scenarios), default=list(scenarios))
+    parser.add_argument('--repeat', type=int, default=5, help='arrangements per scenario, the median counts')
+    parser.add_argument('--output', default='bench-results.json', help='where to write the results')
+    parser.add_argument('--baseline', help='earlier results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown, as a fraction')
+    parser.add_argument('--min-ms', type=float, default=5, help='ignore slowdowns smaller than this')
+    args = parser.parse_args(argv)
+
+    results = run(args.scenarios, args.repeat)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print(f'results written to {args.output}')
+    if args.baseline is None:
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    print_comparison(results, baseline)
+    slower = compare(results, baseline, args.tolerance, args.min_ms / 1000)
+    for name, stage, before, after in slower:
+        print(f'REGRESSION {name} {stage or "total"}: {before:.4f} s -> {after:.4f} s')
+    return 1 if slower else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,63 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" LilyPond wall time by batch size.
+
+Arranges synthetic charts without typesetting them, then typesets all
+of them with a real lilypond at several batch sizes, one lilypond run
+per batch. Larger batches pay lilypond's startup fewer times.
+
+    python benchmarks/bench_typeset.py --lilypond /usr/bin/lilypond
+    python benchmarks/bench_typeset.py --tunes 8 --batch-sizes 1 4 8 -j 2
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'src'))
+
+from leadsheets import write_leadsheet
+from bench_fret_tables import default_lilypond
+import generate_chordmelody
+import typeset_tools
+
+def run(lilypond, tunes, measures, batch_sizes, concurrency):
+    os.makedirs('data/output', exist_ok=True)
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        lilyfiles = []
+        for k in range(tunes):
+            path = write_leadsheet(os.path.join(tmp, f'typeset-{k}.mxl'), measures, seed=k, form='AABA')
+            lilyfile = generate_chordmelody.generate_arrangement(path, output_name=f'typeset-{k}', pdf=False)
+            lilyfiles.append(os.path.join(tmp, os.path.basename(lilyfile)))
+            os.replace(lilyfile, lilyfiles[-1])
+
+        os.environ['LILYPOND_PATH'] = lilypond
+        for size in batch_sizes:
+            with typeset_tools.Typesetter(concurrency=concurrency, batch_size=size) as typesetter:
+                start = time.perf_counter()
+                results = typesetter.typeset_all(lilyfiles)
+                elapsed = time.perf_counter() - start
+            failed = sum(r.error is not None for r in results)
+            rows.append((size, elapsed, failed))
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time LilyPond on a set of charts at several batch sizes.')
+    parser.add_argument('--lilypond', default=default_lilypond(), help='lilypond binary to time')
+    parser.add_argument('--tunes', type=int, default=8, help='charts to typeset')
+    parser.add_argument('--measures', type=int, default=32, help='chart length in measures')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4, 8], help='files per lilypond run')
+    parser.add_argument('-j', '--concurrency', type=int, default=1, help='lilypond processes at once')
+    args = parser.parse_args(argv)
+
+    rows = run(args.lilypond, args.tunes, args.measures, args.batch_sizes, args.concurrency)
+    print()
+    print(f'{"batch size":>11}{"total s":>10}{"s per tune":>12}{"failed":>8}')
+    for size, elapsed, failed in rows:
+        print(f'{size:>11}{elapsed:>10.2f}{elapsed / args.tunes:>12.2f}{failed:>8}')
+
+if __name__ == '__main__':
+    main()
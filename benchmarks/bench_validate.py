@@ -0,0 +1,73 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" Validating a leadsheet against parsing and arranging it.
+
+Times validate_leadsheet() on synthetic charts of increasing length
+against parse_leadsheet() alone and against a whole generate_arrangement()
+without typesetting, which is what a worker spends on a job that turns
+out to fail. Also shows the estimate validate_leadsheet() makes of that
+time.
+
+    python benchmarks/bench_validate.py
+    python benchmarks/bench_validate.py --sizes 32 500 --repeat 5
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'src'))
+
+from leadsheets import write_leadsheet
+from validate_tools import validate_leadsheet
+import generate_chordmelody
+
+def best(f, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = f()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+def arrange(path):
+    generate_chordmelody.voicing_cache.clear()
+    lilyfile = generate_chordmelody.generate_arrangement(path, output_name='bench-validate', pdf=False)
+    os.remove(lilyfile)
+
+def run(sizes, repeat):
+    # a cache would answer the parses
+    for name in ('OUTPUT_CACHE', 'PARSE_CACHE'):
+        os.environ.pop(name, None)
+    os.environ['LILYPOND_PATH'] = os.path.join(here, 'fake_lilypond')
+    os.makedirs('data/output', exist_ok=True)
+    mix = {'plain': 5, 'slash': 2, 'add': 1, 'altered': 2}
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in sizes:
+            path = write_leadsheet(os.path.join(tmp, f'validate-{n}.mxl'), n, seed=n, qualities=mix)
+            validate, report = best(lambda: validate_leadsheet(path), repeat)
+            parse, leadsheet = best(lambda: generate_chordmelody.parse_leadsheet(path), repeat)
+            arrangement, lilyfile = best(lambda: arrange(path), repeat)
+            rows.append((n, validate, parse, arrangement, report['estimated_seconds']))
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time validating leadsheets against parsing and arranging them.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[32, 125, 500], help='chart lengths in measures')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per chart, the best one counts')
+    args = parser.parse_args(argv)
+
+    rows = run(args.sizes, args.repeat)
+    print(f'{"measures":>9}{"validate ms":>13}{"parse ms":>10}{"arrange ms":>12}{"estimate ms":>13}')
+    for n, validate, parse, arrangement, estimate in rows:
+        print(f'{n:>9}{1000 * validate:>13.1f}{1000 * parse:>10.1f}{1000 * arrangement:>12.1f}'
+              f'{1000 * estimate:>13.0f}')
+
+if __name__ == '__main__':
+    sys.exit(main())
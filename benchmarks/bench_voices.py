@@ -0,0 +1,86 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" Time and peak memory of the music21 emitter's voice building.
+
+Arranges synthetic charts of increasing length with emitter='music21'
+and measures lilypond_content_from_streams(), which builds the melody,
+chord symbol and drop voicing voices, realizes the chord durations and
+runs them through music21's LilypondConverter. Building the voices and
+realizing their durations is reported on its own as well.
+
+    python benchmarks/bench_voices.py
+    python benchmarks/bench_voices.py --sizes 32 500 --repeat 5
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'src'))
+
+from leadsheets import write_leadsheet
+from metrics_tools import Metrics, measure_job
+import generate_chordmelody
+
+def measured(f, result):
+    # time f, and trace its peak memory when result has a 'peak' key
+    def wrapper(*args, **kwargs):
+        tracing = 'peak' in result
+        if tracing:
+            tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            return f(*args, **kwargs)
+        finally:
+            result['seconds'] = time.perf_counter() - start
+            if tracing:
+                result['peak'] = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+    return wrapper
+
+def arrange(leadsheet, result):
+    metrics = Metrics()
+    with measure_job('bench-voices', metrics):
+        lilyfile = generate_chordmelody.arrange_leadsheet(leadsheet, output_name='bench-voices',
+                                                          emitter='music21', pdf=False)
+    os.remove(lilyfile)
+    # durations used to be realized in a stage of their own
+    stages = ('voices', 'realize_durations')
+    return result['seconds'], sum(metrics.stages[s]['seconds'] for s in stages if s in metrics.stages)
+
+def run(sizes, repeat):
+    os.environ['LILYPOND_PATH'] = os.path.join(here, 'fake_lilypond')
+    os.environ.pop('PARSE_CACHE', None)
+    os.makedirs('data/output', exist_ok=True)
+    fallback = generate_chordmelody.lilypond_content_from_streams
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in sizes:
+            path = write_leadsheet(os.path.join(tmp, f'bench-{n}.mxl'), n, seed=n, form='AABA')
+            leadsheet = generate_chordmelody.parse_leadsheet(path)
+            result = {}
+            generate_chordmelody.lilypond_content_from_streams = measured(fallback, result)
+            times = [arrange(leadsheet, result) for _ in range(repeat)]
+            result['peak'] = 0
+            arrange(leadsheet, result)
+            generate_chordmelody.lilypond_content_from_streams = fallback
+            rows.append((n, min(t for t, v in times), min(v for t, v in times), result['peak']))
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time the music21 emitter\'s voice building.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[32, 125, 500], help='chart lengths in measures')
+    parser.add_argument('--repeat', type=int, default=3, help='arrangements per chart, the best one counts')
+    args = parser.parse_args(argv)
+
+    rows = run(args.sizes, args.repeat)
+    print()
+    print(f'{"measures":>9}{"emitter s":>11}{"voices s":>10}{"peak MB":>9}')
+    for n, seconds, voices, peak in rows:
+        print(f'{n:>9}{seconds:>11.3f}{voices:>10.3f}{peak / 2**20:>9.1f}')
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,172 @@
+""" Synthetic MusicXML leadsheets for benchmarks: a melody with a chord
+symbol on every half measure, system breaks every four measures and
+an occasional rest on a chord change. Charts can follow a song form
+such as AABA, where every section with the same letter repeats. With
+extras, charts also carry what a notation program exports around the
+leadsheet: credits, page defaults, lyrics, directions, repeat barlines
+and a bass part in a part group.
+
+The number of chords per measure, the mix of chord qualities and the
+range of the melody can be set as well. A quality mix weighs the
+groups in chord_groups, e.g. {'plain': 6, 'slash': 1, 'altered': 1}.
+"""
+import random
+import zipfile
+
+steps = ['C', 'D', 'E', 'F', 'G', 'A', 'B']
+kinds = ['major', 'minor', 'dominant', 'major-seventh', 'minor-seventh', 'half-diminished',
+         'diminished-seventh', 'dominant-ninth', 'major-sixth', 'minor-sixth', 'suspended-fourth']
+spellings = [('C', 0), ('C', 1), ('D', 0), ('E', -1), ('E', 0), ('F', 0),
+             ('F', 1), ('G', 0), ('A', -1), ('A', 0), ('B', -1), ('B', 0)]
+note_types = {1: 'eighth', 2: 'quarter', 4: 'half'}
+
+# chord qualities a quality mix chooses from
+chord_groups = ['plain', 'slash', 'add', 'altered', 'nc']
+added_degrees = [('9', 0), ('9', 0), ('11', 1), ('6', 0)]
+altered_degrees = [('9', -1), ('9', 1), ('5', 1), ('5', -1), ('11', 1), ('13', -1)]
+
+def degree_xml(value, alter, kind):
+    return (f'<degree><degree-value>{value}</degree-value><degree-alter>{alter}</degree-alter>'
+            f'<degree-type>{kind}</degree-type></degree>')
+
+def mixed_harmony_xml(rng, qualities):
+    # a chord symbol from the group drawn by the weights in qualities
+    groups = [g for g in chord_groups if qualities.get(g)]
+    group = rng.choices(groups, [qualities[g] for g in groups])[0]
+    if group == 'nc':
+        return '<harmony><root><root-step>C</root-step></root><kind text="N.C.">none</kind></harmony>'
+    alter = rng.choice([0, 0, 0, -1, 1])
+    root = f'<root><root-step>{rng.choice(steps)}</root-step>' + \
+           (f'<root-alter>{alter}</root-alter>' if alter else '') + '</root>'
+    if group == 'altered':
+        value, degree_alter = rng.choice(altered_degrees)
+        return f'<harmony>{root}<kind>dominant</kind>{degree_xml(value, degree_alter, "alter" if value == "5" else "add")}</harmony>'
+    kind = rng.choice(kinds)
+    if group == 'add':
+        value, degree_alter = rng.choice(added_degrees)
+        return f'<harmony>{root}<kind>{kind}</kind>{degree_xml(value, degree_alter, "add")}</harmony>'
+    bass = f'<bass><bass-step>{rng.choice(steps)}</bass-step></bass>' if group == 'slash' else ''
+    return f'<harmony>{root}<kind>{kind}</kind>{bass}</harmony>'
+
+def harmony_xml(rng, qualities=None):
+    if qualities is not None:
+        return mixed_harmony_xml(rng, qualities)
+    alter = rng.choice([0, 0, 0, -1, 1])
+    root = f'<root><root-step>{rng.choice(steps)}</root-step>' + \
+           (f'<root-alter>{alter}</root-alter>' if alter else '') + '</root>'
+    bass = f'<bass><bass-step>{rng.choice(steps)}</bass-step></bass>' if rng.random() < 0.1 else ''
+    return f'<harmony>{root}<kind>{rng.choice(kinds)}</kind>{bass}</harmony>'
+
+def note_xml(rng, length, rest=False, lyric=None, melody_range=None):
+    if rest:
+        return f'<note><rest/><duration>{length}</duration><type>{note_types[length]}</type></note>'
+    if melody_range is None:
+        step, alter = spellings[rng.randint(0, 11)]
+        octave = rng.choice([4, 4, 5])
+    else:
+        midi = rng.randint(*melody_range)
+        step, alter = spellings[midi % 12]
+        octave = midi // 12 - 1
+    lyric = f'<lyric number="1"><syllabic>single</syllabic><text>{lyric}</text></lyric>' if lyric else ''
+    return (f'<note><pitch><step>{step}</step>' + (f'<alter>{alter}</alter>' if alter else '') +
+            f'<octave>{octave}</octave></pitch><duration>{length}</duration><type>{note_types[length]}</type>'
+            f'{lyric}</note>')
+
+def direction_xml(m):
+    words = f'<direction-type><words>Section {m // 8 + 1}</words></direction-type>' if m % 8 == 1 else ''
+    return (f'<direction placement="above">{words}<direction-type><dynamics><mf/></dynamics></direction-type>'
+            f'<sound tempo="{100 + m % 40}" dynamics="80"/></direction>')
+
+def bass_part_xml(measures, rng):
+    out = ['<part id="P2">']
+    for m in range(1, measures + 1):
+        out.append(f'<measure number="{m}">')
+        if m == 1:
+            out.append('<attributes><divisions>2</divisions><key><fifths>0</fifths></key>'
+                       '<time><beats>4</beats><beat-type>4</beat-type></time>'
+                       '<clef><sign>F</sign><line>4</line></clef></attributes>')
+        step = rng.choice(steps)
+        out.append(f'<note><pitch><step>{step}</step><octave>2</octave></pitch>'
+                   f'<duration>8</duration><type>whole</type></note>')
+        out.append('</measure>')
+    out.append('</part>')
+    return out
+
+def leadsheet_xml(measures, seed=0, form=None, section_length=8, extras=False,
+                  chords_per_measure=2, qualities=None, melody_range=None):
+    """ MusicXML text for a 4/4 leadsheet with the given number of measures.
+    With a form such as 'AABA', sections of section_length measures repeat.
+    chords_per_measure is 1, 2 or 4. qualities weighs the chord_groups;
+    by default chords are plain with an occasional bass note. melody_range
+    is the lowest and highest MIDI pitch of the melody.
+    """
+    # a chord every `every` eighths, and notes do not cross a chord change
+    every = 8 // chords_per_measure
+    span = min(every, 4)
+    rng = random.Random(seed)
+    out = ['<?xml version="1.0" encoding="UTF-8"?>',
+           '<score-partwise version="3.1">',
+           f'<work><work-title>Benchmark {measures}</work-title></work>',
+           '<identification><creator type="composer">Synthetic</creator></identification>']
+    if extras:
+        out += ['<defaults><scaling><millimeters>7</millimeters><tenths>40</tenths></scaling></defaults>',
+                f'<credit page="1"><credit-words justify="center">Benchmark {measures}</credit-words></credit>',
+                '<part-list><part-group type="start" number="1"><group-symbol>bracket</group-symbol></part-group>',
+                '<score-part id="P1"><part-name>Lead</part-name></score-part>',
+                '<score-part id="P2"><part-name>Bass</part-name></score-part>',
+                '<part-group type="stop" number="1"/></part-list>']
+    else:
+        out.append('<part-list><score-part id="P1"><part-name>Lead</part-name></score-part></part-list>')
+    out.append('<part id="P1">')
+    for m in range(1, measures + 1):
+        out.append(f'<measure number="{m}">')
+        if extras and m % section_length == 1 and m > 1:
+            out.append('<barline location="left"><bar-style>heavy-light</bar-style>'
+                       '<repeat direction="forward"/></barline>')
+        if m == 1:
+            out.append('<attributes><divisions>2</divisions><key><fifths>0</fifths></key>'
+                       '<time><beats>4</beats><beat-type>4</beat-type></time>'
+                       '<clef><sign>G</sign><line>2</line></clef></attributes>')
+        elif m % 4 == 1:
+            out.append('<print new-system="yes"/>')
+        if extras:
+            out.append(direction_xml(m))
+        if form is not None:
+            # the same section letter and bar within it give the same bar
+            section = form[(m - 1) // section_length % len(form)]
+            rng = random.Random(f'{seed}-{section}-{(m - 1) % section_length}')
+        pos = 0
+        while pos < 8:
+            length = min(rng.choice([1, 2, 2, 4]), span - pos % span)
+            if length == 3:
+                length = 2
+            if pos % every == 0:
+                out.append(harmony_xml(rng, qualities))
+            rest = pos % every == 0 and m > 1 and rng.random() < 0.05
+            out.append(note_xml(rng, length, rest, f'la{pos}' if extras else None, melody_range))
+            pos += length
+        if extras and m % section_length == 0:
+            out.append('<barline location="right"><bar-style>light-heavy</bar-style>'
+                       '<repeat direction="backward"/></barline>')
+        out.append('</measure>')
+    out.append('</part>')
+    if extras:
+        out += bass_part_xml(measures, random.Random(f'{seed}-bass'))
+    out.append('</score-partwise>')
+    return '\n'.join(out)
+
+def write_leadsheet(path, measures, seed=0, form=None, extras=False, **options):
+    """ Write a leadsheet to path, compressed unless path ends in .xml.
+    options go to leadsheet_xml().
+    """
+    text = leadsheet_xml(measures, seed, form, extras=extras, **options)
+    if path.endswith('.xml'):
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+    with zipfile.ZipFile(path, 'w') as z:
+        z.writestr('META-INF/container.xml',
+                   '<?xml version="1.0" encoding="UTF-8"?><container><rootfiles>'
+                   '<rootfile full-path="score.xml"/></rootfiles></container>')
+        z.writestr('score.xml', text)
+    return path
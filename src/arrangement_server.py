@@ -0,0 +1,314 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" Resident arrangement server.
+
+Keeps a pool of worker processes that have already imported music21 and
+set up the lilypond environment, so a request only pays for the
+arrangement itself. With JOB_MEMORY_MB set, a job that goes over that
+budget is answered with 413 and its worker carries on.
+
+    POST /arrange?drop_type=drop3&format=pdf   body: the .mxl leadsheet
+    POST /arrange?format=json                  chord and melody placements only
+    POST /validate?drop_type=drop3             validate_leadsheet() report as JSON
+    GET  /health                               liveness and metrics as JSON
+"""
+from generate_chordmelody import generate_arrangement, generate_preview, _warm_worker
+from metrics_tools import MemoryBudgetExceeded
+from music21_tools import AnacrusisException
+from preview_tools import optional_msgpack, preview_formats
+from typeset_tools import TypesetError, TypesetTimeout, pdf_path
+from concurrent import futures
+from concurrent.futures.process import BrokenProcessPool
+from http import server
+from urllib import parse
+import argparse
+import collections
+import json
+import os
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+option_types = {
+    'minimum_fret': int,
+    'maximum_fret': int,
+    'maj_triad': str,
+    'min_triad': str,
+    'notation': str,
+    'orientation': str,
+    'interval_names': str,
+    'drop_type': str,
+    'emitter': str,
+}
+
+content_types = {
+    'ly': 'text/x-lilypond; charset=utf-8',
+    'pdf': 'application/pdf',
+    **preview_formats,
+}
+
+class QueueFull(Exception):
+    pass
+
+def _run_job(data, filename, options, fmt):
+    """ Runs inside a worker: arrange the uploaded leadsheet and return the
+    requested artifact as bytes. Previews come back without touching
+    LilyPond.
+    """
+    # the upload keeps its name, which untitled leadsheets are titled
+    # with; the outputs are named apart from other jobs'
+    with tempfile.TemporaryDirectory() as tmp:
+        filepath = os.path.join(tmp, os.path.basename(filename))
+        with open(filepath, 'wb') as f:
+            f.write(data)
+        start = time.perf_counter()
+        if fmt in preview_formats:
+            return generate_preview(filepath, fmt, **options), time.perf_counter() - start
+        lilyfile = generate_arrangement(filepath, output_name=uuid.uuid4().hex, pdf=fmt == 'pdf', **options)
+        elapsed = time.perf_counter() - start
+
+    outputs = [lilyfile, pdf_path(lilyfile)]
+    try:
+        with open(outputs[0] if fmt == 'ly' else outputs[1], 'rb') as f:
+            return f.read(), elapsed
+    finally:
+        for o in outputs:
+            if os.path.exists(o):
+                os.remove(o)
+
+def _validate(data, filename, options):
+    """ The validate_leadsheet() report on an upload, as JSON. It reads
+    the file with ElementTree and imports no music21, so it runs on the
+    request thread, ahead of the queue.
+    """
+    from validate_tools import validate_leadsheet
+    with tempfile.TemporaryDirectory() as tmp:
+        filepath = os.path.join(tmp, os.path.basename(filename))
+        with open(filepath, 'wb') as f:
+            f.write(data)
+        return json.dumps(validate_leadsheet(filepath, **options)).encode()
+
+class ArrangementService:
+    """ Admission control and metrics in front of the worker pool.
+
+    At most `concurrency` jobs run at once, and up to `queue_size` more
+    wait for a worker. Anything beyond that is rejected with QueueFull.
+    When a worker dies, the jobs it took down fail with BrokenProcessPool
+    and the pool is replaced before the next job.
+    """
+
+    def __init__(self, concurrency=None, queue_size=16):
+        self.concurrency = concurrency or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.pool = self.new_pool()
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.pending = 0
+        self.counts = collections.Counter()
+        self.latencies = collections.deque(maxlen=1000)
+        self.work_times = collections.deque(maxlen=1000)
+
+    def new_pool(self):
+        return futures.ProcessPoolExecutor(max_workers=self.concurrency, initializer=_warm_worker)
+
+    def pool_broken(self):
+        # the executor sets _broken once one of its workers dies
+        return bool(getattr(self.pool, '_broken', False))
+
+    def current_pool(self):
+        """ The worker pool, replaced first if a worker died. """
+        with self.lock:
+            if self.pool_broken():
+                self.pool.shutdown(wait=False)
+                self.pool = self.new_pool()
+                self.counts['worker_restarts'] += 1
+            return self.pool
+
+    def warm_up(self):
+        # start every worker now instead of on the first requests
+        for f in [self.pool.submit(time.sleep, 0.1) for _ in range(self.concurrency)]:
+            f.result()
+
+    def submit(self, data, filename, options, fmt='ly'):
+        with self.lock:
+            if self.pending >= self.concurrency + self.queue_size:
+                self.counts['rejected'] += 1
+                raise QueueFull
+            self.pending += 1
+
+        start = time.perf_counter()
+        try:
+            body, elapsed = self.current_pool().submit(_run_job, data, filename, options, fmt).result()
+        except Exception as e:
+            with self.lock:
+                self.counts['failed'] += 1
+                if isinstance(e, MemoryBudgetExceeded):
+                    self.counts['over_budget'] += 1
+            if isinstance(e, BrokenProcessPool):
+                self.current_pool()
+            raise
+        finally:
+            with self.lock:
+                self.pending -= 1
+
+        with self.lock:
+            self.counts['completed'] += 1
+            self.latencies.append(time.perf_counter() - start)
+            self.work_times.append(elapsed)
+        return body
+
+    def metrics(self):
+        with self.lock:
+            return {
+                'status': 'degraded' if self.pool_broken() else 'ok',
+                'uptime_s': round(time.time() - self.started, 3),
+                'concurrency': self.concurrency,
+                'queue_size': self.queue_size,
+                'running': min(self.pending, self.concurrency),
+                'queued': max(self.pending - self.concurrency, 0),
+                'completed': self.counts['completed'],
+                'failed': self.counts['failed'],
+                'over_budget': self.counts['over_budget'],
+                'rejected': self.counts['rejected'],
+                'worker_restarts': self.counts['worker_restarts'],
+                'latency_ms': _percentiles(self.latencies),
+                'arrangement_ms': _percentiles(self.work_times),
+            }
+
+    def close(self):
+        self.pool.shutdown()
+
+def _percentiles(values):
+    values = sorted(values)
+    if not values:
+        return {}
+    pick = lambda q: round(1000 * values[min(len(values) - 1, int(q * len(values)))], 2)
+    return {'p50': pick(0.5), 'p95': pick(0.95), 'p99': pick(0.99)}
+
+def parse_options(query):
+    options = {}
+    for k, v in parse.parse_qsl(query):
+        if k in ('format', 'filename'):
+            continue
+        if k not in option_types:
+            raise ValueError(f'unknown option {k}')
+        options[k] = option_types[k](v)
+    return options
+
+class ArrangementHandler(server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        path = parse.urlsplit(self.path).path
+        if path in ('/health', '/metrics'):
+            self._send(200, json.dumps(self.server.service.metrics()).encode(), 'application/json')
+        else:
+            self._send(404, b'not found\n')
+
+    def do_POST(self):
+        url = parse.urlsplit(self.path)
+        if url.path == '/validate':
+            return self._validate(url)
+        if url.path != '/arrange':
+            return self._send(404, b'not found\n')
+
+        query = dict(parse.parse_qsl(url.query))
+        fmt = query.get('format', 'ly')
+        filename = query.get('filename', 'leadsheet.mxl')
+        try:
+            options = parse_options(url.query)
+            if fmt not in content_types:
+                raise ValueError(f'unknown format {fmt}')
+            if fmt == 'msgpack' and optional_msgpack() is None:
+                raise ValueError('msgpack is not installed')
+        except ValueError as e:
+            return self._send(400, f'{e}\n'.encode())
+
+        data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        try:
+            body = self.server.service.submit(data, filename, options, fmt)
+        except QueueFull:
+            return self._send(503, b'arrangement queue is full\n')
+        except AnacrusisException:
+            return self._send(422, b'pickup measures are not supported\n')
+        except MemoryBudgetExceeded as e:
+            return self._send(413, f'{e}\n'.encode())
+        except BrokenProcessPool:
+            return self._send(503, b'an arrangement worker died, try again\n')
+        except TypesetTimeout as e:
+            return self._send(504, f'{e}\n'.encode())
+        except TypesetError as e:
+            return self._send(500, f'{e}\n{e.stderr}'.encode())
+        except FileNotFoundError:
+            return self._send(500, b'typesetting produced no output\n')
+        except Exception as e:
+            return self._send(500, f'{type(e).__name__}: {e}\n'.encode())
+        self._send(200, body, content_types[fmt])
+
+    def _validate(self, url):
+        filename = dict(parse.parse_qsl(url.query)).get('filename', 'leadsheet.mxl')
+        data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        try:
+            body = _validate(data, filename, parse_options(url.query))
+        except ValueError as e:
+            return self._send(400, f'{e}\n'.encode())
+        self._send(200, body, 'application/json')
+
+    def _send(self, status, body, content_type='text/plain; charset=utf-8'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # unix socket clients have no address
+        return self.client_address[0] if self.client_address else 'unix'
+
+class ArrangementHTTPServer(server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, service):
+        self.service = service
+        super().__init__(address, ArrangementHandler)
+
+class ArrangementUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, service):
+        self.service = service
+        if os.path.exists(path):
+            os.remove(path)
+        super().__init__(path, ArrangementHandler)
+
+def serve(host='127.0.0.1', port=8321, socket_path=None, concurrency=None, queue_size=16):
+    service = ArrangementService(concurrency, queue_size)
+    service.warm_up()
+    if socket_path is not None:
+        httpd = ArrangementUnixServer(socket_path, service)
+        print(f'serving on unix:{socket_path} with {service.concurrency} workers')
+    else:
+        httpd = ArrangementHTTPServer((host, port), service)
+        print(f'serving on http://{host}:{port} with {service.concurrency} workers')
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        service.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve chord-melody arrangements from a pool of warm workers.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8321)
+    parser.add_argument('--socket', dest='socket_path', default=None, help='listen on a unix socket instead')
+    parser.add_argument('-j', '--concurrency', type=int, default=None, help='worker processes (default: one per core)')
+    parser.add_argument('--queue-size', type=int, default=16, help='jobs allowed to wait for a worker')
+    args = parser.parse_args(argv)
+    serve(**vars(args))
+
+if __name__ == "__main__":
+    sys.exit(main())
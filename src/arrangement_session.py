@@ -0,0 +1,385 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" Arranging a leadsheet again after an edit, redoing only what changed.
+
+An ArrangementSession keeps what the last arrangement of one document was
+made of: the score with the parser state at every measure, the voicing
+and placement of every chord, and the LilyPond lines of every measure.
+Given the edited file, it compares it with the last version measure by
+measure, reparses the measures that changed, places the chords again from
+the first changed one until the placements run into the ones from last
+time, and writes the LilyPond lines of the measures that are affected.
+The .ly file comes out as generate_arrangement() would write it.
+
+    session = ArrangementSession(drop_type='drop3', pdf=False)
+    session.arrange('data/input/tune.mxl')
+    # ... the tune is edited ...
+    session.arrange('data/input/tune.mxl')
+
+Edits that cannot be spliced in arrange the whole leadsheet again: a
+changed header or file name, measures added or removed, a measure whose
+length, time signature or other attributes change what the measures after
+it are read as, and slurs or other spanners in a changed measure. So do
+leadsheets the streaming reader or the direct emitter do not handle.
+"""
+from generate_chordmelody import *
+from musicxml_tools import ReadRecord, ReaderUnsupported, measure_texts, read_musicxml, reparse_measure, state_key
+
+class ArrangementSession:
+    """ The last arrangement of one leadsheet document, for arranging it
+    again after an edit. options are arrange_leadsheet()'s and hold for
+    the whole session.
+    """
+
+    def __init__(self, **options):
+        bound = inspect.signature(arrange_leadsheet).bind(None, **options)
+        bound.apply_defaults()
+        self.options = {k: v for k, v in bound.arguments.items() if k != 'leadsheet'}
+        self.reset()
+
+    def reset(self):
+        """ Forget the last arrangement, so the next one starts over. """
+        self.record = None
+        self.filename = None
+        self.header = None
+        self.texts = None
+
+    def arrange(self, filepath, metrics=None):
+        """ Arrange the leadsheet at filepath, reusing whatever the last
+        arrangement has for the measures that did not change. Returns the
+        .ly file, and typesets it unless the session has pdf=False.
+        """
+        setup_environment()
+        with measure_job(filepath, metrics):
+            try:
+                with stage('scan'):
+                    changes = self.changes(filepath)
+                if changes is not None:
+                    try:
+                        return self.arrange_changes(filepath, changes)
+                    except (ReaderUnsupported, EmitterUnsupported, AnacrusisException):
+                        pass
+                count('full_arrangements')
+                return self.arrange_all(filepath)
+            except Exception:
+                self.reset()
+                raise
+
+    def changes(self, filepath):
+        """ (measure index, its new bytes) for each measure of the file
+        that differs from the last arrangement, or None when the file
+        cannot be arranged by splicing in measures.
+        """
+        if self.record is None or os.path.basename(filepath) != self.filename:
+            return None
+        try:
+            header, texts = measure_texts(filepath)
+        except ReaderUnsupported:
+            return None
+        if header != self.header or len(texts) != len(self.texts):
+            return None
+        return [(i, text) for i, (text, last) in enumerate(zip(texts, self.texts)) if text != last]
+
+    ######
+    # whole arrangements
+    #
+    def arrange_all(self, filepath):
+        """ Arrange the leadsheet from scratch and keep its parts. """
+        self.reset()
+        options = self.options
+        filename = filepath.split('/')[-1]
+        record = ReadRecord()
+        try:
+            with stage('read_score'):
+                src = read_musicxml(filepath, record) if leadsheet_reader() == 'stream' else None
+        except ReaderUnsupported:
+            src = None
+        if src is None:
+            return arrange_leadsheet(parse_leadsheet(filepath), **options)
+        leadsheet = leadsheet_from_score(src, filename)
+        if options['emitter'] != 'direct':
+            return arrange_leadsheet(leadsheet, **options)
+
+        self.filename = filename
+        self.src = src
+        self.measures = list(leadsheet.measures)
+        self.contents = [measure_contents(m) for m in self.measures]
+        self.symbols = [chord_symbols(m) for m in self.measures]
+        # the time signature in effect in each measure
+        self.time_signatures = []
+        ts = None
+        for m in self.measures:
+            ts = m.timeSignature or ts
+            self.time_signatures.append(ts)
+        self.all_chord_symbols = leadsheet.all_chord_symbols
+        self.all_notes = leadsheet.all_notes
+        self.voicings = {}
+        self.chord_offsets = []
+        self.chord_voicings = []
+        self.pitches = []
+        self.masks = []
+        self.positions = []
+        self.states = []
+        self.interval_names = {}
+        self.root_bodies = {}
+        self.drop_bodies = {}
+        self.melody_lines = [None] * len(self.measures)
+        self.root_lines = [None] * len(self.measures)
+        self.drop_lines = [None] * len(self.measures)
+        try:
+            lilyfile = self.write(leadsheet.offsets, leadsheet.melody_for_chord)
+        except EmitterUnsupported:
+            # arrange_leadsheet() falls back to music21's converter
+            self.reset()
+            return arrange_leadsheet(leadsheet, **options)
+        try:
+            self.header, self.texts = measure_texts(filepath)
+        except ReaderUnsupported:
+            return lilyfile
+        if len(self.texts) == len(self.measures):
+            self.record = record
+        return lilyfile
+
+    ######
+    # edits
+    #
+    def arrange_changes(self, filepath, changes):
+        """ Splice the changed measures into the last arrangement and
+        arrange it again from there.
+        """
+        record = self.record
+        count('measures_changed', len(changes))
+
+        # every changed measure has to read as it did for the measures
+        # after it, or they would all have to be read again
+        with stage('read_score'):
+            reparsed = []
+            for i, text in changes:
+                m, state = reparse_measure(text, record, i)
+                if state_key(state) != state_key(record.states[i + 1]):
+                    raise ReaderUnsupported(f'measure {i} changes the measures after it')
+                reparsed.append((i, text, m, state))
+            # with a single chord symbol, music21 realizes its duration differently
+            symbols = {i: len(m.getElementsByClass('ChordSymbol')) for i, text, m, state in reparsed}
+            if sum(symbols.get(i, len(s)) for i, s in enumerate(self.symbols)) < 2:
+                raise ReaderUnsupported('fewer than two chord symbols')
+
+        with stage('offsets'):
+            part = self.src.parts[0]
+            for i, text, m, state in reparsed:
+                part.replace(self.measures[i], m)
+                self.measures[i] = m
+                self.texts[i] = text
+                record.states[i + 1] = state
+                self.symbols[i] = chord_symbols(m)
+            for i, text, m, state in reparsed:
+                self.realize_chord_durations(i)
+            for i, text, m, state in reparsed:
+                # as read_leadsheet() checks, without m.barDuration's search
+                # through the whole part
+                ts = self.time_signatures[i] = m.timeSignature or self.time_signatures[i]
+                bar = ts.barDuration if ts is not None else m.barDuration
+                if m.duration.quarterLength < bar.quarterLength:
+                    raise AnacrusisException
+
+            for i, text, m, state in reparsed:
+                chords, notes = self.contents[i]
+                for o in chords:
+                    del self.all_chord_symbols[o]
+                for o in notes:
+                    del self.all_notes[o]
+                chords, notes = self.contents[i] = measure_contents(m)
+                self.all_chord_symbols.update(chords)
+                self.all_notes.update(notes)
+            offsets = sorted(set(self.all_chord_symbols) | set(self.all_notes))
+            melody_for_chord, chord_for_note = melody_and_chords(offsets, self.all_chord_symbols, self.all_notes)
+
+        with stage('slash_chords'):
+            for i, text, m, state in reparsed:
+                for cs in self.contents[i][0].values():
+                    strip_slash_chord(cs)
+
+        return self.write(offsets, melody_for_chord)
+
+    def realize_chord_durations(self, i):
+        """ harmony.realizeChordSymbolDurations() for the chord symbols of
+        measure i and the one before them.
+        """
+        before = next((s[-1] for s in reversed(self.symbols[:i]) if s), None)
+        after = next((s[0] for s in self.symbols[i + 1:] if s), None)
+        chain = ([before] if before is not None else []) + self.symbols[i] + ([after] if after is not None else [])
+        for (o, cs), (next_o, _) in zip(chain, chain[1:]):
+            cs.duration.quarterLength = next_o - o
+        if after is None and chain:
+            # the last chord symbol lasts to the end of the piece
+            last = self.measures[-1]
+            o, cs = chain[-1]
+            cs.duration.quarterLength = last.offset + last.highestTime - o
+
+    def write(self, offsets, melody_for_chord):
+        """ Voicings, placements and LilyPond lines for the leadsheet as it
+        is now, reusing those of the last arrangement where their inputs
+        are the same, and the .ly file made from them.
+        """
+        options = self.options
+        all_chord_symbols = self.all_chord_symbols
+        count('measures', len(self.measures))
+        count('notes', len(self.all_notes))
+        count('chords', len(all_chord_symbols))
+
+        with stage('voicings'):
+            voicings = {}
+            for o, cs in all_chord_symbols.items():
+                melody = melody_for_chord[o]
+                last = self.voicings.get(o)
+                if last is not None and last[0] is cs and last[1] is melody:
+                    voicings[o] = last
+                else:
+                    voicings[o] = (cs, melody, voicing_for_chord_symbol(cs, melody, options['minimum_fret'],
+                                                                        options['maj_triad'], options['min_triad'],
+                                                                        options['drop_type']))
+            self.voicings = voicings
+
+        with stage('positions'):
+            chord_offsets = [o for o in offsets if o in voicings]
+            self.place([voicings[o][2] for o in chord_offsets], chord_offsets)
+            positions = dict(zip(chord_offsets, self.positions))
+
+            ######
+            # melody string and frets of the placed chords, and the neck
+            # position under each melody note
+            #
+            placed_chords = []
+            melody_positions = []
+            drop_bodies = {}
+            current_pos = options['minimum_fret']
+            for o in offsets:
+                if o in positions:
+                    cs, melody, c = voicings[o]
+                    if positions[o] is None:
+                        drop_bodies[o] = None
+                    else:
+                        melody_string, np = positions[o]
+                        current_pos = int(min(np))
+                        names = self.interval_names.get(o)
+                        if names is None or names[0] is not c or names[1] is not cs:
+                            names = self.interval_names[o] = (c, cs, interval_names_for_chord(c, cs))
+                        placed_chords.append((melody_string + 1, np, names[2]))
+                        body = self.drop_bodies.get(o)
+                        if body is None or body[0] is not c:
+                            body = self.drop_bodies[o] = (c, voicing_body(c))
+                        drop_bodies[o] = body[1]
+                if o in self.all_notes:
+                    melody_positions.append(current_pos)
+
+        with stage('lilypond_text'):
+            root_bodies = {}
+            for o, cs in all_chord_symbols.items():
+                body = self.root_bodies.get(o)
+                if body is None or body[0] is not cs:
+                    body = self.root_bodies[o] = (cs, chord_body(cs))
+                root_bodies[o] = body[1]
+            melody_content = self.measure_lines(self.melody_lines, self.melody_measure, ())
+            root_chord_content = self.measure_lines(self.root_lines, self.chord_measure, (root_bodies, 's'))
+            drop_chord_content = self.measure_lines(self.drop_lines, self.chord_measure, (drop_bodies, 'r'))
+
+        return write_arrangement(self.filename, self.src, self.measures,
+                                 melody_content, root_chord_content, drop_chord_content, placed_chords,
+                                 melody_positions, options['notation'], options['orientation'],
+                                 options['interval_names'], options['drop_type'], options['output_name'],
+                                 options['pdf'])
+
+    def place(self, chords, chord_offsets):
+        """ positions_for_chords() for the voicings as they are now, placing
+        them again from the first one that differs from last time until
+        the placement chain is back in the state it was in last time.
+        """
+        drop_type = self.options['drop_type']
+        if drop_type not in drop_string_offsets:
+            self.positions = positions_for_chords(chords, self.options['minimum_fret'],
+                                                  self.options['maximum_fret'], drop_type)
+            return
+        string_offsets = drop_string_offsets[drop_type]
+
+        # the changed run of chords, between a common start and end
+        old_offsets, old_chords = self.chord_offsets, self.chord_voicings
+        n, old_n = len(chords), len(old_chords)
+        start = 0
+        while start < min(n, old_n) and chords[start] is old_chords[start] \
+                and chord_offsets[start] == old_offsets[start]:
+            start += 1
+        end = 0
+        while end < min(n, old_n) - start and chords[n - 1 - end] is old_chords[old_n - 1 - end] \
+                and chord_offsets[n - 1 - end] == old_offsets[old_n - 1 - end]:
+            end += 1
+        shift = old_n - n
+
+        changed_pitches = [sorted(c.pitches) for c in chords[start:n - end]]
+        full = [p for p in changed_pitches if len(p) >= 4]
+        valid, valid_anywhere = string_set_masks(full, drop_type, (self.options['minimum_fret'], 0))
+        masks = iter(zip(valid, valid_anywhere))
+        changed_masks = [next(masks) if len(p) >= 4 else None for p in changed_pitches]
+        pitches = self.pitches[:start] + changed_pitches + self.pitches[old_n - end:]
+        all_masks = self.masks[:start] + changed_masks + self.masks[old_n - end:]
+
+        positions = self.positions[:start]
+        states = self.states[:start]
+        state = states[-1] if states else None
+        masks = [m for m in all_masks[start:] if m is not None]
+        placements = place_chords(pitches[start:], (m[0] for m in masks), (m[1] for m in masks),
+                                  string_offsets, state)
+        for i in range(start, n):
+            # past the change, and in the state as last time: the rest
+            # is placed as it was
+            if i >= n - end and state == (self.states[i + shift - 1] if i + shift > 0 else None):
+                positions += self.positions[i + shift:]
+                states += self.states[i + shift:]
+                break
+            position, state = next(placements)
+            positions.append(position)
+            states.append(state)
+            count('chords_placed')
+
+        self.chord_offsets = chord_offsets
+        self.chord_voicings = chords
+        self.pitches = pitches
+        self.masks = all_masks
+        self.positions = positions
+        self.states = states
+
+    def measure_lines(self, cache, make, args):
+        """ The lines of every measure, made again for the measures whose
+        inputs changed, with the closing empty line.
+        """
+        lines = []
+        carried = None
+        emitted = 0
+        for i, m in enumerate(self.measures):
+            entry, carried, made = make(cache[i], i, m, carried, *args)
+            cache[i] = entry
+            emitted += made
+            lines += entry[-1]
+        count('measures_emitted', emitted)
+        lines.append('')
+        return lines
+
+    def melody_measure(self, entry, i, m, carried, *args):
+        prev = self.measures[i - 1] if i > 0 else None
+        key = (m, prev.number if prev is not None else None)
+        if entry is not None and entry[0] is m and entry[1] == key[1]:
+            return entry, None, 0
+        return key + (melody_measure_lines(m, prev),), None, 1
+
+    def chord_measure(self, entry, i, m, ts, bodies, spacer):
+        bar = ts.barDuration.quarterLength if ts is not None else None
+        measure_bodies = tuple(bodies[o] for o in self.contents[i][0])
+        if entry is not None and entry[0] is m and entry[1] == bar and entry[2] == measure_bodies:
+            return entry, entry[3] or ts, 0
+        lines, after = chord_measure_lines(m, i == 0, ts, bodies, spacer)
+        return (m, bar, measure_bodies, after if after is not ts else None, lines), after, 1
+
+def chord_symbols(m):
+    """ (offset in the score, chord symbol) for the chord symbols of a
+    measure, N.C. included, in order.
+    """
+    return [(m.offset + cs.offset, cs) for cs in m.getElementsByClass('ChordSymbol')]
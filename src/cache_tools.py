@@ -0,0 +1,289 @@
+import collections
+import gc
+import hashlib
+import io
+import os
+import pickle
+import tempfile
+import threading
+import weakref
+
+class LRUCache:
+    """ A bounded mapping that evicts the least recently used entry,
+    with hit/miss counters. Safe to share between threads.
+    """
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+            self.dirty = True
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+            self.dirty = False
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+        }
+
+    def save(self, path):
+        """ Write the entries to path, atomically, so several processes
+        can share one cache file.
+        """
+        with self._lock:
+            items = list(self._data.items())
+            self.dirty = False
+        atomic_write(path, pickle.dumps(items, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def load(self, path):
+        """ Add the entries saved at path. A missing or unreadable file
+        just leaves the cache as it is.
+        """
+        try:
+            with open(path, 'rb') as f:
+                items = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            return
+        for key, value in items[-self.maxsize:]:
+            self.put(key, value)
+        self.dirty = False
+
+def atomic_write(path, data):
+    """ Write bytes to path through a temporary file in the same directory,
+    so readers never see a partial file.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+def content_hash(*parts):
+    """ Hex sha256 over bytes or str parts, each length-prefixed so that
+    different splits of the same bytes give different hashes.
+    """
+    h = hashlib.sha256()
+    for p in parts:
+        if isinstance(p, str):
+            p = p.encode('utf-8')
+        h.update(len(p).to_bytes(8, 'little'))
+        h.update(p)
+    return h.hexdigest()
+
+class ArtifactCache:
+    """ Output files stored on disk under a content hash, as
+    directory/<key><suffix>, e.g. one .ly and one .pdf per key.
+
+    Files are written atomically, so several processes can share one
+    directory. When the files add up to more than max_bytes, the least
+    recently used ones are removed. Hit, miss, store and eviction counts
+    are kept per process.
+    """
+
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key, suffix):
+        return os.path.join(self.directory, key + suffix)
+
+    def get(self, key, suffixes):
+        """ Paths of the cached files for key, one per suffix, or None
+        unless every one of them is cached.
+        """
+        paths = [self.path(key, s) for s in suffixes]
+        try:
+            for p in paths:
+                os.utime(p)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return paths
+
+    def read(self, key, suffix):
+        """ The bytes cached for key, or None. """
+        try:
+            with open(self.path(key, suffix), 'rb') as f:
+                data = f.read()
+            os.utime(self.path(key, suffix))
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def write(self, key, suffix, data):
+        """ Store bytes under key. """
+        atomic_write(self.path(key, suffix), data)
+        with self._lock:
+            self.stores += 1
+        self.evict()
+
+    def fetch(self, key, targets):
+        """ Copy the cached files for key to targets, a dict of suffix to
+        destination path. Returns False, copying nothing, on a miss.
+        """
+        paths = self.get(key, list(targets))
+        if paths is None:
+            return False
+        try:
+            data = []
+            for p in paths:
+                with open(p, 'rb') as f:
+                    data.append(f.read())
+        except FileNotFoundError:
+            # evicted by another process in the meantime
+            with self._lock:
+                self.hits -= 1
+                self.misses += 1
+            return False
+        for target, d in zip(targets.values(), data):
+            atomic_write(target, d)
+        return True
+
+    def put(self, key, sources):
+        """ Store copies of sources, a dict of suffix to file path, under key. """
+        for suffix, source in sources.items():
+            with open(source, 'rb') as f:
+                atomic_write(self.path(key, suffix), f.read())
+        with self._lock:
+            self.stores += 1
+        self.evict()
+
+    def entries(self):
+        # (mtime, size, path) of every cached file
+        found = []
+        for name in os.listdir(self.directory):
+            if name.startswith('.tmp-'):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            found.append((st.st_mtime, st.st_size, os.path.join(self.directory, name)))
+        return found
+
+    def evict(self):
+        """ Remove least recently used files until the cache fits in max_bytes. """
+        found = sorted(self.entries())
+        total = sum(size for mtime, size, path in found)
+        for mtime, size, path in found:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            else:
+                with self._lock:
+                    self.evictions += 1
+            total -= size
+
+    def stats(self):
+        found = self.entries()
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'stores': self.stores,
+            'evictions': self.evictions,
+            'files': len(found),
+            'bytes': sum(size for mtime, size, path in found),
+            'max_bytes': self.max_bytes,
+        }
+
+class WeakrefPickler(pickle.Pickler):
+    """ Pickles weak references as references to the same object, so
+    object graphs with back references, like music21 streams and their
+    sites, pickle in one pass. A dead reference stays dead.
+    """
+
+    def reducer_override(self, obj):
+        if type(obj) is weakref.ReferenceType:
+            target = obj()
+            return (weakref.ref, (target,)) if target is not None else (_dead_ref, ())
+        if type(obj) is weakref.WeakSet:
+            return (weakref.WeakSet, (list(obj),))
+        return NotImplemented
+
+class _Gone:
+    pass
+
+def _dead_ref():
+    return weakref.ref(_Gone())
+
+def dumps(obj, pickler=WeakrefPickler):
+    """ pickle.dumps() through WeakrefPickler, or a subclass of it.
+    pickle.loads() reads it back.
+    """
+    f = io.BytesIO()
+    pickler(f, protocol=pickle.HIGHEST_PROTOCOL).dump(obj)
+    return f.getvalue()
+
+def loads(data):
+    """ pickle.loads() with the cyclic garbage collector paused, since
+    allocating a large object graph otherwise sets off collection after
+    collection.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return pickle.loads(data)
+    finally:
+        if enabled:
+            gc.enable()
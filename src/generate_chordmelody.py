@@ -2,56 +2,199 @@
 # -*- coding: utf-8 -*-
 import sys
 from music21_tools import *
+from lilypond_tools import *
+from typeset_tools import *
+from cache_tools import ArtifactCache, content_hash, dumps, loads
+from metrics_tools import Metrics, count, measure_job, metrics_from_environment, stage, warm_up
+from preview_tools import encode, preview_document
+from transpose_tools import key_fifths, key_name, key_transpositions, keeps_octaves, transpose_voicing, transposed
 from dotenv import load_dotenv
+from concurrent import futures
+import argparse
+import collections
 import chevron
+import copy
+import functools
+import glob
+import importlib
+import inspect
+import multiprocessing
 import os
 import re
+import zlib
 
-def generate_arrangement(filepath,
-                   minimum_fret=5,
-                   maximum_fret=15,
-                   maj_triad='major-seven',
-                   min_triad='minor-seven',
-                   notation='tablature',
-                   orientation='standard',
-                   interval_names='intervals_off',
-                   drop_type='drop2'):
+Leadsheet = collections.namedtuple('Leadsheet', ['filename', 'src', 'measures', 'all_chord_symbols', 'all_notes',
+                                                 'offsets', 'melody_for_chord', 'chord_for_note'])
+Placement = collections.namedtuple('Placement', ['chords_drop', 'chord_note_frets', 'melody_string_nums',
+                                                 'chord_interval_names', 'chord_neck_positions',
+                                                 'melody_neck_positions'])
+ArrangementResult = collections.namedtuple('ArrangementResult', ['filepath', 'lilyfile', 'error', 'metrics'],
+                                           defaults=(None,))
+
+_environment_loaded = False
+_unset = object()
+_lilypond_path = _unset
+_lilypond_converter = None
 
+def setup_environment():
+    """ Load .env and the voicing cache, once per process. """
+    global _environment_loaded
+    if not _environment_loaded:
+        load_dotenv()
+        if os.environ.get('VOICING_CACHE'):
+            voicing_cache.load(os.environ['VOICING_CACHE'])
+        _environment_loaded = True
+
+def save_caches():
+    """ Write new voicing cache entries to VOICING_CACHE, if set. """
+    path = os.environ.get('VOICING_CACHE')
+    if path and voicing_cache.dirty:
+        voicing_cache.save(path)
+
+def lilypond_converter():
+    """ A LilypondConverter reused across jobs in this process, since
+    creating one shells out to lilypond --version. music21's user
+    settings are only rewritten when LILYPOND_PATH actually changes.
+    """
+    global _lilypond_path, _lilypond_converter
+    from music21 import environment, lily
+    setup_environment()
+    path = os.environ.get('LILYPOND_PATH')
+    if path != _lilypond_path:
+        environment.UserSettings()['lilypondPath'] = path
+        _lilypond_path = path
+        _lilypond_converter = None
+    if _lilypond_converter is None:
+        _lilypond_converter = lily.translate.LilypondConverter()
+    _lilypond_converter.currentMeasure = None
+    return _lilypond_converter
+
+def leadsheet_reader(reader=None):
+    """ The reader to parse leadsheets with: reader if given, else
+    LEADSHEET_READER, else 'stream'.
+    """
+    setup_environment()
+    return reader or os.environ.get('LEADSHEET_READER') or 'stream'
+
+def read_score(filepath, reader=None):
+    """ The music21 Score of a leadsheet file. The 'stream' reader builds
+    only what the arranger uses, in one pass over the file, and leaves
+    anything it does not handle to converter.parseFile(), which is the
+    'music21' reader.
+    """
+    from music21 import converter
+    from musicxml_tools import ReaderUnsupported, read_musicxml
+    if leadsheet_reader(reader) == 'stream':
+        try:
+            return read_musicxml(filepath)
+        except ReaderUnsupported:
+            pass
+    return converter.parseFile(filepath)
+
+@warm_up
+def _import_reader():
+    # music21 is imported on first use, which takes 45 MB the first job
+    # measured under JOB_MEMORY_MB would otherwise be charged for
+    for name in ('music21', 'musicxml_tools'):
+        importlib.import_module(name)
+
+def parse_leadsheet(filepath, reader=None):
+    """ Parse a leadsheet and line its chords and melody up by offset.
+
+    None of this depends on the arrangement options, so one Leadsheet
+    can be arranged any number of times with arrange_leadsheet(). With
+    PARSE_CACHE set, a leadsheet with the same bytes and file name, which
+    untitled scores are titled with, is loaded from a pickle instead. The
+    key includes code_version(), so the pickles go stale when music21 or
+    this code changes.
+    """
     filename = filepath.split('/')[-1]
-    src = converter.parseFile(filepath)
+    reader = leadsheet_reader(reader)
+    cache = parse_cache()
+    if cache is None:
+        return read_leadsheet(filepath, filename, reader)
 
-    load_dotenv()
-    environment.UserSettings()['lilypondPath'] = os.environ.get('LILYPOND_PATH')
+    with open(filepath, 'rb') as f:
+        key = content_hash(f.read(), filename, reader, code_version())
+    with stage('parse_cache'):
+        data = cache.read(key, '.leadsheet')
+        leadsheet = None
+        if data is not None:
+            try:
+                leadsheet = loads(zlib.decompress(data))
+            except Exception:
+                pass
+        if leadsheet is not None:
+            restore_score(leadsheet.src)
+            leadsheet.src.filePath = os.path.abspath(filepath)
+            # the measures are an iterator over src, which does not pickle
+            measures = leadsheet.src.parts[0].getElementsByClass('Measure')
+            count('parse_cache_hits')
+            return leadsheet._replace(filename=filename, measures=measures)
 
-    measures = src.parts[0].getElementsByClass('Measure')  # # get the measures
-    harmony.realizeChordSymbolDurations(measures)  # # need this to see how long chords are
+    leadsheet = read_leadsheet(filepath, filename, reader)
+    with stage('parse_cache'):
+        cache.write(key, '.leadsheet', zlib.compress(dumps(leadsheet._replace(filename=None, measures=None), ScorePickler), 1))
+    return leadsheet
 
-    # we don't currently support anacrusis (pickup measures)
-    for m in measures:
-        if m.duration.quarterLength < m.barDuration.quarterLength:
-            raise AnacrusisException
+def read_leadsheet(filepath, filename, reader=None):
+    """ parse_leadsheet() without the cache. """
+    with stage('read_score'):
+        src = read_score(filepath, reader)
+    return leadsheet_from_score(src, filename)
 
-    # TODO: Should also add an exception for Chords that aren't ChordSymbols
+def leadsheet_from_score(src, filename):
+    """ The Leadsheet of a score read by read_score(). """
+    from music21 import harmony
+    with stage('offsets'):
+        measures = src.parts[0].getElementsByClass('Measure')  # # get the measures
+        harmony.realizeChordSymbolDurations(measures)  # # need this to see how long chords are
 
+        # we don't currently support anacrusis (pickup measures)
+        for m in measures:
+            if m.duration.quarterLength < m.barDuration.quarterLength:
+                raise AnacrusisException
 
-    ######
-    # get all the musical elements into a big list by offset
-    #
-    all_chord_symbols = {}
-    all_notes = {}
-    for i, m in enumerate(measures):
-        chords = m.getElementsByClass('Chord')
-        notes = m.getElementsByClass(['Note', 'Rest'])
-        for c in chords:
-            if 'N.C.' in c.figure:
-                continue
-            all_chord_symbols[m.offset + c.offset] = c
-        for n in notes:
-            all_notes[m.offset + n.offset] = n
+        # TODO: Should also add an exception for Chords that aren't ChordSymbols
+
+
+        ######
+        # get all the musical elements into a big list by offset
+        #
+        all_chord_symbols = {}
+        all_notes = {}
+        for m in measures:
+            chords, notes = measure_contents(m)
+            all_chord_symbols.update(chords)
+            all_notes.update(notes)
 
-    offsets = sorted(list(set(list(all_chord_symbols.keys()) + list(all_notes.keys()))))
+        offsets = sorted(list(set(list(all_chord_symbols.keys()) + list(all_notes.keys()))))
+        melody_for_chord, chord_for_note = melody_and_chords(offsets, all_chord_symbols, all_notes)
 
+    with stage('slash_chords'):
+        # strip slash chords down to their upper structure, once, so that
+        # arranging the leadsheet again finds the chord symbols unchanged
+        for cs in all_chord_symbols.values():
+            strip_slash_chord(cs)
 
+    return Leadsheet(filename, src, measures, all_chord_symbols, all_notes, offsets, melody_for_chord, chord_for_note)
+
+def measure_contents(m):
+    """ The chord symbols (without N.C.) and the notes and rests of a
+    measure, by offset in the score.
+    """
+    chords = {}
+    notes = {}
+    for c in m.getElementsByClass('Chord'):
+        if 'N.C.' in c.figure:
+            continue
+        chords[m.offset + c.offset] = c
+    for n in m.getElementsByClass(['Note', 'Rest']):
+        notes[m.offset + n.offset] = n
+    return chords, notes
+
+def melody_and_chords(offsets, all_chord_symbols, all_notes):
+    """ The melody note for each chord, and the chord for each note. """
     ######
     # figure out the melody for each chord, and the chord for each note
     #
@@ -78,130 +221,109 @@ def generate_arrangement(filepath,
         elif o in all_chord_symbols:
             melody_for_chord[o] = prev_note
             prev_chord = all_chord_symbols[o]
+    return melody_for_chord, chord_for_note
 
+def strip_slash_chord(cs):
+    """ Reduce a slash chord symbol to its upper structure, in place. """
+    from music21 import note
+    if '/' in cs.figure:
+        for n in cs.notes:
+            cs.remove(n)
+        for p in upper_structure(cs.figure):
+            cs.add(note.Note(music21_pitch(p)))
 
-    ######
-    # build out processed chords
-    #
-    all_chords_drop = {} # for fretboard diagrams
-    for o in all_chord_symbols.keys():
-        cs = all_chord_symbols[o]
-        mel = melody_for_chord[o]
-
-        if '/' in cs.figure:
-            noslash = harmony.ChordSymbol(cs.figure.split('/')[0])
-            for n in cs.notes:
-                cs.remove(n)
-            for n in noslash.notes:
-                cs.add(n)
-
-        # Hack for some slash chords
-        if 'Cannot Be Identified' in cs.figure:
-            cs.remove(cs[0])
-
-        extensions = []
-
-        # for "add __" chords, just get rid of the last note
-        if 'add' in cs.figure and len(cs.notes) == 4:
-            new_c = chord.Chord(cs.notes[0:min(len(cs.notes),3)])
-            extensions += [cs.notes[3]]
-        else:
-            new_c = chord.Chord(cs.notes[0:min(len(cs.notes),4)])
-            extensions += cs.notes[4:] if len(cs.notes) > 4 else []
+    # Hack for some slash chords
+    if 'Cannot Be Identified' in cs.figure:
+        cs.remove(cs[0])
 
-        fnc = expand_to_four_note_chord(new_c, cs.chordKind, maj_triad=maj_triad, min_triad=min_triad)
-        mc = add_melody_to_chord(fnc, mel)
-        red = reduce_to_four_note_chord(mc, cs, mel)
+def measure_header(m, first, copies):
+    """ A new measure with m's number and what the output voices need
+    from m's header: key, time signature and clef on the first measure,
+    line breaks and time signature changes after that. With copies, the
+    header elements are copies, for a measure whose durations are set.
+    """
+    from music21 import layout, stream
+    header = stream.Measure()
+    header.number = m.number
+    if first:
+        for e in (m.keySignature, m.timeSignature, m.clef):
+            header.insert(0.0, copy.deepcopy(e) if copies else e)
+    for n in m:
+        if 'SystemLayout' in n.classes:
+            header.append(layout.SystemLayout(isNew=True))
+        if 'TimeSignature' in n.classes and not first:
+            header.append(copy.deepcopy(n) if copies else n)
+    return header
 
-        if mel is not None:
-            inversion = match_inversion_to_melody(red, mel)
-        else:
-            inversion = increase_chord_octave(red, minimum_fret)
+def lilypond_content_from_streams(src, measures, all_chord_symbols, all_chords_drop):
+    """ The melody, drop chord and chord symbol lines through music21's
+    LilypondConverter. Slower than the lilypond_tools emitter, which
+    writes the same text, but handles any notation music21 does.
+    """
+    # the chord symbols belong to the leadsheet, and get their own
+    # durations back once the chord symbol line is written
+    durations = [(cs, cs.duration) for cs in all_chord_symbols.values()]
+    try:
+        return _lilypond_content_from_streams(src, measures, all_chord_symbols, all_chords_drop)
+    finally:
+        for cs, d in durations:
+            cs.duration = d
 
-        dc = drop_chord(inversion, drop_type)
-        
-        final = add_extensions(dc, cs, extensions, mel)
+def _lilypond_content_from_streams(src, measures, all_chord_symbols, all_chords_drop):
+    from music21 import exceptions21, lily, note, stream
+    with stage('voices'):
+        ######
+        # back to music21 objects, once, for the output voices
+        #
+        drop_chords = {}
+        for o, v in all_chords_drop.items():
+            drop_chords[o] = v.to_chord() if v is not None else note.Rest()
 
-        all_chords_drop[o] = final
+        ######
+        # build the melody, chord symbol and drop chord scores for the
+        # converter, with the chord durations realized measure by measure
+        #
+        lilymelody = stream.Score()
+        lilymelody.streamStatus.beams = False
+        lilymelody.metadata = src.parts[0].metadata
+        lilychordsroot = stream.Score()
+        lilychords = stream.Score()
 
+        ts = None
+        for i, m in enumerate(measures):
+            measure_melody = measure_header(m, i == 0, False)
+            measure_chords_root = measure_header(m, i == 0, True)
+            measure_chords_drop = measure_header(m, i == 0, True)
 
-    ######
-    # figure out chord positions and melody string nums
-    #
-    chord_neck_positions = {}
-    melody_neck_positions = {}
-    chord_note_frets = {}
-    melody_string_nums = {}
-    chord_interval_names = {}
-    current_pos = minimum_fret
-    prev_chord = None
-    melody_string = 0
-    for o in offsets:
-        if o in all_chords_drop:
-            try:
-                c = all_chords_drop[o]
-                melody_string, np = position_for_chord(c, minimum_fret, maximum_fret, prev_chord, -1 * (melody_string) + 5, drop_type)
-                current_pos = int(min(np))
-                chord_note_frets[o] = np
-                cs = all_chord_symbols[o]
-                chord_interval_names[o] = interval_names_for_chord(c, cs)
-                chord_neck_positions[o] = current_pos
-                melody_string_nums[o] = melody_string + 1
-                prev_chord = c
-            except NoteTooLowForChord:
-                r = note.Rest()
-                r.duration = all_chords_drop[o].duration
-                all_chords_drop[o] = r
-                prev_chord = None
-        if o in all_notes:
-            melody_neck_positions[o] = current_pos
+            for n in m:
+                o = n.offset + m.offset
+                if 'Note' in n.classes or 'Rest' in n.classes:
+                    n.lyrics = []
+                    measure_melody.insert(n.offset, n)
+                elif 'Chord' in n.classes:
+                    if 'N.C' in n.figure:
+                        continue
+                    try:
+                        measure_chords_root.insert(n.offset, all_chord_symbols[o])
+                        measure_chords_drop.insert(n.offset, drop_chords[o])
+                    except exceptions21.StreamException:
+                        # a second chord symbol at the same offset
+                        count('duplicate_chords')
 
-    ######
-    # build voices for final output
-    #
-    voice_melody = stream.Voice()
-    voice_chords_root = stream.Voice()
-    voice_chords_drop = stream.Voice()
-
-    for i, m in enumerate(measures):
-        measure_melody = stream.Measure()
-        measure_melody.number = m.number
-
-        if i == 0:
-            measure_melody.insert(0.0, m.keySignature)
-            measure_melody.insert(0.0, m.timeSignature)
-            measure_melody.insert(0.0, m.clef)
-
-        for n in m:
-            if 'SystemLayout' in n.classes:
-                sl = layout.SystemLayout(isNew=True)
-                measure_melody.append(sl)
-            if 'TimeSignature' in n.classes and i != 0:
-                measure_melody.append(n)
-
-        measure_chords_root = copy.deepcopy(measure_melody)
-        measure_chords_drop = copy.deepcopy(measure_melody)
-
-        for n in m:
-            o = n.offset + m.offset
-            if 'Note' in n.classes or 'Rest' in n.classes:
-                n.lyrics = []
-                measure_melody.insert(n.offset, n)
-            elif 'Chord' in n.classes:
-                if 'N.C' in n.figure:
-                    continue
-                try:
-                    measure_chords_root.insert(n.offset, all_chord_symbols[o])
-                    measure_chords_drop.insert(n.offset, all_chords_drop[o])
-                except exceptions21.StreamException:
-                    print("Possible duplicate chord skipped: {n}")
-
-        voice_melody.insert(m.offset, measure_melody)
-        voice_chords_root.insert(m.offset, measure_chords_root)
-        voice_chords_drop.insert(m.offset, measure_chords_drop)
-
-    voice_chords_root = realize_chord_durations(voice_chords_root)
-    voice_chords_drop = realize_chord_durations(voice_chords_drop)
+            # the new measures are not in a voice, so their bar length
+            # comes from the last time signature of the leadsheet
+            if m.timeSignature is not None:
+                ts = m.timeSignature
+            bar_duration = ts.barDuration if ts is not None else m.barDuration
+            realize_measure_durations(measure_chords_root, bar_duration)
+            realize_measure_durations(measure_chords_drop, bar_duration)
+            # insert() would work out the highest time of the score every time
+            lilymelody.coreInsert(m.offset, measure_melody)
+            lilychordsroot.coreInsert(m.offset, measure_chords_root)
+            lilychords.coreInsert(m.offset, measure_chords_drop)
+
+        for score in (lilymelody, lilychordsroot, lilychords):
+            score.coreElementsChanged()
 
     ############
     ############
@@ -210,134 +332,736 @@ def generate_arrangement(filepath,
     #
     #
 
-    # fretboard diagrams
-    lilychords = stream.Score()  # # create a stream to put everything in
-    for m in voice_chords_drop:
-        lilychords.insert(m.offset, m)
-
-    # chord symbols
-    lilychordsroot = stream.Score()
-    for m in voice_chords_root:
-        lilychordsroot.insert(m.offset, m)
-
-    # melody
-    lilymelody = stream.Score()
-    lilymelody.streamStatus.beams = False
-    lilymelody.metadata = src.parts[0].metadata
-    for m in voice_melody:
-        lilymelody.insert(m.offset, m)
-
-    # create a lilypond converter
-    lpc = lily.translate.LilypondConverter()
-
-    # Get the lilypond text for the melody content
-    lpc.context = lily.lilyObjects.LyMusicList()
-    lpc.appendObjectsToContextFromStream(lilymelody)
-    melody_content = str(lpc.context).split('\n')
+    with stage('lilypond_convert'):
+        # create a lilypond converter
+        lpc = lilypond_converter()
+
+        # Get the lilypond text for the melody content
+        lpc.context = lily.lilyObjects.LyMusicList()
+        lpc.appendObjectsToContextFromStream(lilymelody)
+        melody_content = str(lpc.context).split('\n')
+
+        # Get the lilypond text for the drop chord content
+        lpc.context = lily.lilyObjects.LyMusicList()
+        lpc.appendObjectsToContextFromStream(lilychords)
+        drop_chord_content = str(lpc.context).split('\n')
+        drop_chord_content = [s for s in drop_chord_content if not s.startswith('\\')]
+
+        # Get the lilypond text for the root chord content
+        lpc.context = lily.lilyObjects.LyMusicList()
+        lpc.appendObjectsToContextFromStream(lilychordsroot)
+        root_chord_content = str(lpc.context).split('\n')
+        root_chord_content = [s.replace('r ','s ') for s in root_chord_content if not s.startswith('\\')]
+
+        # Replace tied chord endings with rests (for weird time signatures)
+        for i in range(1,len(root_chord_content)):
+            if '~' in root_chord_content[i-1]:
+                root_chord_content[i] = re.sub('<.*>', 's', root_chord_content[i])
+        for i in range(1,len(drop_chord_content)):
+            if '~' in drop_chord_content[i-1]:
+                drop_chord_content[i] = re.sub('<.*>', 'r', drop_chord_content[i])
+
+    return melody_content, drop_chord_content, root_chord_content
+
+def arrange_leadsheet(leadsheet,
+                   minimum_fret=5,
+                   maximum_fret=15,
+                   maj_triad='major-seven',
+                   min_triad='minor-seven',
+                   notation='tablature',
+                   orientation='standard',
+                   interval_names='intervals_off',
+                   drop_type='drop2',
+                   output_name=None,
+                   emitter='direct',
+                   pdf=True):
+    """ Arrange a parsed leadsheet and typeset it. The output files are
+    named after the leadsheet unless output_name is given. emitter='music21'
+    writes the LilyPond text through music21's LilypondConverter instead of
+    lilypond_tools. pdf=False only writes the .ly file, for typesetting it
+    later in a batch.
+    """
+    setup_environment()
+    count('measures', len(leadsheet.measures))
+    count('notes', len(leadsheet.all_notes))
+    count('chords', len(leadsheet.all_chord_symbols))
+
+    placement = place_leadsheet(leadsheet, minimum_fret, maximum_fret, maj_triad, min_triad, drop_type)
+    return arrange_placement(leadsheet, placement, notation, orientation, interval_names, drop_type, output_name,
+                             emitter, pdf)
+
+def arrange_placement(leadsheet, placement, notation, orientation, interval_names, drop_type, output_name, emitter,
+                      pdf):
+    """ The rest of arrange_leadsheet() once the chords are placed: the
+    LilyPond text of the voices, written out and typeset.
+    """
+    filename = leadsheet.filename
+    src = leadsheet.src
+    measures = leadsheet.measures
+    all_chord_symbols = leadsheet.all_chord_symbols
+    all_chords_drop = placement.chords_drop
+
+    ######
+    # lilypond text for the melody, chord symbols and drop voicings
+    #
+    try:
+        if emitter != 'direct':
+            raise EmitterUnsupported(emitter)
+        with stage('lilypond_text'):
+            melody_content = melody_lines(measures)
+            root_chord_content = chord_lines(measures, {o: chord_body(cs) for o, cs in all_chord_symbols.items()}, 's')
+            drop_chord_content = chord_lines(measures, {o: voicing_body(v) if v is not None else None
+                                                        for o, v in all_chords_drop.items()}, 'r')
+    except EmitterUnsupported:
+        count('emitter_fallbacks')
+        melody_content, drop_chord_content, root_chord_content = \
+            lilypond_content_from_streams(src, measures, all_chord_symbols, all_chords_drop)
+    placed_chords = zip(placement.melody_string_nums.values(), placement.chord_note_frets.values(),
+                        placement.chord_interval_names.values())
+    return write_arrangement(filename, src, measures, melody_content, root_chord_content, drop_chord_content,
+                             placed_chords, placement.melody_neck_positions.values(), notation, orientation,
+                             interval_names, drop_type, output_name, pdf)
+
+def preview_leadsheet(leadsheet, minimum_fret=5, maximum_fret=15, maj_triad='major-seven', min_triad='minor-seven',
+                      drop_type='drop2'):
+    """ What arrange_leadsheet() would typeset, as a preview document
+    (see preview_tools) instead of LilyPond: every melody note and chord
+    by measure, with the strings, frets and interval names of the drop
+    voicings.
+    """
+    setup_environment()
+    count('measures', len(leadsheet.measures))
+    count('notes', len(leadsheet.all_notes))
+    count('chords', len(leadsheet.all_chord_symbols))
+
+    placement = place_leadsheet(leadsheet, minimum_fret, maximum_fret, maj_triad, min_triad, drop_type)
+    with stage('preview'):
+        options = dict(minimum_fret=minimum_fret, maximum_fret=maximum_fret, maj_triad=maj_triad,
+                       min_triad=min_triad, drop_type=drop_type)
+        return preview_document(leadsheet, placement, options)
+
+def place_leadsheet(leadsheet, minimum_fret=5, maximum_fret=15, maj_triad='major-seven', min_triad='minor-seven',
+                    drop_type='drop2'):
+    """ The drop voicing of every chord symbol and where it goes on the
+    neck, along with the neck position of every melody note, as a
+    Placement of dicts keyed by offset. A chord that fits nowhere has
+    None for its voicing and no entry in the other dicts.
+    """
+    all_chords_drop = leadsheet_voicings(leadsheet, minimum_fret, maj_triad, min_triad, drop_type)
+    return place_voicings(leadsheet, all_chords_drop, minimum_fret, maximum_fret, drop_type)
+
+def leadsheet_voicings(leadsheet, minimum_fret, maj_triad, min_triad, drop_type):
+    """ The drop voicing of every chord symbol, by offset. """
+    all_chord_symbols = leadsheet.all_chord_symbols
+    melody_for_chord = leadsheet.melody_for_chord
+
+    with stage('voicings'):
+        ######
+        # build out processed chords
+        #
+        all_chords_drop = {} # for fretboard diagrams
+        for o, cs in all_chord_symbols.items():
+            all_chords_drop[o] = voicing_for_chord_symbol(cs, melody_for_chord[o], minimum_fret, maj_triad, min_triad, drop_type)
+    return all_chords_drop
+
+def place_voicings(leadsheet, all_chords_drop, minimum_fret, maximum_fret, drop_type):
+    """ place_leadsheet() for voicings worked out already. Voicings that
+    fit nowhere are set to None in all_chords_drop.
+    """
+    all_chord_symbols = leadsheet.all_chord_symbols
+    all_notes = leadsheet.all_notes
+    offsets = leadsheet.offsets
+
+    with stage('positions'):
+        ######
+        # figure out chord positions and melody string nums
+        #
+        chord_neck_positions = {}
+        melody_neck_positions = {}
+        chord_note_frets = {}
+        melody_string_nums = {}
+        chord_interval_names = {}
+        current_pos = minimum_fret
+        chord_offsets = [o for o in offsets if o in all_chords_drop]
+        positions = positions_for_chords([all_chords_drop[o] for o in chord_offsets], minimum_fret, maximum_fret, drop_type)
+        positions = dict(zip(chord_offsets, positions))
+        for o in offsets:
+            if o in all_chords_drop:
+                if positions[o] is None:
+                    all_chords_drop[o] = None
+                else:
+                    melody_string, np = positions[o]
+                    c = all_chords_drop[o]
+                    current_pos = int(min(np))
+                    chord_note_frets[o] = np
+                    cs = all_chord_symbols[o]
+                    chord_interval_names[o] = interval_names_for_chord(c, cs)
+                    chord_neck_positions[o] = current_pos
+                    melody_string_nums[o] = melody_string + 1
+            if o in all_notes:
+                melody_neck_positions[o] = current_pos
+
+    return Placement(all_chords_drop, chord_note_frets, melody_string_nums, chord_interval_names,
+                     chord_neck_positions, melody_neck_positions)
+
+def write_arrangement(filename, src, measures, melody_content, root_chord_content, drop_chord_content,
+                      placed_chords, melody_positions, notation, orientation, interval_names, drop_type,
+                      output_name, pdf):
+    """ The rest of arrange_leadsheet() once the LilyPond text of the
+    voices is there: fret diagram tables, tablature positions and the
+    template, written out and typeset. placed_chords yields (melody
+    string number, frets, interval names) for each placed chord, and
+    melody_positions is the neck position for each melody note.
+    """
     melody_content.insert(0, f'\\set Score.currentBarNumber = #{measures[0].number}')
 
-    # Get the lilypond text for the drop chord content
-    lpc.context = lily.lilyObjects.LyMusicList()
-    lpc.appendObjectsToContextFromStream(lilychords)
-    drop_chord_content = str(lpc.context).split('\n')
-    drop_chord_content = [s for s in drop_chord_content if not s.startswith('\\')]
-
-    # Get the lilypond text for the root chord content
-    lpc.context = lily.lilyObjects.LyMusicList()
-    lpc.appendObjectsToContextFromStream(lilychordsroot)
-    root_chord_content = str(lpc.context).split('\n')
-    root_chord_content = [s.replace('r ','s ') for s in root_chord_content if not s.startswith('\\')]
-
-    # Replace tied chord endings with rests (for weird time signatures)
-    for i in range(1,len(root_chord_content)):
-        if '~' in root_chord_content[i-1]:
-            root_chord_content[i] = re.sub('<.*>', 's', root_chord_content[i])
-    for i in range(1,len(drop_chord_content)):
-        if '~' in drop_chord_content[i-1]:
-            drop_chord_content[i] = re.sub('<.*>', 'r', drop_chord_content[i])
-
-    # Build the fretboard diagrams for the drop voicings
-    string_offsets = []
-    if drop_type == 'drop2':
-        string_offsets = [0, 1, 2, 3]
-    elif drop_type == 'drop3':
-        string_offsets = [0, 1, 2, 4]
-    elif drop_type == 'drop24':
-        string_offsets = [0, 1, 3, 4]
-
-    i = 0
-    cc = copy.deepcopy(drop_chord_content)
-    fretboard_templates = copy.deepcopy(drop_chord_content)
-
-    for j, l in enumerate(cc):
-        if '~' in cc[j-1]:
-            fretboard_templates[j] = ''
-            drop_chord_content[j] = f'\\set predefinedDiagramTable = #fret-table-{i}\n          ' + drop_chord_content[j]
-            continue
-        if '<' not in l or '>' not in l:
-            continue
-        mel_string_num = melody_string_nums[list(melody_string_nums.keys())[i]]
-        note_pos = chord_note_frets[list(chord_note_frets.keys())[i]]
-        interval_name = chord_interval_names[list(chord_interval_names.keys())[i]]
-        fretboard_templates[j] = f'#(define fret-table-{i} (make-fretboard-table))\n\n' + \
-                                 f'\\storePredefinedDiagram #fret-table-{i}\n' + \
-                                 fretboard_templates[j] + '\n'
-        fretboard_templates[j] += '#guitar-tuning\n'
-        fretboard_templates[j] += '#\'('
-        fretboard_templates[j] += f'(place-fret {mel_string_num + string_offsets[0]} {int(note_pos[0])} "{interval_name[3]}")'
-        fretboard_templates[j] += f'(place-fret {mel_string_num + string_offsets[1]} {int(note_pos[1])} "{interval_name[2]}")'
-        fretboard_templates[j] += f'(place-fret {mel_string_num + string_offsets[2]} {int(note_pos[2])} "{interval_name[1]}")'
-        fretboard_templates[j] += f'(place-fret {mel_string_num + string_offsets[3]} {int(note_pos[3])} "{interval_name[0]}"))'
-        fretboard_templates[j] += f'\n'
-        drop_chord_content[j] = f'\\set predefinedDiagramTable = #fret-table-{i}\n          ' + drop_chord_content[j]
-        i += 1
+    with stage('fret_tables'):
+        # Build the fretboard diagrams for the drop voicings
+        fretboard_templates, drop_chord_content = fretboard_tables(drop_chord_content, iter(placed_chords),
+                                                                   drop_string_offsets.get(drop_type, []))
+    count('fret_tables', len(fretboard_templates))
 
     # convert melody to tab with positions
     if notation == 'tablature':
-        mel_i = 0
-        for i, l in enumerate(list(melody_content)):
-            if ('\\' not in l and
-                    '{' not in l and
-                    '}' not in l and
-                    l.strip() != ''):
-                p = melody_neck_positions[list(melody_neck_positions.keys())[mel_i]]
-                p = max(p-1, 0)
-                melody_content.insert(i + mel_i, f'\\set TabStaff.minimumFret = #{p}')
-                mel_i += 1
-
-    # build header
-    header = []
-    if src.metadata.title is not None: header += [f'title = "{src.metadata.title}"'];
-    if src.metadata.composer is not None: header += [f'composer = "{src.metadata.composer}"'];
-    header += [f'tagline = ##f']
-
-    # build paper block
-    paper = []
-
-    # final template values
-    vals = {}
-    vals['header'] =             '\n    '.join(header)
-    vals['fretboard_templates'] = '\n'.join([f for f in fretboard_templates if '<' in f])
-    vals['chord_symbols'] =      '\n              '.join(root_chord_content)
-    vals['interval_names'] =     True if interval_names == 'intervals_on' else False
-    vals['orientation'] =        '\\override FretBoard.fret-diagram-details.orientation = #\'landscape' if orientation == 'landscape' else ''
-    vals['fretboard_diagrams'] = '\n          '.join(drop_chord_content)
-    vals['staff_type'] =         'TabStaff' if notation == 'tablature' else 'Staff'
-    vals['staff_headers'] =      '\\set TabStaff.restrainOpenStrings = ##t' if notation == 'tablature' else ''
-    vals['melody'] =             '\n          '.join(melody_content)
-    vals['paper'] =              '\n    '.join(paper)
-
-    # write the final lilypond file from template
-    with open('templates/lilypond.ly', 'r') as f:
-        final = chevron.render(f, vals)
-        lilyfile = filename.replace('.mxl', '.ly')
-        lilyfile = "data/output/" + lilyfile
-        with open(lilyfile, 'w') as lf:
-            print(f'writing {lilyfile}')
-            lf.write(final)
+        with stage('tab'):
+            melody_content = tab_positions(melody_content, melody_positions)
+
+    with stage('template'):
+        # build header
+        header = []
+        if src.metadata.title is not None: header += [f'title = "{src.metadata.title}"'];
+        if src.metadata.composer is not None: header += [f'composer = "{src.metadata.composer}"'];
+        header += ['tagline = ##f']
+
+        # build paper block
+        paper = []
+
+        # final template values
+        vals = {}
+        vals['header'] =             '\n    '.join(header)
+        vals['fretboard_templates'] = '\n'.join(fretboard_templates)
+        vals['chord_symbols'] =      '\n              '.join(root_chord_content)
+        vals['interval_names'] =     True if interval_names == 'intervals_on' else False
+        vals['orientation'] =        '\\override FretBoard.fret-diagram-details.orientation = #\'landscape' if orientation == 'landscape' else ''
+        vals['fretboard_diagrams'] = '\n          '.join(drop_chord_content)
+        vals['staff_type'] =         'TabStaff' if notation == 'tablature' else 'Staff'
+        vals['staff_headers'] =      '\\set TabStaff.restrainOpenStrings = ##t' if notation == 'tablature' else ''
+        vals['melody'] =             '\n          '.join(melody_content)
+        vals['paper'] =              '\n    '.join(paper)
+
+        # write the final lilypond file from template
+        with open('templates/lilypond.ly', 'r') as f:
+            final = chevron.render(f, vals)
+            lilyfile = output_lilyfile(filename, output_name)
+            with open(lilyfile, 'w') as lf:
+                print(f'writing {lilyfile}')
+                lf.write(final)
 
     # typeset the lilypond into PDF
-    os.system(f'{os.environ.get("LILYPOND_PATH")} -o {lilyfile.replace(".ly", "")} {lilyfile}')
+    if pdf:
+        with stage('typeset'):
+            typeset(lilyfile)
+
+    save_caches()
+
+    return lilyfile
+
+def output_lilyfile(filename, output_name=None):
+    """ Where the .ly file for a leadsheet goes. """
+    lilyfile = filename.replace('.mxl', '.ly') if output_name is None else output_name + '.ly'
+    return "data/output/" + lilyfile
+
+def music21_version():
+    """ music21's version, without importing it. """
+    from importlib import metadata
+    try:
+        return metadata.version('music21')
+    except metadata.PackageNotFoundError:
+        import music21
+        return music21.VERSION_STR
+
+@functools.lru_cache()
+def code_version():
+    """ A hash of the arranger's source files and the music21 version.
+    Cached output is keyed by it, so it goes stale with the code.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    parts = [music21_version()]
+    for path in sorted(glob.glob(os.path.join(here, '*.py'))):
+        with open(path, 'rb') as f:
+            parts += [os.path.basename(path), f.read()]
+    return content_hash(*parts)
+
+_artifact_caches = {}
+
+def artifact_cache(name):
+    """ The ArtifactCache in the directory named by the environment
+    variable `name`, if set, bounded to `name`_MB megabytes (default 512).
+    """
+    setup_environment()
+    path = os.environ.get(name)
+    if not path:
+        return None
+    if path not in _artifact_caches:
+        _artifact_caches[path] = ArtifactCache(path, int(os.environ.get(name + '_MB', 512)) * 1024 * 1024)
+    return _artifact_caches[path]
+
+def output_cache():
+    """ Arranged .ly and PDF files, in OUTPUT_CACHE. """
+    return artifact_cache('OUTPUT_CACHE')
+
+def parse_cache():
+    """ Parsed leadsheets, in PARSE_CACHE. """
+    return artifact_cache('PARSE_CACHE')
+
+def arrangement_key(filepath, options):
+    """ Cache key of an arrangement: the leadsheet's bytes and file name,
+    which untitled leadsheets are titled with, every option that changes
+    the output (defaults filled in), the template and the code version.
+    """
+    bound = inspect.signature(arrange_leadsheet).bind(None, **options)
+    bound.apply_defaults()
+    arguments = {k: v for k, v in bound.arguments.items() if k not in ('leadsheet', 'output_name', 'pdf')}
+    with open(filepath, 'rb') as f:
+        leadsheet = f.read()
+    with open('templates/lilypond.ly', 'rb') as f:
+        template = f.read()
+    return content_hash(leadsheet, os.path.basename(filepath), repr(sorted(arguments.items())), template,
+                        code_version())
+
+def generate_arrangement(filepath,
+                   minimum_fret=5,
+                   maximum_fret=15,
+                   maj_triad='major-seven',
+                   min_triad='minor-seven',
+                   notation='tablature',
+                   orientation='standard',
+                   interval_names='intervals_off',
+                   drop_type='drop2',
+                   output_name=None,
+                   emitter='direct',
+                   pdf=True,
+                   *,
+                   metrics=None):
+    """ Parse, arrange and typeset a leadsheet. With OUTPUT_CACHE set, a
+    leadsheet already arranged with the same options is copied from the
+    cache instead. The time spent in each stage goes into metrics, a
+    metrics_tools.Metrics, if given, or into a JSON line in METRICS_LOG
+    if that is set.
+    """
+    setup_environment()
+    options = dict(minimum_fret=minimum_fret, maximum_fret=maximum_fret, maj_triad=maj_triad, min_triad=min_triad,
+                   notation=notation, orientation=orientation, interval_names=interval_names, drop_type=drop_type,
+                   output_name=output_name, emitter=emitter, pdf=pdf)
+    with measure_job(filepath, metrics):
+        cache = output_cache()
+        if cache is None:
+            return arrange_leadsheet(parse_leadsheet(filepath), **options)
+
+        with stage('output_cache'):
+            key = arrangement_key(filepath, options)
+            lilyfile = output_lilyfile(os.path.basename(filepath), output_name)
+            targets = {'.ly': lilyfile}
+            if pdf:
+                targets['.pdf'] = pdf_path(lilyfile)
+            hit = cache.fetch(key, targets)
+        if hit:
+            count('output_cache_hits')
+            return lilyfile
+
+        lilyfile = arrange_leadsheet(parse_leadsheet(filepath), **options)
+        with stage('output_cache'):
+            cache.put(key, targets)
+        return lilyfile
+
+def leadsheet_keys(leadsheet, keys=None):
+    """ The (name, transposition) of each key to arrange a leadsheet in,
+    named after the key signature of its first measure: all twelve, or
+    those named in keys, in that order.
+    """
+    first = leadsheet.measures[0].keySignature
+    sharps = first.sharps if first is not None else 0
+    mode = first.mode if first is not None and 'music21.key.Key' in first.classSet else 'major'
+    available = {key_name(key_fifths(sharps, t), mode): t for t in key_transpositions(sharps)}
+    if keys is None:
+        return list(available.items())
+    missing = [k for k in keys if k not in available]
+    if missing:
+        raise ValueError(f'unknown keys {", ".join(missing)}, expected some of {", ".join(available)}')
+    return [(k, available[k]) for k in keys]
+
+def arrange_keys(leadsheet, keys=None, metrics=False, minimum_fret=5, maximum_fret=15, maj_triad='major-seven',
+                 min_triad='minor-seven', notation='tablature', orientation='standard', interval_names='intervals_off',
+                 drop_type='drop2', output_name=None, emitter='direct', pdf=True):
+    """ Arrange a parsed leadsheet in several keys, see leadsheet_keys().
+    Yields (key name, ArrangementResult) as each key is written, named
+    after output_name (or the leadsheet) and the key, e.g. tune-Eb.
+
+    The voicings are worked out once, in the leadsheet's own key, and
+    transposed for every other key. Only placing them on the neck and
+    writing the LilyPond text are done per key. Chords without a melody
+    note are voiced again per key, as their octave depends on the
+    minimum fret, and so are the few whose melody note did not end up
+    on top, which happens when its spelling throws the octave off. In
+    a key where a chord's symbol or melody note is spelled across an
+    octave (a B# or Cb, see keeps_octaves()), it is voiced again too.
+    """
+    setup_environment()
+    melody_for_chord = leadsheet.melody_for_chord
+    base = leadsheet.filename.replace('.mxl', '') if output_name is None else output_name
+    voicings = leadsheet_voicings(leadsheet, minimum_fret, maj_triad, min_triad, drop_type)
+    relative = {o for o, v in voicings.items()
+                if melody_for_chord[o] is not None and max(v.pitches, default=None) == melody_for_chord[o].pitch.ps}
+    spellings = {}
+    for o in relative:
+        record = chord_record(leadsheet.all_chord_symbols[o])
+        spellings[o] = record.base + record.extensions + (spelled_pitch(melody_for_chord[o].pitch),)
+    for name, transposition in leadsheet_keys(leadsheet, keys):
+        key_output = f'{base}-{name}'
+        m = job_metrics(key_output, metrics)
+        try:
+            with measure_job(key_output, m), transposed(leadsheet, transposition):
+                count('measures', len(leadsheet.measures))
+                count('notes', len(leadsheet.all_notes))
+                count('chords', len(leadsheet.all_chord_symbols))
+                with stage('voicings'):
+                    all_chords_drop = {}
+                    for o, cs in leadsheet.all_chord_symbols.items():
+                        if o in relative and keeps_octaves(spellings[o], transposition):
+                            all_chords_drop[o] = transpose_voicing(voicings[o], transposition)
+                        else:
+                            all_chords_drop[o] = voicing_for_chord_symbol(cs, melody_for_chord[o], minimum_fret,
+                                                                          maj_triad, min_triad, drop_type)
+                placement = place_voicings(leadsheet, all_chords_drop, minimum_fret, maximum_fret, drop_type)
+                lilyfile = arrange_placement(leadsheet, placement, notation, orientation, interval_names, drop_type,
+                                             key_output, emitter, pdf)
+            yield name, ArrangementResult(leadsheet.filename, lilyfile, None, m)
+        except Exception as e:
+            yield name, ArrangementResult(leadsheet.filename, None, e, m)
+
+def generate_keys(filepath, keys=None, callback=None, pdf=True, batch_size=8, timeout=None, metrics=False,
+                  **options):
+    """ Arrange a leadsheet in all twelve keys, or in those named in keys
+    (see leadsheet_keys()), parsing it and voicing its chords once.
+
+    Returns a dict of ArrangementResult by key name, in order. The .ly
+    files are typeset batch_size at a time per lilypond run, with a
+    timeout per file; pdf=False skips typesetting. callback and
+    metrics work as in generate_variants().
+    """
+    options['pdf'] = False
+    leadsheet = parse_leadsheet(filepath)
+    with Typesetter(concurrency=1, batch_size=batch_size, timeout=timeout) as typesetter:
+        arranged = arrange_keys(leadsheet, keys, metrics, **options)
+        results = _typeset_arranged(arranged, typesetter if pdf else None, callback)
+    return {name: results[name] for name, transposition in leadsheet_keys(leadsheet, keys)}
+
+def generate_preview(filepath, format='json', metrics=None, **options):
+    """ Parse a leadsheet and return its preview_leadsheet() document as
+    JSON or msgpack bytes, without writing any LilyPond. Takes the
+    options of generate_arrangement(); those that only change the
+    LilyPond output make no difference here.
+    """
+    inspect.signature(arrange_leadsheet).bind(None, **options)
+    parameters = inspect.signature(preview_leadsheet).parameters
+    setup_environment()
+    with measure_job(filepath, metrics):
+        document = preview_leadsheet(parse_leadsheet(filepath), **{k: v for k, v in options.items() if k in parameters})
+        with stage('encode'):
+            return encode(document, format)
+
+_async_pool = None
+
+def async_executor():
+    """ The pool of worker processes that generate_arrangement_async()
+    arranges in unless given an executor, one per core, started on first
+    use with music21 imported.
+    """
+    global _async_pool
+    if _async_pool is None:
+        _async_pool = futures.ProcessPoolExecutor(max_workers=os.cpu_count() or 1, initializer=_warm_worker)
+    return _async_pool
+
+def _arrange_for_async(filepath, options, pdf, metrics=None):
+    # runs in the executor: write the .ly file, or fetch it and its PDF
+    # from OUTPUT_CACHE. Returns the .ly file, the cache key, whether the
+    # PDF is there already, and the job's Metrics
+    setup_environment()
+    with measure_job(filepath, metrics) as m:
+        cache = output_cache()
+        if cache is None or not pdf:
+            return generate_arrangement(filepath, **dict(options, pdf=False)), None, False, m
+
+        lilyfile = output_lilyfile(os.path.basename(filepath), options.get('output_name'))
+        with stage('output_cache'):
+            key = arrangement_key(filepath, options)
+            hit = cache.fetch(key, {'.ly': lilyfile, '.pdf': pdf_path(lilyfile)})
+        if hit:
+            count('output_cache_hits')
+            return lilyfile, key, True, m
+        lilyfile = arrange_leadsheet(parse_leadsheet(filepath), **dict(options, pdf=False))
+        with stage('output_cache'):
+            cache.put(key, {'.ly': lilyfile})
+        return lilyfile, key, False, m
+
+async def generate_arrangement_async(filepath, metrics=None, executor=None, timeout=None, **options):
+    """ generate_arrangement() for asyncio. The arrangement runs in
+    executor, by default async_executor(), and lilypond runs as an
+    asyncio subprocess, so one event loop can wait on many jobs.
+
+    timeout is a deadline in seconds for the whole job, past which it
+    raises asyncio.TimeoutError. Cancelling the job or missing its
+    deadline kills lilypond. An arrangement still queued in the executor
+    never starts; one already running finishes there and is dropped.
+    """
+    import asyncio
+    return await asyncio.wait_for(_generate_arrangement_async(filepath, metrics, executor, options), timeout)
+
+async def _generate_arrangement_async(filepath, metrics, executor, options):
+    import asyncio
+    loop = asyncio.get_running_loop()
+    pdf = options.pop('pdf', True)
+    lilyfile, key, cached, m = await loop.run_in_executor(executor or async_executor(), _arrange_for_async,
+                                                          filepath, options, pdf, metrics)
+    if metrics is not None and m is not metrics:
+        # a worker process filled in a copy
+        vars(metrics).update(vars(m))
+    if pdf and not cached:
+        result = await typeset_async(lilyfile)
+        if metrics is not None:
+            metrics.add('typeset', result.elapsed)
+        if key is not None:
+            await loop.run_in_executor(None, output_cache().put, key, {'.pdf': result.pdf})
+    return lilyfile
+
+_leadsheet = None
+
+def _share_leadsheet(leadsheet):
+    # forked workers inherit the parsed leadsheet, others parse the file once
+    global _leadsheet
+    _warm_worker()
+    _leadsheet = parse_leadsheet(leadsheet) if isinstance(leadsheet, str) else leadsheet
+
+def job_metrics(label, metrics):
+    """ The Metrics to collect for one job of a batch: always with
+    metrics=True, and set up from the environment when it asks for them,
+    so a JOB_MEMORY_MB budget holds either way.
+    """
+    return metrics_from_environment(label) or (Metrics(label) if metrics else None)
+
+def _arrange_variant(options, leadsheet=None, metrics=False):
+    leadsheet = leadsheet or _leadsheet
+    m = job_metrics(options['output_name'], metrics)
+    try:
+        with measure_job(options['output_name'], m):
+            lilyfile = arrange_leadsheet(leadsheet, **options)
+        return ArrangementResult(leadsheet.filename, lilyfile, None, m)
+    except Exception as e:
+        return ArrangementResult(leadsheet.filename, None, e, m)
+
+def variant_name(filename, options):
+    """ Output name for one variant: the leadsheet name followed by the
+    options that differ from the defaults, e.g. tune-drop3-landscape.
+    """
+    defaults = inspect.signature(arrange_leadsheet).parameters
+    parts = [filename.replace('.mxl', '')]
+    parts += [str(options[k]) for k, p in defaults.items() if k in options and options[k] != p.default]
+    return '-'.join(parts)
+
+def generate_variants(filepath, variants, workers=None, callback=None, pdf=True, batch_size=8, timeout=None,
+                      metrics=False):
+    """ Arrange one leadsheet with several option sets, parsing it once.
+
+    variants is a list of option dicts for arrange_leadsheet(). Each
+    variant is written under its own variant_name() unless it sets
+    output_name. Returns one ArrangementResult per variant, in order.
+    With more than one worker the parsed leadsheet is handed to forked
+    worker processes instead of being parsed again in each of them.
+    The .ly files are typeset batch_size at a time per lilypond run,
+    with a timeout per file; pdf=False skips typesetting. metrics=True
+    gives every result the Metrics of its variant.
+    """
+    variants = [dict(v) for v in variants]
+    for v in variants:
+        v.setdefault('output_name', variant_name(os.path.basename(filepath), v))
+        v['pdf'] = False
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(variants)))
+
+    with Typesetter(concurrency=workers, batch_size=batch_size, timeout=timeout) as typesetter:
+        typesetter = typesetter if pdf else None
+        if workers == 1:
+            leadsheet = parse_leadsheet(filepath)
+            arranged = ((i, _arrange_variant(v, leadsheet, metrics)) for i, v in enumerate(variants))
+            results = _typeset_arranged(arranged, typesetter, callback)
+        else:
+            if 'fork' in multiprocessing.get_all_start_methods():
+                context, shared = multiprocessing.get_context('fork'), parse_leadsheet(filepath)
+            else:
+                context, shared = None, filepath
+            with futures.ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                             initializer=_share_leadsheet, initargs=(shared,)) as pool:
+                jobs = {pool.submit(_arrange_variant, v, None, metrics): i for i, v in enumerate(variants)}
+                arranged = ((jobs[job], job.result()) for job in futures.as_completed(jobs))
+                results = _typeset_arranged(arranged, typesetter, callback)
+    return [results[i] for i in range(len(variants))]
+
+def find_leadsheets(paths):
+    """ Expand files, directories and glob patterns into a sorted
+    list of leadsheet files. Directories contribute their .mxl files.
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    found = []
+    for p in paths:
+        if os.path.isdir(p):
+            found += glob.glob(os.path.join(p, '*.mxl'))
+        elif os.path.isfile(p):
+            found += [p]
+        else:
+            found += glob.glob(p)
+    return sorted(set(found))
+
+def _warm_worker():
+    # import music21 and create a converter before the first job comes in
+    setup_environment()
+    lilypond_converter()
+
+def _arrange_one(filepath, options, metrics=False):
+    m = job_metrics(filepath, metrics)
+    try:
+        return ArrangementResult(filepath, generate_arrangement(filepath, metrics=m, **options), None, m)
+    except Exception as e:
+        return ArrangementResult(filepath, None, e, m)
+
+def _typeset_arranged(arranged, typesetter, callback=None):
+    # typeset the .ly files of (key, ArrangementResult) pairs as they come
+    # in, a batch per lilypond run, and return the results by key with any
+    # lilypond failure in their error field and the typeset time in their
+    # metrics
+    results = {}
+    batch, jobs = [], []
+    def finish(key, r):
+        results[key] = r
+        if callback is not None:
+            callback(r)
+    def flush():
+        if batch:
+            jobs.append((list(batch), typesetter.submit([r.lilyfile for key, r in batch])))
+            batch.clear()
+
+    for key, r in arranged:
+        if r.error is not None or typesetter is None:
+            finish(key, r)
+            continue
+        batch.append((key, r))
+        if len(batch) >= typesetter.batch_size:
+            flush()
+    flush()
+    for batch, job in jobs:
+        for (key, r), t in zip(batch, job.result()):
+            if r.metrics is not None:
+                r.metrics.add('typeset', t.elapsed)
+            finish(key, r if t.error is None else r._replace(error=t.error))
+    return results
+
+def generate_arrangements(paths, workers=None, callback=None, batch_size=8, timeout=None, metrics=False, **options):
+    """ Arrange every leadsheet found in paths (files, directories or
+    glob patterns) across a pool of worker processes.
+
+    Returns one ArrangementResult per file, in sorted file order. A failing
+    file only records its exception in the result's error field, the rest
+    of the batch keeps going. callback, if given, is called with each
+    result as soon as it completes. The .ly files are typeset batch_size
+    at a time per lilypond run, with a timeout per file. With OUTPUT_CACHE
+    set, files already arranged with the same options come from the cache.
+    metrics=True gives every arranged result the Metrics of its job.
+    """
+    filepaths = find_leadsheets(paths)
+    pdf = options.pop('pdf', True)
+    options['pdf'] = False
+
+    # whole hits skip the workers and lilypond; workers still find
+    # cached .ly files on their own
+    results = {}
+    cache = output_cache() if pdf else None
+    keys = {f: arrangement_key(f, options) for f in filepaths} if cache is not None else {}
+    for f in keys:
+        lilyfile = output_lilyfile(os.path.basename(f), options.get('output_name'))
+        if cache.fetch(keys[f], {'.ly': lilyfile, '.pdf': pdf_path(lilyfile)}):
+            results[f] = ArrangementResult(f, lilyfile, None)
+            if callback is not None:
+                callback(results[f])
+    todo = [f for f in filepaths if f not in results]
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(todo)))
+    with Typesetter(concurrency=workers, batch_size=batch_size, timeout=timeout) as typesetter:
+        typesetter = typesetter if pdf else None
+        if workers == 1:
+            arranged = ((f, _arrange_one(f, options, metrics)) for f in todo)
+            typeset_results = _typeset_arranged(arranged, typesetter, callback)
+        else:
+            with futures.ProcessPoolExecutor(max_workers=workers, initializer=_warm_worker) as pool:
+                jobs = [pool.submit(_arrange_one, f, options, metrics) for f in todo]
+                arranged = ((r.filepath, r) for r in (job.result() for job in futures.as_completed(jobs)))
+                typeset_results = _typeset_arranged(arranged, typesetter, callback)
+
+    for f, r in typeset_results.items():
+        if cache is not None and r.error is None:
+            cache.put(keys[f], {'.pdf': pdf_path(r.lilyfile)})
+    results.update(typeset_results)
+    return [results[f] for f in filepaths]
+
+def _print_result(r):
+    if r.error is None:
+        print(f'ok     {r.filepath} -> {r.lilyfile}')
+    else:
+        print(f'failed {r.filepath}: {type(r.error).__name__} {r.error}')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate chord-melody arrangements from MusicXML leadsheets.')
+    parser.add_argument('paths', nargs='+', help='leadsheet files, directories or glob patterns')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='worker processes (default: one per core)')
+    parser.add_argument('--minimum-fret', type=int, default=5)
+    parser.add_argument('--maximum-fret', type=int, default=15)
+    parser.add_argument('--maj-triad', default='major-seven',
+                        choices=['major-seven', 'major-six', 'major-nine', 'major-six-nine'])
+    parser.add_argument('--min-triad', default='minor-seven',
+                        choices=['minor-seven', 'minor-six', 'minor-nine', 'minor-six-nine'])
+    parser.add_argument('--notation', default='tablature', choices=['tablature', 'standard'])
+    parser.add_argument('--orientation', default='standard', choices=['standard', 'landscape'])
+    parser.add_argument('--interval-names', default='intervals_off', choices=['intervals_off', 'intervals_on'])
+    parser.add_argument('--drop-type', default='drop2', choices=['drop2', 'drop3', 'drop24'])
+    parser.add_argument('--emitter', default='direct', choices=['direct', 'music21'],
+                        help='write LilyPond text directly, or through music21\'s LilypondConverter')
+    parser.add_argument('--batch-size', type=int, default=8, help='.ly files typeset per lilypond run')
+    parser.add_argument('--timeout', type=float, default=None, help='lilypond seconds per file (default: LILYPOND_TIMEOUT)')
+    parser.add_argument('--no-pdf', dest='pdf', action='store_false', help='only write the .ly files')
+    parser.add_argument('--keys', nargs='*', default=None,
+                        help='also arrange in these keys, e.g. Bb F#m (no names: all twelve), one leadsheet at a time')
+    args = parser.parse_args(argv)
+
+    options = vars(args)
+    paths = options.pop('paths')
+    workers = options.pop('workers')
+    keys = options.pop('keys')
+    if keys is not None:
+        results = []
+        for filepath in find_leadsheets(paths):
+            try:
+                results += generate_keys(filepath, keys or None, callback=_print_result, **options).values()
+            except Exception as e:
+                results.append(ArrangementResult(filepath, None, e))
+                _print_result(results[-1])
+    else:
+        results = generate_arrangements(paths, workers=workers, callback=_print_result, **options)
+
+    failed = [r for r in results if r.error is not None]
+    print(f'{len(results) - len(failed)} arranged, {len(failed)} failed')
+    return 1 if failed else 0
 
 if __name__ == "__main__":
-    generate_arrangement(sys.argv[1])
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
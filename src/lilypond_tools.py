@@ -0,0 +1,367 @@
+from metrics_tools import count
+
+class EmitterUnsupported(Exception):
+    """ Raised for notation the direct emitter does not handle, so the
+    caller can fall back to music21's LilypondConverter.
+    """
+    pass
+
+# same tables as music21's LilypondConverter
+accidental_suffixes = {
+    'double-sharp': 'isis',
+    'double-flat': 'eses',
+    'one-and-a-half-sharp': 'isih',
+    'one-and-a-half-flat': 'eseh',
+    'sharp': 'is',
+    'flat': 'es',
+    'half-sharp': 'ih',
+    'half-flat': 'eh'}
+
+alter_suffixes = {-2: 'eses', -1: 'es', 0: '', 1: 'is', 2: 'isis'}
+
+clef_names = [
+    ('Treble8vbClef', 'treble_8'),
+    ('TrebleClef', 'treble'),
+    ('BassClef', 'bass'),
+    ('AltoClef', 'alto'),
+    ('TenorClef', 'tenor'),
+    ('SopranoClef', 'soprano'),
+    ('PercussionClef', 'percussion')]
+
+def octave_marks(octave):
+    return ',' * (3 - octave) if octave < 3 else '\'' * (octave - 3)
+
+def lily_pitch(p):
+    name = p.step.lower()
+    if p.accidental is not None:
+        name += accidental_suffixes.get(p.accidental.name, '')
+    return name + octave_marks(p.implicitOctave) + ' '
+
+def lily_voicing_pitch(midi, step):
+    # pitch names for a Voicing, spelled like Voicing.to_chord()
+    octave = step // 7
+    alter = midi - 12 * (octave + 1) - [0, 2, 4, 5, 7, 9, 11][step % 7]
+    return 'cdefgab'[step % 7] + alter_suffixes.get(alter, '') + octave_marks(octave) + ' '
+
+def accidental_marks(p):
+    marks = []
+    if p.accidental is not None:
+        if p.accidental.displayType == 'always':
+            marks.append('! ')
+        if p.accidental.displayStyle == 'parentheses':
+            marks.append('? ')
+    return marks
+
+_durations = {}
+
+def lily_duration(d):
+    """ Duration text for a simple (single component) duration. """
+    key = (d.type, d.dots)
+    if key not in _durations:
+        from music21 import duration
+        try:
+            number = duration.convertTypeToNumber(d.type)
+        except duration.DurationException:
+            raise EmitterUnsupported(f'duration {d}')
+        if number == 0.5:
+            number = '\\breve'
+        elif number == 0.25:
+            number = '\\longa'
+        elif number < 1:
+            raise EmitterUnsupported(f'duration {d}')
+        else:
+            number = int(number)
+        _durations[key] = f'{number}' + '.' * int(d.dots) + ' '
+    return _durations[key]
+
+_split_durations = {}
+
+def split_duration(ql):
+    """ Duration texts for a chord or rest lasting ql quarters, one per
+    tied piece, as music21 splits complex durations.
+    """
+    if ql not in _split_durations:
+        from music21 import duration
+        d = duration.Duration(ql)
+        if d.tuplets or any(c.tuplets for c in d.components if hasattr(c, 'tuplets')):
+            raise EmitterUnsupported(f'tuplet duration {ql}')
+        if d.type == 'complex':
+            pieces = [duration.Duration(c.quarterLength) for c in d.components]
+        else:
+            pieces = [d]
+        for p in pieces:
+            if p.type == 'complex' or p.tuplets:
+                raise EmitterUnsupported(f'duration {ql}')
+        _split_durations[ql] = [lily_duration(p) for p in pieces]
+    return _split_durations[ql]
+
+def hidden(el):
+    return el.hasStyleInformation and el.style.hideObjectOnPrint
+
+def beam_lines(n):
+    left = right = 0
+    if getattr(n, 'beams', None) is not None:
+        for b in n.beams:
+            if b.type == 'start':
+                right += 1
+            elif b.type == 'continue':
+                right += 1
+                left += 1
+            elif b.type == 'stop':
+                left += 1
+            elif b.type == 'partial':
+                if b.direction == 'left':
+                    left += 1
+                else:
+                    right += 1
+    lines = []
+    if left > 0:
+        lines.append(f'\\set stemLeftBeamCount = #{left}')
+    if right > 0:
+        lines.append(f'\\set stemRightBeamCount = #{right}')
+    return lines
+
+def note_line(n):
+    parts = ''
+    if n.hasStyleInformation and n.style.color and n.style.hideObjectOnPrint is False:
+        parts += '\\color "' + n.style.color + '" '
+    if 'Note' in n.classes:
+        if hidden(n):
+            parts += 's '
+        else:
+            parts += lily_pitch(n.pitch) + ''.join(accidental_marks(n.pitch))
+    elif 'SpacerRest' in n.classes or hidden(n):
+        parts += 's '
+    else:
+        parts += 'r '
+    parts += lily_duration(n.duration)
+    if getattr(n, 'beams', None):
+        if n.beams.beamsList[0].type == 'start':
+            parts += '[ '
+        elif n.beams.beamsList[0].type == 'stop':
+            parts += '] '
+
+    post = ''
+    if n.tie is not None and n.tie.type != 'stop':
+        post += ' ~ '
+    for e in n.expressions:
+        if 'Fermata' in e.classes:
+            post += ' \\fermata '
+    return parts + post + ' '
+
+def melody_note_lines(n):
+    """ Lines for one note or rest of the melody: beam and stem settings
+    followed by the note itself.
+    """
+    if n.duration.type == 'complex':
+        raise EmitterUnsupported('complex duration in the melody')
+    if n.duration.isGrace:
+        return []
+    lines = beam_lines(n)
+    stem = getattr(n, 'stemDirection', None)
+    if stem is not None and stem.upper() in ('UP', 'DOWN'):
+        lines.append(f'\\once \\override Stem #\'direction = #{stem.upper()} ')
+    lines.append(note_line(n))
+    return lines
+
+def header_line(el):
+    if 'Clef' in el.classes:
+        name = next((l for c, l in clef_names if c in el.classes), '')
+        return f'\\clef "{name}" '
+    if 'KeySignature' in el.classes:
+        k = el if 'music21.key.Key' in el.classSet else el.asKey('major')
+        name = k.tonic.step.lower()
+        if k.tonic.accidental is not None:
+            name += accidental_suffixes.get(k.tonic.accidental.name, '')
+        return f'\\key {name} \\{k.mode} '
+    if 'TimeSignature' in el.classes:
+        return f'\\time {el.ratioString}'
+    return '\\break'
+
+def melody_lines(measures):
+    """ The melody as the lines LilypondConverter writes for the melody
+    voice generate_arrangement builds.
+    """
+    lines = []
+    prev = None
+    for m in measures:
+        lines += melody_measure_lines(m, prev)
+        prev = m
+    lines.append('')
+    return lines
+
+def melody_measure_lines(m, prev):
+    """ melody_lines() for one measure, following measure prev, or None
+    for the first measure.
+    """
+    from music21 import layout
+    first = prev is None
+    lines = []
+    if not first:
+        lines.append(f'\\bar "|"  %{{ end measure {prev.number} %}} ')
+
+    # everything in the measure, in music21's sort order
+    elements = []
+    if first:
+        for el in (m.keySignature, m.timeSignature, m.clef):
+            if el is None:
+                raise EmitterUnsupported('first measure without clef, key or time signature')
+            elements.append((0.0, el.priority, el.classSortOrder, el))
+    for n in m:
+        if 'SystemLayout' in n.classes:
+            elements.append((0.0, 0, layout.SystemLayout.classSortOrder, n))
+        elif 'TimeSignature' in n.classes and not first:
+            elements.append((0.0, n.priority, n.classSortOrder, n))
+    for n in m:
+        if 'Note' in n.classes or 'Rest' in n.classes:
+            elements.append((n.offset, n.priority, n.classSortOrder, n))
+    elements.sort(key=lambda e: e[:3])
+
+    tuplet = None
+    for _, _, _, n in elements:
+        if 'Note' not in n.classes and 'Rest' not in n.classes:
+            lines.append(header_line(n))
+            continue
+        tuplets = n.duration.tuplets
+        if tuplets and tuplets[0].type == 'start' and not n.duration.isGrace:
+            if tuplet is not None:
+                raise EmitterUnsupported('nested tuplets')
+            tuplet = (int(tuplets[0].tupletNormal[0]), int(tuplets[0].tupletActual[0]), [])
+        note_lines = melody_note_lines(n)
+        if tuplet is None:
+            lines += note_lines
+        else:
+            tuplet[2].extend(note_lines)
+            if tuplets and tuplets[0].type == 'stop' and not n.duration.isGrace:
+                lines += tuplet_lines(*tuplet)
+                tuplet = None
+    if tuplet is not None:
+        raise EmitterUnsupported('tuplet across a barline')
+    return lines
+
+def tuplet_lines(numerator, denominator, inner):
+    text = f'\\times {numerator}/{denominator} {{ ' + ''.join(l + '\n   ' for l in inner) + ' } \n   '
+    return text.replace('\n\n', '\n').split('\n')
+
+def chord_body(c):
+    if hidden(c):
+        return 's  '
+    return '< ' + ' '.join(' '.join([lily_pitch(p)] + accidental_marks(p)) for p in c.pitches) + ' > '
+
+def voicing_body(v):
+    return '< ' + ' '.join(lily_voicing_pitch(midi, step) for midi, step in v.notes) + ' > '
+
+def chord_lines(measures, bodies, spacer):
+    """ Chord lines for the chords of each measure, with durations running
+    up to the next chord like realize_chord_durations.
+
+    bodies maps chord offsets to the '< ... >' text of the chord, or None
+    for a rest. Pieces of chords that need tied durations after the first
+    are written as spacer, as are rests.
+    """
+    lines = []
+    ts = None
+    for i, m in enumerate(measures):
+        measure_lines, ts = chord_measure_lines(m, i == 0, ts, bodies, spacer)
+        lines += measure_lines
+    lines.append('')
+    return lines
+
+def chord_measure_lines(m, first, ts, bodies, spacer):
+    """ chord_lines() for one measure, given the time signature in effect
+    before it. Returns the lines and the time signature in effect after.
+    """
+    # follow the time signature along, m.barDuration searches back
+    # through all the earlier measures when m has none of its own
+    if m.timeSignature is not None:
+        ts = m.timeSignature
+    bar = ts.barDuration.quarterLength if ts is not None else 4.0
+    has_header = first
+    chords = []
+    seen = set()
+    for n in m:
+        if 'TimeSignature' in n.classes:
+            ts = n
+        if 'SystemLayout' in n.classes or ('TimeSignature' in n.classes and not first):
+            has_header = True
+        elif 'Chord' in n.classes:
+            if 'N.C' in n.figure:
+                continue
+            o = n.offset + m.offset
+            body = bodies[o]
+            if o in seen:
+                # a second chord symbol at the same offset; the voicings
+                # skip the same ones, so count them with the symbols
+                if spacer == 's':
+                    count('duplicate_chords')
+                continue
+            seen.add(o)
+            chords.append((n.offset, body))
+    chords.sort(key=lambda c: c[0])
+
+    if not chords:
+        chords = [(0.0, None)]
+    elif chords[0][0] != 0.0 and not has_header:
+        chords.insert(0, (0.0, None))
+
+    lines = []
+    for j, (offset, body) in enumerate(chords):
+        end = chords[j + 1][0] if j + 1 < len(chords) else bar
+        pieces = split_duration(end - offset)
+        if body is None:
+            lines += [f'{spacer} {d} ' for d in pieces]
+        else:
+            # every piece but the last is tied to the next one
+            for k, d in enumerate(pieces):
+                tie = '~   ' if k + 1 < len(pieces) else ' '
+                lines.append((body if k == 0 else f'{spacer} ') + d + ' ' + tie)
+    return lines, ts
+
+def fretboard_tables(drop_chord_content, placed_chords, string_offsets):
+    """ Predefined diagram tables for the chord lines, in a single pass.
+
+    placed_chords yields (melody string number, frets, interval names)
+    for each chord line in order. Identical diagrams share one table, so
+    a voicing that comes back in the same position is stored only once.
+    Returns the table definitions and the chord lines, each now selecting
+    its table.
+    """
+    tables = []
+    interned = {}
+    i = None
+    lines = [None] * len(drop_chord_content)
+    for j, l in enumerate(drop_chord_content):
+        if '~' in drop_chord_content[j-1] and i is not None:
+            # a tied piece keeps the table of the chord it continues
+            lines[j] = f'\\set predefinedDiagramTable = #fret-table-{i}\n          ' + l
+            continue
+        if '<' not in l or '>' not in l:
+            lines[j] = l
+            continue
+        mel_string_num, note_pos, interval_name = next(placed_chords)
+        places = ''.join(f'(place-fret {mel_string_num + string_offsets[k]} {int(note_pos[k])} "{interval_name[3 - k]}")'
+                         for k in range(4))
+        key = (l[:l.index('>') + 1], places)
+        i = interned.get(key)
+        if i is None:
+            i = interned[key] = len(tables)
+            tables.append(f'#(define fret-table-{i} (make-fretboard-table))\n\n'
+                          f'\\storePredefinedDiagram #fret-table-{i}\n'
+                          f'{l}\n'
+                          '#guitar-tuning\n'
+                          f"#'({places})"
+                          '\n')
+        lines[j] = f'\\set predefinedDiagramTable = #fret-table-{i}\n          ' + l
+    return tables, lines
+
+def tab_positions(melody_content, positions):
+    """ Precede every note line of the melody with the minimum fret of
+    its neck position, taking positions in order.
+    """
+    positions = iter(positions)
+    lines = []
+    for l in melody_content:
+        if '\\' not in l and '{' not in l and '}' not in l and l.strip() != '':
+            lines.append(f'\\set TabStaff.minimumFret = #{max(next(positions) - 1, 0)}')
+        lines.append(l)
+    return lines
@@ -0,0 +1,294 @@
+""" Per-stage timing, counts and memory for arrangement jobs.
+
+Code marks its stages with `with stage('name'):` and counts things with
+count('name', n). Both go to the Metrics of the job running on this
+thread, and cost one attribute lookup when no job is being measured.
+
+measure_job() measures one job. It collects into the Metrics it is given, or
+into a new one when the environment asks for it:
+
+    METRICS_LOG     append a JSON line per job to this file ('-' for stderr)
+    METRICS_MEMORY  also record the peak memory of each stage: traced
+                    allocations, or resident size with METRICS_MEMORY=rss
+    JOB_MEMORY_MB   fail a job with MemoryBudgetExceeded once it has used
+                    this much memory (sampled as resident size unless
+                    METRICS_MEMORY asks for tracing)
+    PROFILE_DIR     write a cProfile dump per job into this directory
+
+Memory is per process, so it is only the job's own in a worker that runs
+one job at a time. What a process loads on first use, like music21, is
+loaded by the functions given to warm_up() before the first job whose
+memory is measured, so that job is not charged for it. The budget is checked at the end of each stage, in the
+job's thread, so a job over it stops between stages and the process
+carries on; a single stage can still go past it before it is caught.
+"""
+import contextlib
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+_active = threading.local()
+_warm_ups = []
+_off = contextlib.nullcontext()
+_profile_numbers = itertools.count()
+_page_size = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+rss_interval = 0.005
+
+class MemoryBudgetExceeded(Exception):
+    """ A job used more memory than its budget. """
+
+    def __init__(self, stage=None, used=None, budget=None):
+        super().__init__(stage, used, budget)
+        self.stage = stage
+        self.used = used
+        self.budget = budget
+
+    def __str__(self):
+        # built again from pickled args, or raised by hand, some may be None
+        used = 'too much memory' if self.used is None else f'{self.used / 2**20:.0f} MB'
+        stage = '' if self.stage is None else f' by the end of {self.stage}'
+        budget = '' if self.budget is None else f' of {self.budget / 2**20:.0f} MB'
+        return f'job used {used}{stage}, over its budget{budget}'
+
+def rss_bytes():
+    """ Resident size of this process. Without /proc this is the peak
+    resident size so far, which never goes down.
+    """
+    try:
+        with open('/proc/self/statm', 'rb') as f:
+            return int(f.read().split()[1]) * _page_size
+    except OSError:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+class RSSSampler(threading.Thread):
+    """ Samples the resident size every interval seconds and keeps its
+    peak over the job and over the current stage.
+    """
+
+    def __init__(self, interval=rss_interval):
+        super().__init__(name='rss-sampler', daemon=True)
+        self.interval = interval
+        self.stopping = threading.Event()
+        self.peak = self.stage_peak = rss_bytes()
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        # racing with start_stage() at worst counts one sample in the
+        # stage before
+        rss = rss_bytes()
+        self.peak = max(self.peak, rss)
+        self.stage_peak = max(self.stage_peak, rss)
+        return rss
+
+    def start_stage(self):
+        self.stage_peak = self.sample()
+        return self.stage_peak
+
+    def stop(self):
+        self.stopping.set()
+        self.join()
+        self.sample()
+
+class Metrics:
+    """ Wall time, calls and optionally peak memory per stage of one job,
+    plus counts of what it worked on. Stages do not nest. memory=True
+    traces allocations, which slows the job down severalfold;
+    memory='rss' samples the resident size from a thread instead, which
+    costs next to nothing but only sees what the allocator gets from the
+    system. budget is the most memory in bytes the job may use, sampled
+    as resident size unless memory=True. profile is a path for a cProfile
+    dump of the job.
+    """
+
+    def __init__(self, label=None, memory=False, profile=None, budget=None):
+        self.label = label
+        self.memory = memory or ('rss' if budget is not None else False)
+        self.profile = profile
+        self.budget = budget
+        self.stages = {}
+        self.counts = {}
+        self.seconds = None
+        self.error = None
+        self.peak_bytes = None
+        self._sampler = None
+        self._baseline = 0
+
+    @property
+    def tracing(self):
+        return bool(self.memory) and self.memory != 'rss'
+
+    def start_memory(self):
+        """ Take the job's memory baseline; measure_job() calls this. """
+        if self.tracing:
+            self._baseline = tracemalloc.get_traced_memory()[0]
+        elif self.memory:
+            self._sampler = RSSSampler()
+            self._baseline = self._sampler.peak
+            self._sampler.start()
+
+    def stop_memory(self):
+        if self._sampler is not None:
+            self._sampler.stop()
+            self.used(self._sampler.peak)
+            self._sampler = None
+
+    def used(self, high):
+        """ Note that the process got to high bytes during the job. """
+        self.peak_bytes = max(self.peak_bytes or 0, high - self._baseline)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        baseline = None
+        if self.tracing:
+            baseline = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        elif self._sampler is not None:
+            baseline = self._sampler.start_stage()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            peak = None
+            if baseline is not None:
+                if self.tracing:
+                    high = tracemalloc.get_traced_memory()[1]
+                else:
+                    self._sampler.sample()
+                    high = self._sampler.stage_peak
+                peak = high - baseline
+                self.used(high)
+            self.add(name, elapsed, peak)
+        if self.budget is not None and (self.peak_bytes or 0) > self.budget:
+            raise MemoryBudgetExceeded(name, self.peak_bytes, self.budget)
+
+    def add(self, name, seconds, peak=None):
+        """ Record one call of a stage timed elsewhere. """
+        entry = self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0})
+        entry['seconds'] += seconds
+        entry['calls'] += 1
+        if peak is not None:
+            entry['peak_bytes'] = max(entry.get('peak_bytes', 0), peak)
+
+    def count(self, name, n=1):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def as_dict(self):
+        return {'label': self.label, 'seconds': self.seconds, 'error': self.error,
+                'stages': self.stages, 'counts': self.counts,
+                'peak_bytes': self.peak_bytes, 'budget_bytes': self.budget}
+
+    def json_line(self):
+        return json.dumps(dict(self.as_dict(), event='arrangement', pid=os.getpid()), sort_keys=True)
+
+    def __repr__(self):
+        stages = ', '.join(f'{k} {v["seconds"]:.3f}s' for k, v in self.stages.items())
+        return f'Metrics({self.label!r}, {stages})'
+
+def active():
+    """ The Metrics of the job running on this thread, or None. """
+    return getattr(_active, 'metrics', None)
+
+def stage(name):
+    """ Time the block as a stage of the active job, if any. """
+    metrics = getattr(_active, 'metrics', None)
+    return _off if metrics is None else metrics.stage(name)
+
+def count(name, n=1):
+    metrics = getattr(_active, 'metrics', None)
+    if metrics is not None:
+        metrics.count(name, n)
+
+def warm_up(f):
+    """ Run f once, before the baseline of the first job in this process
+    whose memory is measured. Returns f, so it works as a decorator.
+    """
+    _warm_ups.append(f)
+    return f
+
+def metrics_from_environment(label):
+    """ A Metrics for a job if METRICS_LOG, METRICS_MEMORY, JOB_MEMORY_MB
+    or PROFILE_DIR is set, else None.
+    """
+    memory = os.environ.get('METRICS_MEMORY') or False
+    if memory and memory != 'rss':
+        memory = True
+    budget = os.environ.get('JOB_MEMORY_MB')
+    budget = int(float(budget) * 1024 * 1024) if budget else None
+    profile_dir = os.environ.get('PROFILE_DIR')
+    if not (os.environ.get('METRICS_LOG') or memory or budget or profile_dir):
+        return None
+    profile = None
+    if profile_dir:
+        name = os.path.basename(label or 'job')
+        profile = os.path.join(profile_dir, f'{name}-{os.getpid()}-{next(_profile_numbers)}.prof')
+    return Metrics(label, memory=memory, profile=profile, budget=budget)
+
+def log(metrics):
+    """ Append the job's JSON line to METRICS_LOG, if set. """
+    path = os.environ.get('METRICS_LOG')
+    if not path:
+        return
+    line = metrics.json_line() + '\n'
+    if path == '-':
+        sys.stderr.write(line)
+    else:
+        with open(path, 'a') as f:
+            f.write(line)
+
+@contextlib.contextmanager
+def measure_job(label, metrics=None):
+    """ Measure the block as one job and yield its Metrics, or None when
+    nothing is being measured. Inside another job, the block counts
+    towards that one.
+    """
+    if active() is not None:
+        yield active()
+        return
+    if metrics is None:
+        metrics = metrics_from_environment(label)
+    if metrics is None:
+        yield None
+        return
+
+    if metrics.memory:
+        while _warm_ups:
+            _warm_ups.pop(0)()
+    started_tracing = metrics.tracing and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    metrics.start_memory()
+    profiler = None
+    if metrics.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+    _active.metrics = metrics
+    start = time.perf_counter()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield metrics
+    except Exception as e:
+        metrics.error = f'{type(e).__name__}: {e}'
+        raise
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        metrics.seconds = time.perf_counter() - start
+        _active.metrics = None
+        metrics.stop_memory()
+        if started_tracing:
+            tracemalloc.stop()
+        if profiler is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(metrics.profile)), exist_ok=True)
+            profiler.dump_stats(metrics.profile)
+        log(metrics)
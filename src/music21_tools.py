@@ -1,5 +1,7 @@
-from music21 import *
-import copy
+from cache_tools import LRUCache, WeakrefPickler
+import collections
+import functools
+import pickle
 
 class AnacrusisException(Exception):
     pass
@@ -41,308 +43,607 @@ melody_replacement_index = {
     #R     b9    9     b3          4     b5          #5    13           7
     {      1: 0, 2: 0, 3: 1,       5: 1, 6: 2,       8: 2, 9: 2,        11: 3}}
 
-def voicing_out_of_fret_range(pitches, mel_string, string_offsets, min_fret):
-    return (
-        pitches[3] < string_notes[mel_string-string_offsets[0]] + min_fret or
-        pitches[2] < string_notes[mel_string-string_offsets[1]] + min_fret or
-        pitches[1] < string_notes[mel_string-string_offsets[2]] + min_fret or
-        pitches[0] < string_notes[mel_string-string_offsets[3]] + min_fret
-    )
+# Spelled pitches are (midi, step) pairs of ints, where step is the
+# diatonic note number 7 * octave + letter index. That is all music21
+# needs to recover the note name, and (step, midi) is also the order
+# music21 sorts chord notes in.
+step_semitones = [0, 2, 4, 5, 7, 9, 11]
+
+# letter music21 picks when a pitch is set from its ps, per pitch class
+ps_letters = [0, 0, 1, 2, 2, 3, 3, 4, 4, 5, 6, 6]
+
+def spelled_pitch(p):
+    return (int(p.ps), 7 * p.octave + 'CDEFGAB'.index(p.step))
+
+def respell(midi):
+    """ Same spelling as assigning to a music21 Pitch's ps. """
+    return (midi, 7 * (midi // 12 - 1) + ps_letters[midi % 12])
+
+def music21_pitch(p):
+    """ A music21 Pitch spelled like the (midi, step) pair p. """
+    from music21 import pitch
+    midi, step = p
+    result = pitch.Pitch()
+    result.step = 'CDEFGAB'[step % 7]
+    result.octave = step // 7
+    alter = midi - 12 * (result.octave + 1) - step_semitones[step % 7]
+    if alter != 0:
+        result.accidental = pitch.Accidental(alter)
+    return result
+
+def shift_octave(p, octaves):
+    return (p[0] + 12 * octaves, p[1] + 7 * octaves)
+
+def transpose_pitch(p, semitones):
+    # music21 respells notes transposed by a number of semitones
+    return respell(p[0] + semitones)
+
+def pitch_octave(p):
+    return p[1] // 7
+
+def _add(notes, p):
+    # same as music21's Chord.add: append and sort by step, then pitch
+    notes.append(p)
+    notes.sort(key=lambda n: (n[1], n[0]))
+
+class Voicing:
+    """ A chord voicing as MIDI pitch numbers in chord order, the diatonic
+    step of each note (so spellings survive), and the root pitch class.
+    """
+    __slots__ = ('pitches', 'steps', 'root')
 
-def check_valid_string_set(mel_string, string_offsets):
-    if mel_string-string_offsets[3] < 0:
-        raise IndexError
+    def __init__(self, notes, root):
+        self.pitches = tuple(n[0] for n in notes)
+        self.steps = tuple(n[1] for n in notes)
+        self.root = root
 
-def position_for_chord(c, min_fret, max_fret, prev_chord, prev_string, drop_type):
-    string_offsets = []
-    if drop_type == 'drop2':
-        string_offsets = [0, 1, 2, 3]
-    elif drop_type == 'drop3':
-        string_offsets = [0, 1, 2, 4]
-    elif drop_type == 'drop24':
-        string_offsets = [0, 1, 3, 4]
-
-    pitches = [x.ps for x in c.pitches]
-    pitches = list(sorted(pitches))
-    mel_string = 5
+    @classmethod
+    def from_notes(cls, notes, root=None):
+        notes = [spelled_pitch(n.pitch) for n in notes]
+        return cls(notes, notes[0][0] % 12 if root is None else root)
+
+    @property
+    def notes(self):
+        return list(zip(self.pitches, self.steps))
+
+    @property
+    def pitch_classes(self):
+        return [p % 12 for p in self.pitches]
+
+    def __len__(self):
+        return len(self.pitches)
+
+    def __eq__(self, other):
+        return (isinstance(other, Voicing) and self.pitches == other.pitches and
+                self.steps == other.steps and self.root == other.root)
+
+    def __hash__(self):
+        return hash((self.pitches, self.steps, self.root))
+
+    def __repr__(self):
+        return f'Voicing({self.notes}, {self.root})'
+
+    def to_chord(self):
+        from music21 import chord
+        return chord.Chord([music21_pitch(n) for n in self.notes])
+
+def chord_quality(kind, figure):
+    """ The chordkind_interval_names / melody_replacement_index key
+    for a chord symbol, or None.
+    """
+    if 'minor' in kind:
+        return 'minor'
+    elif 'augmented' in kind:
+        return 'augmented'
+    elif 'half-diminished' in kind:
+        return 'half-diminished'
+    elif 'diminished' in kind:
+        return 'diminished'
+    elif 'dominant' in kind:
+        return 'dominant'
+    elif 'major' in kind or 'pedal' in figure:
+        return 'major'
+    elif 'suspended' in kind:
+        return 'suspended'
+    return None
+
+drop_string_offsets = {
+    'drop2':  [0, 1, 2, 3],
+    'drop3':  [0, 1, 2, 4],
+    'drop24': [0, 1, 3, 4]}
+
+@functools.lru_cache(maxsize=None)
+def placement_index(drop_type, min_fret):
+    """ Precomputed string sets for a drop type and minimum fret.
+
+    Whether a voicing fits a string set is decided voice by voice, so
+    the index holds one table per voice (melody first), mapping a MIDI
+    pitch to the bitmask of melody strings that voice can be played
+    from at or above min_fret. ANDing the four masks of a voicing gives
+    all of its valid string sets.
+    """
+    string_offsets = drop_string_offsets[drop_type]
+    masks = []
+    for k in range(4):
+        table = []
+        for p in range(128):
+            m = 0
+            for s in range(string_offsets[3], 6):
+                if p >= string_notes[s - string_offsets[k]] + min_fret:
+                    m |= 1 << s
+            table.append(m)
+        masks.append(table)
+    return masks
+
+# highest melody string at or below a starting string in a
+# string set bitmask, or -1 if there is none
+highest_string = [[max([s for s in range(start + 1) if mask >> s & 1], default=-1)
+                   for start in range(6)] for mask in range(64)]
+
+def string_set_mask(pitches, drop_type, min_fret):
+    """ Bitmask of the melody strings a sorted voicing fits on. """
+    masks = placement_index(drop_type, min_fret)
+    if pitches[0] < 0 or pitches[3] > 127:
+        pitches = [min(max(p, 0), 127) for p in pitches]
+    return masks[0][pitches[3]] & masks[1][pitches[2]] & masks[2][pitches[1]] & masks[3][pitches[0]]
+
+def choose_melody_string(valid, valid_anywhere, prev_string=None):
+    """ Melody string for a voicing from its string set bitmasks, or -1.
+    prev_string is given when the melody note is held over from the
+    previous chord.
+    """
+    mel_string = -1
 
     # if the highest voice stayed the same between chords
     # try to play it on the same string
-    if prev_chord is not None:
-        prev_mel = list(sorted([x.ps for x in prev_chord.pitches]))[3]
-        if pitches[3] == prev_mel:
-            mel_string = prev_string
-            try:
-                while (voicing_out_of_fret_range(pitches, mel_string, string_offsets, min_fret)):
-                    mel_string -= 1
-                    check_valid_string_set(mel_string, string_offsets)
-            except IndexError:
-                mel_string = 5
+    if prev_string is not None:
+        mel_string = highest_string[valid][prev_string]
 
     # normal case, start from the highest string
-    try:
-        while (voicing_out_of_fret_range(pitches, mel_string, string_offsets, min_fret)):
-            mel_string -= 1
-            check_valid_string_set(mel_string, string_offsets)
-    except IndexError:
-        try:
-            min_fret = 0
-            mel_string = 5
-            while (voicing_out_of_fret_range(pitches, mel_string, string_offsets, min_fret)):
-                mel_string -= 1
-                check_valid_string_set(mel_string, string_offsets)
-        except IndexError:
-            raise NoteTooLowForChord
-
-    note_positions = [
+    if mel_string < 0:
+        mel_string = highest_string[valid][5]
+
+    # otherwise anywhere on the neck
+    if mel_string < 0:
+        mel_string = highest_string[valid_anywhere][5]
+    return mel_string
+
+def fret_positions(pitches, mel_string, string_offsets):
+    return [
         pitches[3] - string_notes[mel_string-string_offsets[0]],
         pitches[2] - string_notes[mel_string-string_offsets[1]],
         pitches[1] - string_notes[mel_string-string_offsets[2]],
         pitches[0] - string_notes[mel_string-string_offsets[3]] ]
 
-    # return melody_string_num, fret_position, note_positions
-    return 5 - mel_string, note_positions
+def position_for_chord(c, min_fret, max_fret, prev_chord, prev_string, drop_type):
+    if drop_type not in drop_string_offsets:
+        raise NoteTooLowForChord
+    string_offsets = drop_string_offsets[drop_type]
+
+    pitches = sorted(c.pitches)
+    if len(pitches) < 4:
+        # a drop voicing places four notes
+        raise NoteTooLowForChord
+
+    held = prev_chord is not None and len(prev_chord) >= 4 and pitches[3] == sorted(prev_chord.pitches)[3]
+    mel_string = choose_melody_string(
+        string_set_mask(pitches, drop_type, min_fret),
+        string_set_mask(pitches, drop_type, 0),
+        prev_string if held else None)
+    if mel_string < 0:
+        raise NoteTooLowForChord
+
+    # return melody_string_num, note_positions
+    return 5 - mel_string, fret_positions(pitches, mel_string, string_offsets)
+
+@functools.lru_cache(maxsize=None)
+def optional_numpy():
+    """ numpy if it is installed, else None. Imported on first use, as it
+    takes longer to import than the rest of this module.
+    """
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+@functools.lru_cache(maxsize=None)
+def _string_thresholds(drop_type, min_frets):
+    # lowest playable pitch per (minimum fret, melody string, voice), lowest
+    # voice first; strings too low for the drop type can never be reached
+    string_offsets = drop_string_offsets[drop_type]
+    return optional_numpy().array([[[string_notes[s - string_offsets[k]] + f if s >= string_offsets[3] else 1000
+                          for k in (3, 2, 1, 0)] for s in range(6)] for f in min_frets])
+
+def string_set_masks(voicings, drop_type, min_frets):
+    """ string_set_mask for a list of sorted four note voicings, for each
+    of min_frets, done as one array comparison when numpy is available.
+    """
+    numpy = optional_numpy()
+    if numpy is None or not voicings:
+        return [[string_set_mask(p, drop_type, f) for p in voicings] for f in min_frets]
+    pitches = numpy.array([p[:4] for p in voicings])
+    fits = (pitches[None, :, None, :] >= _string_thresholds(drop_type, tuple(min_frets))[:, None]).all(axis=3)
+    return (fits @ (1 << numpy.arange(6))).tolist()
+
+def positions_for_chords(chords, min_fret, max_fret, drop_type):
+    """ position_for_chord for every chord of a song at once.
+
+    The string sets of all voicings are worked out in one batch; only the
+    choice of melody string, which depends on the previous chord, is made
+    in order. Returns (melody_string_num, note_positions) per chord, or
+    None where position_for_chord raises NoteTooLowForChord.
+    """
+    if drop_type not in drop_string_offsets:
+        return [None] * len(chords)
+    string_offsets = drop_string_offsets[drop_type]
+
+    all_pitches = [sorted(c.pitches) for c in chords]
+    full = [p for p in all_pitches if len(p) >= 4]
+    valid, valid_anywhere = map(iter, string_set_masks(full, drop_type, (min_fret, 0)))
+    return [position for position, state in place_chords(all_pitches, valid, valid_anywhere, string_offsets)]
+
+def place_chords(all_pitches, valid, valid_anywhere, string_offsets, state=None):
+    """ The choices positions_for_chords() makes in order, one at a time.
+
+    valid and valid_anywhere iterate over the string set masks of the
+    voicings with four notes. Yields each position together with the
+    state the next chord is placed from: None, or the top pitch and
+    melody string of the last placed chord. Placing can resume from a
+    state yielded earlier.
+    """
+    for pitches in all_pitches:
+        if len(pitches) < 4:
+            # placed nowhere, like a voicing too low for every string set
+            state = None
+            yield None, state
+            continue
+        held = state is not None and pitches[3] == state[0]
+        mel_string = choose_melody_string(next(valid), next(valid_anywhere), state[1] if held else None)
+        if mel_string < 0:
+            state = None
+            yield None, state
+            continue
+        state = (pitches[3], mel_string)
+        yield (5 - mel_string, fret_positions(pitches, mel_string, string_offsets)), state
 
 def increase_chord_octave(c, min_fret):
     """ Increase the octave of all notes in the chord
     to fit the chord above the minimum fret.
     """
-    c = copy.deepcopy(c)
-    octaves = 1 + ((string_notes[-1] + min_fret) - c.pitches[-1].ps) // 12
+    octaves = int(1 + ((string_notes[-1] + min_fret) - c.pitches[-1]) // 12)
+    notes = []
     for n in c.notes:
-        new = copy.deepcopy(n)
-        new.octave += octaves
-        c.remove(n)
-        c.add(new)
+        _add(notes, shift_octave(n, octaves))
 
-    return c
+    return Voicing(notes, c.root)
 
 def match_inversion_to_melody(c, mel):
     """ Increase chord octave and invert the notes
     to match the melody voice to the melody note.
     """
-    c = copy.deepcopy(c)
-    for n in c.notes: # find pitch of the melody note in the chord
-            if n.pitch.pitchClass == mel.pitch.pitchClass:
+    notes = c.notes
+    for n in notes: # find pitch of the melody note in the chord
+            if n[0] % 12 == mel[0] % 12:
                 chord_mel = n
                 break
-    for n in c.notes: # shift the whole chord up so that the melody note matches
-        new = copy.deepcopy(n)
-        new.octave += (mel.octave - chord_mel.octave)
-        c.remove(n)
-        c.add(new)
-    for n in c.notes:
-        if n.pitch.ps > mel.pitch.ps:
-            new = copy.deepcopy(n)
-            while(new.pitch.ps > mel.pitch.ps):
-                new.octave -= 1
-            c.remove(n)
-            c.add(new)
-
-    return c
+    octaves = pitch_octave(mel) - pitch_octave(chord_mel)
+    notes = sorted((shift_octave(n, octaves) for n in notes), key=lambda n: (n[1], n[0]))
+    for n in list(notes):
+        if n[0] > mel[0]:
+            new = n
+            while(new[0] > mel[0]):
+                new = shift_octave(new, -1)
+            notes.remove(n)
+            _add(notes, new)
+
+    return Voicing(notes, c.root)
 
 def drop_chord(c, type='drop2'):
-    c = copy.deepcopy(c)
+    notes = c.notes
     if type == 'drop2':
-        c[2].octave -= 1
+        notes[2] = shift_octave(notes[2], -1)
     elif type == 'drop3':
-        c[1].octave -= 1
+        notes[1] = shift_octave(notes[1], -1)
     elif type == 'drop24':
-        c[0].octave -= 1
-        c[2].octave -= 1
+        notes[0] = shift_octave(notes[0], -1)
+        notes[2] = shift_octave(notes[2], -1)
 
-    return c
+    return Voicing(notes, c.root)
 
 def add_melody_to_chord(c, mel):
-    c = copy.deepcopy(c)
-    if mel is None or mel.pitch.pitchClass in c.pitchClasses:
+    if mel is None or mel[0] % 12 in c.pitch_classes:
         return c
-    r = copy.deepcopy(c[0].pitch)
-    i = interval.Interval(noteStart=r, noteEnd=mel)
-    r.ps += i.semitones % 12
-    c.add(r)
+    notes = c.notes
+    r = notes[0]
+    _add(notes, respell(r[0] + (mel[0] - r[0]) % 12))
 
-    return c
+    return Voicing(notes, c.root)
 
 def expand_to_four_note_chord(c, kind, maj_triad='major-seven', min_triad='minor-seven'):
-    c = copy.deepcopy(c)
-    if len(c.notes) == 3:
-        r = copy.deepcopy(c[0].pitch)
+    notes = c.notes
+    if len(notes) == 3:
+        r = notes[0]
         if 'minor' in kind:
             if min_triad == 'minor-seven':
-                r.ps -= 2
-                r.octave += 1
-                c.add(r)
+                _add(notes, shift_octave(respell(r[0] - 2), 1))
             elif min_triad == 'minor-six':
-                r.ps -= 3
-                r.octave += 1
-                c.add(r)
+                _add(notes, shift_octave(respell(r[0] - 3), 1))
             elif min_triad == 'minor-nine':
-                r.ps -= 2
-                r.octave += 1
-                c.add(r)
-                c[0].transpose(2, inPlace=True)
+                _add(notes, shift_octave(respell(r[0] - 2), 1))
+                notes[0] = transpose_pitch(notes[0], 2)
             elif min_triad == 'minor-six-nine':
-                r.ps -= 3
-                r.octave += 1
-                c.add(r)
-                c[0].transpose(2, inPlace=True)
+                _add(notes, shift_octave(respell(r[0] - 3), 1))
+                notes[0] = transpose_pitch(notes[0], 2)
         elif 'augmented' in kind:
-            r.ps -= 2
-            r.octave += 1
-            c.add(r)
+            _add(notes, shift_octave(respell(r[0] - 2), 1))
         elif 'diminished' in kind:
-            r.ps -= 3
-            r.octave += 1
-            c.add(r)
+            _add(notes, shift_octave(respell(r[0] - 3), 1))
         elif 'major' in kind:
             if maj_triad == 'major-seven':
-                r.ps += 11
-                c.add(r)
+                _add(notes, respell(r[0] + 11))
             elif maj_triad == 'major-six':
-                r.ps += 9
-                c.add(r)
+                _add(notes, respell(r[0] + 9))
             elif maj_triad == 'major-nine':
-                r.ps += 11
-                c.add(r)
-                c[0].transpose(2, inPlace=True)
+                _add(notes, respell(r[0] + 11))
+                notes[0] = transpose_pitch(notes[0], 2)
             elif maj_triad == 'major-six-nine':
-                r.ps += 9
-                c.add(r)
-                c[0].transpose(2, inPlace=True)
+                _add(notes, respell(r[0] + 9))
+                notes[0] = transpose_pitch(notes[0], 2)
         elif 'suspended' in kind:
-            flatseven = copy.deepcopy(c[0].pitch)
-            flatseven.ps -=2
-            flatseven.octave += 1
-            c.add(flatseven)
-    elif len(c.notes) == 1: # assume major?
-        r = copy.deepcopy(c[0].pitch)
-        third = copy.deepcopy(r)
-        third.ps += 4
-        fifth = copy.deepcopy(r)
-        fifth.ps += 7
-        seventh = copy.deepcopy(r)
+            _add(notes, shift_octave(respell(r[0] - 2), 1))
+    elif len(notes) == 1: # assume major?
+        r = notes[0]
+        seventh = r
         if maj_triad == 'major-seven' or maj_triad == 'major-nine':
-            seventh.ps += 11
+            seventh = respell(r[0] + 11)
         elif maj_triad == 'major-six' or maj_triad == 'major-six-nine':
-            seventh.ps += 9
-        c.add(third)
-        c.add(fifth)
-        c.add(seventh)
-
-    return c
-
-def reduce_to_four_note_chord(c, csymb, mel):
-    c = copy.deepcopy(c)
-    if len(c.notes) > 4:
-        for n in c.notes:
-            if n.pitch.pitchClass == mel.pitch.pitchClass:
+            seventh = respell(r[0] + 9)
+        _add(notes, respell(r[0] + 4))
+        _add(notes, respell(r[0] + 7))
+        _add(notes, seventh)
+
+    return Voicing(notes, c.root)
+
+def reduce_to_four_note_chord(c, record, mel):
+    notes = c.notes
+    if len(notes) > 4:
+        for n in notes:
+            if n[0] % 12 == mel[0] % 12:
                 mel = n
                 break
 
-        c.remove(mel)
-        mel_semitones = interval.Interval(noteStart=csymb[0].pitch, noteEnd=mel).semitones % 12
-
-        if 'minor' in csymb.chordKind:
-            if mel_semitones in melody_replacement_index['minor']:
-                c.remove(c[melody_replacement_index['minor'][mel_semitones]])
-        elif 'augmented' in csymb.chordKind:
-            if mel_semitones in melody_replacement_index['augmented']:
-                c.remove(c[melody_replacement_index['augmented'][mel_semitones]])
-        elif 'half-diminished' in csymb.chordKind:
-            if mel_semitones in melody_replacement_index['half-diminished']:
-                c.remove(c[melody_replacement_index['half-diminished'][mel_semitones]])
-        elif 'diminished' in csymb.chordKind:
-            if mel_semitones in melody_replacement_index['diminished']:
-                c.remove(c[melody_replacement_index['diminished'][mel_semitones]])
-        elif 'dominant' in csymb.chordKind:
-            if mel_semitones in melody_replacement_index['dominant']:
-                c.remove(c[melody_replacement_index['dominant'][mel_semitones]])
-            if mel_semitones == 9: # turn a 13 into a 9/13
-                c[0].transpose(2, inPlace=True)
-        elif 'major' in csymb.chordKind or 'pedal' in csymb.figure:
-            if mel_semitones in melody_replacement_index['major']:
-                c.remove(c[melody_replacement_index['major'][mel_semitones]])
-        elif 'suspended' in csymb.chordKind:
-            if mel_semitones in melody_replacement_index['suspended']:
-                c.remove(c[melody_replacement_index['suspended'][mel_semitones]])
-
-        c.add(mel)
-
-    return c
+        notes.remove(mel)
+        mel_semitones = (mel[0] - c.root) % 12
+
+        quality = record.quality
+        if quality is not None and mel_semitones in melody_replacement_index[quality]:
+            notes.remove(notes[melody_replacement_index[quality][mel_semitones]])
+        if quality == 'dominant' and mel_semitones == 9: # turn a 13 into a 9/13
+            notes[0] = transpose_pitch(notes[0], 2)
+
+        _add(notes, mel)
+
+    return Voicing(notes, c.root)
 
 def interval_names_for_chord(c, cs):
-    pitches = [x.ps for x in c.pitches]
-    pitches = list(sorted(pitches))
-    root_ps = cs.notes[0].pitch.ps
+    pitches = list(sorted(c.pitches))
+    quality = chord_quality(cs.chordKind, cs.figure)
     interval_names = []
 
-    for p in pitches:
-        interval_semitones = int((p - root_ps) % 12)
-        if 'minor' in cs.chordKind:
-            interval_names.append(chordkind_interval_names['minor'][interval_semitones])
-        elif 'augmented' in cs.chordKind:
-            interval_names.append(chordkind_interval_names['augmented'][interval_semitones])
-        elif 'half-diminished' in cs.chordKind:
-            interval_names.append(chordkind_interval_names['half-diminished'][interval_semitones])
-        elif 'diminished' in cs.chordKind:
-            interval_names.append(chordkind_interval_names['diminished'][interval_semitones])
-        elif 'dominant' in cs.chordKind:
-            interval_names.append(chordkind_interval_names['dominant'][interval_semitones])
-        elif 'major' in cs.chordKind or 'pedal' in cs.figure:
-            interval_names.append(chordkind_interval_names['major'][interval_semitones])
-        elif 'suspended' in cs.chordKind:
-            interval_names.append(chordkind_interval_names['suspended'][interval_semitones])
+    if quality is not None:
+        for p in pitches:
+            interval_semitones = (p - c.root) % 12
+            interval_names.append(chordkind_interval_names[quality][interval_semitones])
 
     return interval_names
 
-def add_extensions(c, csymb, ext, mel):
-    c = copy.deepcopy(c)
+def add_extensions(c, record, ext, mel):
+    notes = c.notes
     for e in ext:
-        if e.pitch.pitchClass not in c.pitchClasses:
-            ext_semitones = interval.Interval(noteStart=csymb[0].pitch, noteEnd=e).semitones % 12
-            for v in c.notes:
-                if mel is None or v.pitch.pitchClass != mel.pitch.pitchClass:
+        if e[0] % 12 not in [n[0] % 12 for n in notes]:
+            ext_semitones = (e[0] - c.root) % 12
+            for i, v in enumerate(notes):
+                if mel is None or v[0] % 12 != mel[0] % 12:
                     # don't change any voice that's the melody voice
-                    v_semitones = interval.Interval(noteStart=csymb[0].pitch, noteEnd=v).semitones % 12
+                    v_semitones = (v[0] - c.root) % 12
                     if (v_semitones == 0) and (ext_semitones == 1 or ext_semitones == 2):
                         # voice is root, and ext is b9 or 9
-                        v.transpose(ext_semitones - v_semitones, inPlace=True)
+                        notes[i] = transpose_pitch(v, ext_semitones - v_semitones)
                     # elif (v_semitones == 3 or v_semitones == 4) and (ext_semitones == 5):
                     #     # voice is 3 or b3, and ext is 11
-                    #     v.transpose(ext_semitones - v_semitones, inPlace=True)
+                    #     notes[i] = transpose_pitch(v, ext_semitones - v_semitones)
                     elif (v_semitones == 7) and (ext_semitones == 6 or ext_semitones == 8):
                         # voice is 5, and ext is b5 or #5
-                        v.transpose(ext_semitones - v_semitones, inPlace=True)
+                        notes[i] = transpose_pitch(v, ext_semitones - v_semitones)
                     elif (v_semitones == 11) and (ext_semitones == 9):
                         # voice is 7, and ext is 6
-                        v.transpose(ext_semitones - v_semitones, inPlace=True)
-                    elif (v_semitones == 7) and (ext_semitones == 9) and ('dominant' in csymb.chordKind):
+                        notes[i] = transpose_pitch(v, ext_semitones - v_semitones)
+                    elif (v_semitones == 7) and (ext_semitones == 9) and ('dominant' in record.kind):
                         # voice is a 5, and ext is 13 (on dominant)
-                        v.transpose(ext_semitones - v_semitones, inPlace=True)
+                        notes[i] = transpose_pitch(v, ext_semitones - v_semitones)
+
+    return Voicing(notes, c.root)
+
+# What the voicing code needs of a chord symbol, worked out once per
+# distinct chord: the pitch class of its root, its chordKind and quality
+# (see chord_quality()), and its spelled notes split into the base chord
+# and the extensions on top of it.
+ChordRecord = collections.namedtuple('ChordRecord', ['root', 'kind', 'quality', 'base', 'extensions'])
+
+# realized chord symbols, shared by every arrangement in this process:
+# ChordRecords by figure, chordKind and notes, and the upper structures
+# of slash chords by figure
+chord_records = LRUCache(maxsize=4096)
+
+def chord_record(cs):
+    """ The ChordRecord of a chord symbol, interned in chord_records. """
+    figure = cs.figure
+    kind = cs.chordKind
+    notes = tuple(spelled_pitch(n.pitch) for n in cs.notes)
+    key = (figure, kind, notes)
+    record = chord_records.get(key)
+    if record is not None:
+        return record
+
+    # for "add __" chords, just get rid of the last note
+    if 'add' in figure and len(notes) == 4:
+        base, extensions = notes[0:3], notes[3:]
+    else:
+        base, extensions = notes[0:4], notes[4:]
+    root = notes[0][0] % 12 if len(notes) > 0 else None
+    record = ChordRecord(root, kind, chord_quality(kind, figure), base, extensions)
+    chord_records.put(key, record)
+    return record
+
+def upper_structure(figure):
+    """ The spelled notes of a slash chord's figure without the bass,
+    realized by music21 once and kept in chord_records.
+    """
+    notes = chord_records.get(figure)
+    if notes is None:
+        from music21 import harmony
+        notes = tuple(spelled_pitch(n.pitch) for n in harmony.ChordSymbol(figure.split('/')[0]).notes)
+        chord_records.put(figure, notes)
+    return notes
+
+# finished voicings, shared by every arrangement in this process
+voicing_cache = LRUCache(maxsize=20000)
+
+def voicing_for_chord_symbol(cs, mel, min_fret, maj_triad='major-seven', min_triad='minor-seven', drop_type='drop2'):
+    """ The drop voicing for a chord symbol under a melody note (or None),
+    memoized in voicing_cache.
+    """
+    record = chord_record(cs)
+    if mel is not None:
+        mel = spelled_pitch(mel.pitch)
+
+    # the fret only matters when there is no melody note to invert to
+    key = (record, mel, maj_triad, min_triad, drop_type, min_fret if mel is None else None)
+    final = voicing_cache.get(key)
+    if final is not None:
+        return final
+
+    new_c = Voicing(record.base, record.root)
+    extensions = list(record.extensions)
+
+    fnc = expand_to_four_note_chord(new_c, record.kind, maj_triad=maj_triad, min_triad=min_triad)
+    mc = add_melody_to_chord(fnc, mel)
+    red = reduce_to_four_note_chord(mc, record, mel)
+
+    if mel is not None:
+        inversion = match_inversion_to_melody(red, mel)
+    else:
+        inversion = increase_chord_octave(red, min_fret)
 
-    return c
+    dc = drop_chord(inversion, drop_type)
+
+    final = add_extensions(dc, record, extensions, mel)
+    voicing_cache.put(key, final)
+
+    return final
+
+def realize_measure_durations(m, bar_duration=None):
+    """ Stretch each element of a chord measure up to the next one, and
+    the last up to the barline, in place. An empty measure gets a rest.
+    bar_duration defaults to m.barDuration, which needs m to sit in a
+    voice after a measure with the time signature.
+    """
+    from music21 import duration, note
+    if bar_duration is None:
+        bar_duration = m.barDuration
+    chords = m.getElementsByClass('Chord')
+    rests = m.getElementsByClass('Rest')
+    i = 0
+    if len(chords) == 0 and len(rests) == 0:
+        r = note.Rest()
+        # a time signature's bar duration is its own, so not shared
+        r.duration = duration.Duration(bar_duration.quarterLength)
+        m.insert(0.0, r)
+        return
+    elif m[0].offset != 0.0:
+        r = note.Rest()
+        r.duration = duration.Duration(m[0].offset)
+        m.insert(0.0, r)
+    for n in m:
+        if len(m) == i + 1: # last item in measure
+            n.duration = duration.Duration(bar_duration.quarterLength - n.offset)
+        else:
+            n.duration = duration.Duration(m[i+1].offset - n.offset)
+        i += 1
 
 def realize_chord_durations(v):
-    v = copy.deepcopy(v)
+    """ realize_measure_durations() for every measure of v, in place. """
     for m in v:
-        chords = m.getElementsByClass('Chord')
-        rests = m.getElementsByClass('Rest')
-        i = 0
-        if len(chords) == 0 and len(rests) == 0:
-            r = note.Rest()
-            r.duration = m.barDuration
-            m.insert(0.0, r)
+        realize_measure_durations(m)
+    return v
+
+class ScorePickler(WeakrefPickler):
+    """ Pickles parsed scores in one pass. music21's own SiteRef pickling
+    parks every site in a module global until the pickle is loaded again,
+    so site references are written out directly instead. Cached
+    derivations, such as offset trees, are left out.
+    """
+
+    def reducer_override(self, obj):
+        from music21 import base, sites
+        if isinstance(obj, base.Music21Object):
+            reduced = obj.__reduce_ex__(pickle.HIGHEST_PROTOCOL)
+            state = dict(reduced[2], _cache={})
+            return reduced[:2] + (state,) + reduced[3:]
+        if type(obj) is sites.SiteRef:
+            if obj is sites._NoneSiteRef:
+                return (_none_site_ref, ())
+            return (_site_ref, (obj.site, obj.classString, obj.globalSiteIndex, obj.siteIndex))
+        return super().reducer_override(obj)
+
+def _none_site_ref():
+    from music21 import sites
+    return sites._NoneSiteRef
+
+def _site_ref(site, class_string, global_site_index, site_index):
+    from music21 import sites
+    ref = sites.SiteRef()
+    ref.site = site
+    ref.isDead = site is None
+    ref.classString = class_string
+    ref.globalSiteIndex = global_site_index
+    ref.siteIndex = site_index
+    return ref
+
+def restore_score(score):
+    """ After unpickling a score, key stream offsets, sites and numeric
+    ids by the new objects' id()s again, and drop cached derivations.
+    """
+    from music21 import stream
+    objects = {}
+    streams = [score]
+    while streams:
+        s = streams.pop()
+        if id(s) in objects:
             continue
-        elif m[0].offset != 0.0:
-            r = note.Rest()
-            r.duration = duration.Duration(m[0].offset)
-            m.insert(0.0, r)
-        for n in m:
-            if len(m) == i + 1: # last item in measure
-                n.duration = duration.Duration(m.barDuration.quarterLength - n.offset)
+        objects[id(s)] = s
+        s._offsetDict = {id(e): (o, e) for o, e in s._offsetDict.values()}
+        for e in s._elements + s._endElements:
+            if e.isStream:
+                streams.append(e)
             else:
-                n.duration = duration.Duration(m[i+1].offset - n.offset)
-            i += 1
-
-    return v
+                objects[id(e)] = e
+            for a in ('spannerStorage', '_stream'):
+                if isinstance(getattr(e, a, None), stream.Stream):
+                    streams.append(getattr(e, a))
+    for e in objects.values():
+        restore_object(e)
+    return score
+
+def restore_object(e):
+    """ restore_score() for one unpickled object that is not in a stream. """
+    from music21 import defaults
+    e.sites.siteDict = collections.OrderedDict(
+        (None if k is None else id(ref.site), ref) for k, ref in e.sites.siteDict.items()
+        if k is None or ref.site is not None)
+    e.sites._lastID = -1
+    e._cache = {}
+    if isinstance(e.id, int) and e.id > defaults.minIdNumberToConsiderMemoryLocation:
+        e.id = id(e)
+    return e
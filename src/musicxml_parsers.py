@@ -0,0 +1,87 @@
+""" music21's MusicXML parsers, fed one <measure> at a time.
+
+These subclass music21's own, so importing this module imports music21.
+musicxml_tools imports it only once a file is actually read.
+"""
+from music21.musicxml import xmlToM21
+from music21_tools import ScorePickler, restore_object
+from musicxml_tools import copy_state, element_key, has_spanners, parser_state_names
+from cache_tools import dumps, loads
+
+class MeasureParser(xmlToM21.MeasureParser):
+    """ music21's measure parser, realizing each distinct chord symbol once.
+    Later ones are unpickled from the first, which is several times faster
+    than a deepcopy.
+    """
+
+    def xmlToChordSymbol(self, mxHarmony):
+        # offset and staff are read by the caller, not the chord symbol
+        chord_symbols = self.parent.chord_symbols
+        key = element_key(mxHarmony, skip=('offset', 'staff'))
+        if key not in chord_symbols:
+            chord_symbols[key] = dumps(super().xmlToChordSymbol(mxHarmony), ScorePickler)
+        cs = restore_object(loads(chord_symbols[key]))
+        for n in cs.notes:
+            restore_object(n)
+        return cs
+
+class PartParser(xmlToM21.PartParser):
+    """ music21's part parser over measures that arrive one at a time. """
+
+    def __init__(self, mxPart, measures, mxScorePart, parent, record=None):
+        super().__init__(mxPart, mxScorePart=mxScorePart, parent=parent)
+        self.measures = measures
+        self.chord_symbols = {}
+        self.record = record
+
+    def parseMeasures(self):
+        record = self.record
+        for mxMeasure in self.measures:
+            if record is not None:
+                record.spanners.append(has_spanners(mxMeasure))
+                record.states.append(self.save_state())
+            self.xmlMeasureToMeasure(mxMeasure)
+        if record is not None:
+            record.states.append(self.save_state())
+        self.stream.coreElementsChanged()
+
+    def save_state(self):
+        return {name: copy_state(getattr(self, name)) for name in parser_state_names}
+
+    def restore_state(self, state):
+        for name, value in state.items():
+            setattr(self, name, copy_state(value))
+
+    def xmlMeasureToMeasure(self, mxMeasure):
+        # music21's own, only with the MeasureParser above
+        measureParser = MeasureParser(mxMeasure, parent=self)
+        try:
+            measureParser.parse()
+        except Exception as e:
+            self.measureParsingError(mxMeasure, e)
+        self.lastMeasureParser = measureParser
+
+        if measureParser.staves > self.maxStaves:
+            self.maxStaves = measureParser.staves
+        if measureParser.transposition is not None:
+            self.updateTransposition(measureParser.transposition)
+
+        self.firstMeasureParsed = True
+        self.staffReferenceList.append(measureParser.staffReference)
+
+        m = measureParser.stream
+        self.setLastMeasureInfo(m)
+        if measureParser.fullMeasureRest is True:
+            r1 = m.recurse().getElementsByClass('Rest')[0]
+            lastTSQl = self.lastTimeSignature.barDuration.quarterLength
+            if (r1.fullMeasure is True
+                    or (r1.duration.quarterLength != lastTSQl
+                        and r1.duration.type in ('whole', 'breve')
+                        and r1.duration.dots == 0
+                        and not r1.duration.tuplets)):
+                r1.duration.quarterLength = lastTSQl
+                r1.fullMeasure = True
+
+        self.stream.coreInsert(self.lastMeasureOffset, m)
+        self.adjustTimeAttributesFromMeasure(m)
+        return m
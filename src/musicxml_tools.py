@@ -0,0 +1,258 @@
+""" Reading MusicXML leadsheets without building the whole document.
+
+read_musicxml() streams a .mxl or .xml file through an incremental XML
+parser and hands music21's own part and measure parsers one <measure>
+of the first part at a time, so the notes, chord symbols and layout
+come out as converter.parseFile() makes them. The rest is never built:
+later parts are not even read, and credits, page defaults, part groups,
+directions and lyrics are dropped. Each distinct <harmony> is realized
+into pitches once and copied after that. Files this reader does not
+handle raise ReaderUnsupported, and callers fall back to music21.
+Opening the document and splitting it into measures needs no music21;
+the parsers in musicxml_parsers are imported once a file is read.
+
+Given a ReadRecord, read_musicxml() also keeps the parser state each
+measure was read in, so reparse_measure() can read an edited version of
+one measure on its own, as the whole file would have read it.
+measure_texts() finds which measures an edit changed.
+"""
+import os
+import re
+import xml.etree.ElementTree as ET
+import zipfile
+
+class ReaderUnsupported(Exception):
+    pass
+
+# measure and note content the arranger never looks at
+skipped_measure_tags = {'direction', 'figured-bass', 'sound', 'listening', 'grouping', 'link', 'bookmark'}
+skipped_note_tags = {'lyric'}
+
+# what music21's score parser reads from the top of the document
+header_tags = {'work', 'movement-number', 'movement-title', 'identification', 'part-list'}
+
+# what makes music21 build spanners, which can reach across measures
+spanner_tags = {'slur', 'glissando', 'slide', 'wavy-line', 'tremolo', 'arpeggiate', 'non-arpeggiate', 'ending',
+                'multiple-rest', 'octave-shift', 'wedge', 'bracket', 'dashes', 'pedal'}
+
+# the first part of a document, and the measures in it
+part_pattern = re.compile(rb'<part[\s>].*?</part>', re.S)
+measure_pattern = re.compile(rb'<measure[\s>].*?</measure>', re.S)
+encoding_pattern = re.compile(rb'<\?xml[^>]*encoding=["\']([^"\']*)')
+
+# what PartParser carries from one measure to the next
+parser_state_names = ('lastDivisions', 'lastTimeSignature', 'lastMeasureOffset', 'lastMeasureWasShort',
+                      'lastMeasureNumber', 'lastNumberSuffix', 'activeTuplets', 'lastClefs',
+                      'multiMeasureRestsToCapture', 'activeMultiMeasureRestSpanner', 'activeInstrument',
+                      'atSoundingPitch', 'activeAttributes', 'maxStaves', 'firstMeasureParsed')
+
+def element_key(el, skip=()):
+    """ A hashable copy of an element's tags, attributes and text. """
+    return (el.tag, tuple(sorted(el.attrib.items())), (el.text or '').strip(),
+            tuple(element_key(c) for c in el if c.tag not in skip))
+
+def musicxml_member(names):
+    """ The MusicXML document among the names in a .mxl archive, the one
+    music21 picks, or None.
+    """
+    for name in names:
+        if 'META-INF' in name or not (name.endswith('.xml') or name.endswith('musicxml')):
+            continue
+        return name
+    return None
+
+def open_musicxml(filepath):
+    """ The MusicXML document of a .mxl archive or a plain file, as a
+    binary stream. Picks the same file from an archive as music21.
+    """
+    if not zipfile.is_zipfile(filepath):
+        return open(filepath, 'rb')
+    # the member stays readable after the archive is closed
+    with zipfile.ZipFile(filepath) as archive:
+        name = musicxml_member(archive.namelist())
+        if name is not None:
+            return archive.open(name)
+    raise ReaderUnsupported(f'no MusicXML document in {filepath}')
+
+class ReadRecord:
+    """ What read_musicxml() saw of a file, for reparse_measure(): for
+    each measure, whether it has spanners and the parser state before it.
+    states has one more entry, the state after the last measure.
+    """
+
+    def __init__(self):
+        self.part_id = None
+        self.score_part = None
+        self.chord_symbols = {}
+        self.spanners = []
+        self.states = []
+
+def copy_state(value):
+    # the lists and dicts get changed in place by the next measure
+    if isinstance(value, (list, dict)):
+        return type(value)(value)
+    return value
+
+def state_key(value):
+    """ A comparable copy of a parser state or a value in it. """
+    if isinstance(value, dict):
+        return tuple(sorted((repr(k), state_key(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(state_key(v) for v in value)
+    if isinstance(value, ET.Element):
+        return element_key(value)
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return repr(value)
+
+def has_spanners(mxMeasure):
+    return any(el.tag in spanner_tags for el in mxMeasure.iter())
+
+def strip_measure(mxMeasure):
+    """ Drop what the arranger never reads from a <measure>, in place. """
+    for el in list(mxMeasure):
+        if el.tag in skipped_measure_tags:
+            mxMeasure.remove(el)
+        elif el.tag == 'note':
+            for sub in list(el):
+                if sub.tag in skipped_note_tags:
+                    el.remove(sub)
+    return mxMeasure
+
+def stream_measures(events, part):
+    """ The <measure> elements of one <part>, each freed once it has
+    been parsed. Stops at the end of the part.
+    """
+    depth = 0
+    for event, el in events:
+        if event == 'start':
+            depth += 1
+            continue
+        depth -= 1
+        if depth < 0:
+            return
+        if depth == 0 and el.tag == 'measure':
+            yield strip_measure(el)
+            part.remove(el)
+            el.clear()
+
+def measure_texts(filepath):
+    """ The bytes of a MusicXML document up to its first part, and of each
+    <measure> in that part. A measure whose bytes are the same reads the
+    same, given the same measures before it. Not every document splits
+    like this, which raises ReaderUnsupported.
+    """
+    if os.path.splitext(filepath)[1].lower() not in ('.mxl', '.xml', '.musicxml'):
+        raise ReaderUnsupported(f'not a MusicXML file: {filepath}')
+    with open_musicxml(filepath) as f:
+        data = f.read()
+    # measures are parsed on their own, as UTF-8 and without a DTD
+    encoding = encoding_pattern.match(data)
+    if encoding is not None and encoding.group(1).lower() not in (b'utf-8', b'utf8', b'us-ascii', b'ascii'):
+        raise ReaderUnsupported(f'encoding {encoding.group(1)}')
+    part = part_pattern.search(data)
+    if part is None or data.startswith((b'\xff\xfe', b'\xfe\xff')) or b'<!ENTITY' in data:
+        raise ReaderUnsupported('cannot split the document into measures')
+    return data[:part.start()], measure_pattern.findall(data, part.start(), part.end())
+
+def reparse_measure(text, record, i):
+    """ The music21 Measure for a new version of measure i of the file
+    read_musicxml() kept record of, given as its bytes, parsed from the
+    state measure i was read in, and the parser state after it. The
+    Measure is in no part.
+    """
+    try:
+        mxMeasure = strip_measure(ET.fromstring(text))
+    except ET.ParseError as e:
+        raise ReaderUnsupported(f'malformed measure: {e}') from e
+    if record.spanners[i] or has_spanners(mxMeasure):
+        raise ReaderUnsupported('spanners in a changed measure')
+    from music21.musicxml import xmlToM21
+    from musicxml_parsers import PartParser
+    importer = xmlToM21.MusicXMLImporter()
+    parser = PartParser(ET.Element('part', {'id': record.part_id}), [], record.score_part, importer)
+    parser.chord_symbols = record.chord_symbols
+    parser.restore_state(record.states[i])
+    m = parser.xmlMeasureToMeasure(mxMeasure)
+    parser.stream.remove(m)
+    if len(importer.spannerBundle):
+        raise ReaderUnsupported('spanners in a changed measure')
+    return m, parser.save_state()
+
+def read_musicxml(filepath, record=None):
+    """ A music21 Score holding the metadata and the first part of a
+    partwise MusicXML leadsheet, read in a single streaming pass. Fills
+    in record, a ReadRecord, if given.
+    """
+    if os.path.splitext(filepath)[1].lower() not in ('.mxl', '.xml', '.musicxml'):
+        raise ReaderUnsupported(f'not a MusicXML file: {filepath}')
+    from music21.musicxml import xmlToM21
+    from musicxml_parsers import PartParser
+    importer = xmlToM21.MusicXMLImporter()
+    s = importer.stream
+    with open_musicxml(filepath) as f:
+        events = ET.iterparse(f, events=('start', 'end'))
+        try:
+            event, root = next(events)
+            if root.tag != 'score-partwise':
+                raise ReaderUnsupported(f'root element {root.tag}')
+            header = ET.Element(root.tag, root.attrib)
+            depth, part = 0, None
+            for event, el in events:
+                depth += 1 if event == 'start' else -1
+                if event == 'start' and depth == 1 and el.tag == 'part':
+                    part = el
+                    break
+                if event == 'end' and depth == 0:
+                    root.remove(el)
+                    if el.tag in header_tags:
+                        header.append(el)
+            if part is None:
+                raise ReaderUnsupported('no parts')
+
+            if root.get('version') is not None:
+                importer.musicXmlVersion = root.get('version')
+            s.coreInsert(0, importer.xmlMetadata(header))
+            # part groups span parts this reader never reads
+            part_list = header.find('part-list')
+            if part_list is not None:
+                for el in part_list.findall('part-group'):
+                    part_list.remove(el)
+            importer.parsePartList(header)
+            part_id = part.get('id')
+            if part_id is None and importer.mxScorePartDict:
+                part_id = list(importer.mxScorePartDict.keys())[0]
+            if part_id not in importer.mxScorePartDict:
+                raise ReaderUnsupported(f'no <score-part> for part {part_id}')
+
+            parser = PartParser(part, stream_measures(events, part), importer.mxScorePartDict[part_id], importer, record)
+            parser.parse()
+        except ET.ParseError as e:
+            raise ReaderUnsupported(f'malformed MusicXML: {e}') from e
+    if record is not None:
+        record.part_id = part_id
+        record.score_part = importer.mxScorePartDict[part_id]
+        record.chord_symbols = parser.chord_symbols
+
+    if parser.appendToScoreAfterParse:
+        s.coreInsert(0.0, parser.stream)
+        importer.m21PartObjectsById[part_id] = parser.stream
+    for sp in importer.spannerBundle.getByCompleteStatus(True):
+        s.coreInsert(0, sp)
+        importer.spannerBundle.remove(sp)
+
+    s.coreElementsChanged()
+    s.definesExplicitSystemBreaks = importer.definesExplicitSystemBreaks
+    s.definesExplicitPageBreaks = importer.definesExplicitPageBreaks
+    for p in s.parts:
+        p.definesExplicitSystemBreaks = importer.definesExplicitSystemBreaks
+        p.definesExplicitPageBreaks = importer.definesExplicitPageBreaks
+    s.sort()
+
+    # as converter.parseFile() leaves them
+    if s.metadata.movementName is None:
+        s.metadata.movementName = os.path.basename(filepath)
+    s.filePath = os.path.abspath(filepath)
+    s.fileNumber = None
+    s.fileFormat = 'musicxml'
+    return s
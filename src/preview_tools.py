@@ -0,0 +1,118 @@
+""" Arrangements as data, for previews the frontend draws itself.
+
+A preview document holds what the PDF would show, per measure: the
+melody notes with their neck positions, and the chords with the pitch,
+string, fret and interval name of each note of their drop voicing, as
+parallel lists from low to high. Offsets and durations are in quarter
+notes from the start of the piece, and strings are numbered from 1
+(high e) like lilypond's. Nothing in it needs LilyPond, so a preview costs the parse and the
+chord placement only. Documents are encoded as compact JSON, or as
+msgpack when that is installed.
+"""
+from music21_tools import drop_string_offsets, spelled_pitch, step_semitones
+import bisect
+import functools
+import json
+
+preview_formats = {
+    'json': 'application/json',
+    'msgpack': 'application/msgpack',
+}
+
+@functools.lru_cache(maxsize=None)
+def optional_msgpack():
+    """ msgpack if it is installed, else None. """
+    try:
+        import msgpack
+    except ImportError:
+        return None
+    return msgpack
+
+def pitch_name(p):
+    """ Name of a spelled (midi, step) pitch, e.g. 'Bb3'. """
+    midi, step = p
+    octave = step // 7
+    alter = midi - 12 * (octave + 1) - step_semitones[step % 7]
+    return 'CDEFGAB'[step % 7] + ('#' * alter if alter > 0 else 'b' * -alter) + str(octave)
+
+def number(ql):
+    # quarter lengths may be Fractions, which JSON has no room for
+    return int(ql) if ql == int(ql) else float(ql)
+
+def note_document(o, n, position):
+    pitch = None if n.isRest else spelled_pitch(n.pitch)
+    return {
+        'offset': number(o),
+        'duration': number(n.duration.quarterLength),
+        'pitch': None if pitch is None else pitch_name(pitch),
+        'midi': None if pitch is None else pitch[0],
+        'position': position,
+    }
+
+def chord_document(o, cs, voicing, placement, drop_type):
+    # the notes of the voicing as parallel lists, low to high
+    pitches = sorted(voicing.notes) if voicing is not None else []
+    strings = [None] * len(pitches)
+    frets = [None] * len(pitches)
+    if o in placement.chord_note_frets:
+        # the four lowest notes are placed, with frets and string offsets
+        # going from the fourth down
+        for k in range(min(4, len(pitches))):
+            strings[k] = placement.melody_string_nums[o] + drop_string_offsets[drop_type][3 - k]
+            frets[k] = int(placement.chord_note_frets[o][3 - k])
+    return {
+        'offset': number(o),
+        'duration': number(cs.duration.quarterLength),
+        'figure': cs.figure,
+        'position': placement.chord_neck_positions.get(o),
+        'pitches': [pitch_name(p) for p in pitches],
+        'midi': [p[0] for p in pitches],
+        'strings': strings,
+        'frets': frets,
+        'intervals': placement.chord_interval_names.get(o) or [None] * len(pitches),
+    }
+
+def preview_document(leadsheet, placement, options):
+    """ The preview document of a leadsheet placed by place_leadsheet()
+    with options (minimum_fret, drop_type and so on).
+    """
+    src = leadsheet.src
+    offsets = leadsheet.offsets
+    measures = []
+    for m in leadsheet.measures:
+        start = m.offset
+        end = start + m.duration.quarterLength
+        measure = {'number': m.number, 'offset': number(start), 'duration': number(m.duration.quarterLength),
+                   'notes': [], 'chords': []}
+        # m.timeSignature and m.keySignature each search the measure
+        for el in m.elements:
+            if 'TimeSignature' in el.classes:
+                measure['time_signature'] = el.ratioString
+            elif 'KeySignature' in el.classes:
+                measure['key'] = el.sharps
+        for o in offsets[bisect.bisect_left(offsets, start):bisect.bisect_left(offsets, end)]:
+            if o in leadsheet.all_notes:
+                measure['notes'].append(note_document(o, leadsheet.all_notes[o],
+                                                      placement.melody_neck_positions.get(o)))
+            if o in leadsheet.all_chord_symbols:
+                measure['chords'].append(chord_document(o, leadsheet.all_chord_symbols[o],
+                                                        placement.chords_drop[o], placement,
+                                                        options['drop_type']))
+        measures.append(measure)
+    return {
+        'title': src.metadata.title,
+        'composer': src.metadata.composer,
+        'options': options,
+        'measures': measures,
+    }
+
+def encode(document, format='json'):
+    """ A preview document as bytes in one of preview_formats. """
+    if format == 'json':
+        return json.dumps(document, separators=(',', ':')).encode()
+    if format == 'msgpack':
+        msgpack = optional_msgpack()
+        if msgpack is None:
+            raise ValueError('msgpack is not installed')
+        return msgpack.packb(document)
+    raise ValueError(f'unknown preview format {format}')
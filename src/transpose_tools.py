@@ -0,0 +1,106 @@
+""" Transposing a parsed leadsheet to other keys.
+
+A transposition is a (semitones, steps) pair that moves a spelled
+(midi, step) pitch the same way music21 moves it by an interval, so
+C -> Eb is (3, 2) and C -> D# is (3, 1). The voicing pipeline works in
+intervals from the root and the melody note, so a voicing transposes
+along with its chord symbol and melody note, except where it picks an
+octave by letter (see keeps_octaves()). Only where a chord ends up on
+the neck, which is absolute, has to be worked out again per key.
+"""
+from music21_tools import Voicing, music21_pitch, pitch_octave, respell, spelled_pitch, step_semitones
+import contextlib
+
+fifths_letters = 'FCGDAEB'
+
+def key_fifths(sharps, transposition):
+    """ The key signature (in sharps) that sharps becomes. """
+    semitones, steps = transposition
+    return sharps + 7 * semitones - 12 * steps
+
+def transposition_to(sharps, semitones):
+    """ The transposition by semitones that keeps the key signature
+    between six flats and five sharps, so F# major comes out as Gb.
+    """
+    return (semitones, (sharps + 7 * semitones + 6) // 12)
+
+def key_transpositions(sharps):
+    """ The transpositions to all twelve keys, nearest first, none more
+    than a fourth down or a tritone up so the melody stays in range.
+    """
+    return [transposition_to(sharps, n) for n in sorted(range(-5, 7), key=lambda n: (abs(n), n))]
+
+def key_name(sharps, mode='major'):
+    """ Name of the key with that many sharps, e.g. 'Eb' or 'F#m'. """
+    if mode == 'minor':
+        sharps += 3
+    letter = fifths_letters[(sharps + 1) % 7]
+    alter = (sharps + 1) // 7
+    name = letter + ('#' * alter if alter > 0 else 'b' * -alter)
+    return name + 'm' if mode == 'minor' else name
+
+def transpose_spelled(p, transposition):
+    midi, step = p[0] + transposition[0], p[1] + transposition[1]
+    if abs(midi - 12 * (step // 7 + 1) - step_semitones[step % 7]) > 2:
+        # no triple sharps or flats, lilypond has no names for them
+        return respell(midi)
+    return (midi, step)
+
+def in_own_octave(p):
+    # B# and Cb belong to the octave next to their letter's
+    return p[0] // 12 - 1 == pitch_octave(p)
+
+def keeps_octaves(notes, transposition):
+    """ Whether transposing the spelled notes moves every letter by the
+    same steps and keeps each note in its letter's octave. The voicing
+    code picks octaves by letter, so a chord symbol and melody note that
+    do not keep them can be voiced with other pitches in the new key
+    than their voicing transposed.
+    """
+    for p in notes:
+        q = transpose_spelled(p, transposition)
+        if q[1] != p[1] + transposition[1] or not (in_own_octave(p) and in_own_octave(q)):
+            return False
+    return True
+
+def transpose_voicing(v, transposition):
+    if v is None:
+        return None
+    return Voicing([transpose_spelled(n, transposition) for n in v.notes], (v.root + transposition[0]) % 12)
+
+def music21_interval(transposition):
+    from music21 import interval, pitch
+    return interval.Interval(noteStart=pitch.Pitch('C4'),
+                             noteEnd=music21_pitch(transpose_spelled((60, 28), transposition)))
+
+@contextlib.contextmanager
+def transposed(leadsheet, transposition):
+    """ Transpose the melody, chord symbols and key signatures of a
+    leadsheet in place for the block, and put them back after it.
+    """
+    notes = []
+    for m in leadsheet.measures:
+        for n in m.getElementsByClass('Note'):
+            notes.append(n)
+        for cs in m.getElementsByClass('ChordSymbol'):
+            notes += cs.notes
+    keys = [k for m in leadsheet.measures for k in m.getElementsByClass('KeySignature')]
+    pitches = [n.pitch for n in notes]
+    interval = music21_interval(transposition) if keys else None
+    done = []
+    try:
+        for n, p in zip(notes, pitches):
+            new = music21_pitch(transpose_spelled(spelled_pitch(p), transposition))
+            if p.accidental is not None and new.accidental is not None:
+                new.accidental.displayType = p.accidental.displayType
+                new.accidental.displayStyle = p.accidental.displayStyle
+            n.pitch = new
+        for k in keys:
+            k.transpose(interval, inPlace=True)
+            done.append(k)
+        yield leadsheet
+    finally:
+        for n, p in zip(notes, pitches):
+            n.pitch = p
+        for k in done:
+            k.transpose(interval.reverse(), inPlace=True)
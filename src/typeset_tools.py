@@ -0,0 +1,314 @@
+""" Typesetting .ly files into PDFs with lilypond.
+
+typeset_batch() sends many files to a single lilypond process, so Guile
+and font loading are paid once per batch. Typesetter runs batches
+concurrently under a limit, and typeset_async() runs lilypond as an
+asyncio subprocess for callers on an event loop. The binary is
+LILYPOND_PATH and the per file timeout in seconds is LILYPOND_TIMEOUT,
+so a stub can stand in for lilypond in tests and benchmarks.
+"""
+from concurrent import futures
+import collections
+import os
+import re
+import signal
+import subprocess
+import time
+
+TypesetResult = collections.namedtuple('TypesetResult', ['lilyfile', 'pdf', 'error', 'stderr', 'elapsed'])
+
+class TypesetError(Exception):
+    """ lilypond failed on a file. stderr holds its output for that file. """
+
+    def __init__(self, lilyfile, returncode, stderr, message=None):
+        super().__init__(message or f'lilypond failed on {lilyfile} with exit status {returncode}')
+        self.lilyfile = lilyfile
+        self.returncode = returncode
+        self.stderr = stderr
+
+    def __reduce__(self):
+        # keep the fields when the error crosses a process boundary
+        return (TypesetError, (self.lilyfile, self.returncode, self.stderr, str(self)))
+
+class TypesetTimeout(TypesetError):
+    """ lilypond was killed before it finished the file. """
+
+    def __init__(self, lilyfile, timeout, stderr):
+        super().__init__(lilyfile, None, stderr, f'lilypond timed out after {timeout:g}s on {lilyfile}')
+        self.timeout = timeout
+
+    def __reduce__(self):
+        return (TypesetTimeout, (self.lilyfile, self.timeout, self.stderr))
+
+processing_re = re.compile(r"^Processing `(.*)'$", re.M)
+failed_re = re.compile(r'failed files: (.*)$', re.M)
+
+def lilypond_binary():
+    return os.environ.get('LILYPOND_PATH') or 'lilypond'
+
+def pdf_path(lilyfile):
+    return os.path.splitext(lilyfile)[0] + '.pdf'
+
+def default_timeout():
+    timeout = os.environ.get('LILYPOND_TIMEOUT')
+    return float(timeout) if timeout else None
+
+def split_stderr(stderr, lilyfiles):
+    """ lilypond's output for each file of one run, keyed by file. Output
+    before the first file goes to every file.
+    """
+    parts = processing_re.split(stderr)
+    preamble, per_file = parts[0], dict(zip(parts[1::2], parts[2::2]))
+    return {f: preamble + (f"Processing `{f}'" + per_file[f] if f in per_file else '') for f in lilyfiles}
+
+def _run(lilyfiles, timeout):
+    # one lilypond process for files that share a directory; run from that
+    # directory, every file writes its PDF next to itself
+    paths = [os.path.abspath(f) for f in lilyfiles]
+    start = time.perf_counter()
+    proc = subprocess.Popen([lilypond_binary()] + paths, cwd=os.path.dirname(paths[0]),
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=os.name == 'posix')
+    try:
+        if timeout:
+            stderr, timed_out = _watch(proc, timeout)
+        else:
+            stderr, timed_out = proc.communicate()[1], False
+    finally:
+        if proc.poll() is None:
+            _kill(proc)
+            proc.wait()
+    returncode = None if timed_out else proc.returncode
+    results = _results(lilyfiles, paths, returncode, stderr, timed_out, timeout, time.perf_counter() - start)
+    # the files lilypond never got to go to a fresh process
+    rest = [f for f, r in zip(lilyfiles, results) if r is None]
+    if rest:
+        again = iter(_run(rest, timeout))
+        results = [r if r is not None else next(again) for r in results]
+    return results
+
+def _watch(proc, timeout):
+    # wait for lilypond while reading its stderr as it comes, and kill it
+    # once it has spent longer than timeout on one file; returns the
+    # stderr and whether it was killed
+    import threading
+    lines = []
+    progress, closed = threading.Event(), threading.Event()
+
+    def read_stderr():
+        for line in iter(proc.stderr.readline, b''):
+            lines.append(line)
+            if line.startswith(b'Processing `'):
+                progress.set()
+        closed.set()
+        progress.set()
+
+    readers = [threading.Thread(target=read_stderr, daemon=True),
+               threading.Thread(target=proc.stdout.read, daemon=True)]
+    for t in readers:
+        t.start()
+    deadline = time.monotonic() + timeout
+    timed_out = False
+    while not closed.is_set():
+        if not progress.wait(max(0, deadline - time.monotonic())):
+            timed_out = True
+            break
+        progress.clear()
+        if not closed.is_set():
+            # each file lilypond starts gets the whole timeout
+            deadline = time.monotonic() + timeout
+    if not timed_out:
+        try:
+            proc.wait(max(0, deadline - time.monotonic()))
+        except subprocess.TimeoutExpired:
+            timed_out = True
+    if timed_out:
+        _kill(proc)
+    proc.wait()
+    for t in readers:
+        t.join()
+    return b''.join(lines), timed_out
+
+async def _run_async(lilyfiles, timeout):
+    # _run() without blocking the event loop; lilypond is killed when a
+    # file times out or the task is cancelled
+    import asyncio
+    loop = asyncio.get_running_loop()
+    remaining = lambda: None if deadline is None else max(0, deadline - loop.time())
+    paths = [os.path.abspath(f) for f in lilyfiles]
+    start = time.perf_counter()
+    proc = await asyncio.create_subprocess_exec(lilypond_binary(), *paths, cwd=os.path.dirname(paths[0]),
+                                                stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                                start_new_session=os.name == 'posix')
+    stdout = asyncio.ensure_future(proc.stdout.read())
+    deadline = loop.time() + timeout if timeout else None
+    lines = []
+    timed_out = False
+    try:
+        try:
+            while True:
+                line = await asyncio.wait_for(proc.stderr.readline(), remaining())
+                if not line:
+                    break
+                lines.append(line)
+                if deadline is not None and line.startswith(b'Processing `'):
+                    # each file lilypond starts gets the whole timeout
+                    deadline = loop.time() + timeout
+            await asyncio.wait_for(proc.wait(), remaining())
+        except asyncio.TimeoutError:
+            _kill(proc)
+            timed_out = True
+            # keep what was written before the kill
+            lines.append(await proc.stderr.read())
+            await proc.wait()
+    finally:
+        if proc.returncode is None:
+            _kill(proc)
+            await proc.wait()
+        stdout.cancel()
+    returncode = None if timed_out else proc.returncode
+    results = _results(lilyfiles, paths, returncode, b''.join(lines), timed_out, timeout,
+                       time.perf_counter() - start)
+    rest = [f for f, r in zip(lilyfiles, results) if r is None]
+    if rest:
+        again = iter(await _run_async(rest, timeout))
+        results = [r if r is not None else next(again) for r in results]
+    return results
+
+def _kill(proc):
+    # the whole process group, since ghostscript children of lilypond
+    # would keep its pipes open
+    if os.name == 'posix':
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+            return
+        except ProcessLookupError:
+            pass
+    proc.kill()
+
+def _results(lilyfiles, paths, returncode, stderr, timed_out, timeout, elapsed):
+    # one TypesetResult per file of a lilypond run, or None for the files
+    # it was killed before getting to
+    stderr = (stderr or b'').decode('utf-8', 'replace')
+    logs = split_stderr(stderr, paths)
+
+    failed = set()
+    for names in failed_re.findall(stderr):
+        failed.update(re.findall(r'"([^"]*)"', names))
+    started = processing_re.findall(stderr)
+    # a run killed before its first file counts against that file
+    hung = (started[-1] if started else paths[0]) if timed_out else None
+    ran = len(started) if timed_out else len(paths)
+    results = []
+    for f, path in zip(lilyfiles, paths):
+        pdf, log = pdf_path(f), logs[path]
+        error = None
+        if timed_out and path not in started and path != hung:
+            results.append(None)
+            continue
+        if path == hung:
+            error = TypesetTimeout(f, timeout, log)
+        elif timed_out and ': error:' in log:
+            # killed before lilypond could list its failed files
+            error = TypesetError(f, returncode, log)
+        elif path in failed or (returncode and len(paths) == 1) or not os.path.exists(pdf):
+            error = TypesetError(f, returncode, log)
+        results.append(TypesetResult(f, pdf if error is None else None, error, log, elapsed / max(ran, 1)))
+    return results
+
+def typeset_batch(lilyfiles, timeout=None):
+    """ Typeset several .ly files with one lilypond process per directory.
+
+    Returns one TypesetResult per file, in order. A file that fails only
+    records its TypesetError, the rest of the batch still gets its PDF.
+    timeout is per file: lilypond is killed once it has spent that long
+    on one file, which fails with TypesetTimeout, and the files after it
+    are typeset again in a new process.
+    """
+    if timeout is None:
+        timeout = default_timeout()
+    by_dir = collections.defaultdict(list)
+    for f in lilyfiles:
+        by_dir[os.path.dirname(os.path.abspath(f))].append(f)
+    # stale PDFs would hide a file that failed
+    for f in lilyfiles:
+        if os.path.exists(pdf_path(f)):
+            os.remove(pdf_path(f))
+    results = {}
+    for files in by_dir.values():
+        for f, r in zip(files, _run(files, timeout)):
+            results[f] = r
+    return [results[f] for f in lilyfiles]
+
+def typeset(lilyfile, timeout=None):
+    """ Typeset one .ly file next to itself. Returns its TypesetResult,
+    or raises TypesetError when lilypond fails or times out.
+    """
+    result = typeset_batch([lilyfile], timeout)[0]
+    if result.error is not None:
+        raise result.error
+    return result
+
+async def typeset_batch_async(lilyfiles, timeout=None):
+    """ typeset_batch() for asyncio. lilypond runs as an asyncio
+    subprocess, so the event loop keeps going while it works. Cancelling
+    the task kills lilypond.
+    """
+    import asyncio
+    if timeout is None:
+        timeout = default_timeout()
+    by_dir = collections.defaultdict(list)
+    for f in lilyfiles:
+        by_dir[os.path.dirname(os.path.abspath(f))].append(f)
+    for f in lilyfiles:
+        if os.path.exists(pdf_path(f)):
+            os.remove(pdf_path(f))
+    runs = await asyncio.gather(*(_run_async(files, timeout) for files in by_dir.values()))
+    results = {}
+    for files, run in zip(by_dir.values(), runs):
+        for f, r in zip(files, run):
+            results[f] = r
+    return [results[f] for f in lilyfiles]
+
+async def typeset_async(lilyfile, timeout=None):
+    """ typeset() for asyncio. """
+    result = (await typeset_batch_async([lilyfile], timeout))[0]
+    if result.error is not None:
+        raise result.error
+    return result
+
+class Typesetter:
+    """ Typesets batches of .ly files, at most `concurrency` lilypond
+    processes at a time and up to `batch_size` files per process.
+    """
+
+    def __init__(self, concurrency=None, batch_size=8, timeout=None):
+        self.concurrency = concurrency or os.cpu_count() or 1
+        self.batch_size = max(1, batch_size)
+        self.timeout = timeout
+        self.pool = futures.ThreadPoolExecutor(max_workers=self.concurrency)
+
+    def submit(self, lilyfiles):
+        """ Start typesetting one batch. The future holds its TypesetResults. """
+        return self.pool.submit(typeset_batch, list(lilyfiles), self.timeout)
+
+    def typeset_all(self, lilyfiles, callback=None):
+        """ Typeset any number of files in batches. Returns one TypesetResult
+        per file, in order. callback is called with each finished batch.
+        """
+        lilyfiles = list(lilyfiles)
+        jobs = [self.submit(lilyfiles[i:i + self.batch_size]) for i in range(0, len(lilyfiles), self.batch_size)]
+        results = []
+        for job in jobs:
+            results += job.result()
+            if callback is not None:
+                callback(job.result())
+        return results
+
+    def close(self):
+        self.pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
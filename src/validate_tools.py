@@ -0,0 +1,332 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" Checking an uploaded leadsheet before it is arranged.
+
+validate_leadsheet() reads the first part of a MusicXML file with
+ElementTree alone, without music21, and reports what would make the
+arrangement fail or come out degraded: pickup and other short measures,
+chord kinds the voicing code cannot handle, chords notated in the
+melody, and a melody the chords cannot be placed under between the
+minimum and maximum fret. It also estimates how long arranging the file
+takes, so a job can be rejected or routed before it is queued.
+
+    python src/validate_tools.py data/input/ --drop-type drop3
+"""
+from music21_tools import chord_quality, drop_string_offsets, step_semitones, string_notes
+from musicxml_tools import ReaderUnsupported, open_musicxml
+from preview_tools import pitch_name
+from fractions import Fraction
+import argparse
+import inspect
+import json
+import os
+import sys
+import xml.etree.ElementTree as ET
+import zipfile
+
+# chord kinds music21 cannot spell into a chord the voicing code extends
+failing_kinds = {'Neapolitan', 'Italian', 'French', 'German', 'Tristan', 'other'}
+
+# quarter notes per MusicXML note type
+type_quarters = {name: Fraction(2) ** (5 - k) for k, name in enumerate(
+    ['maxima', 'long', 'breve', 'whole', 'half', 'quarter', 'eighth', '16th', '32nd', '64th', '128th', '256th',
+     '512th', '1024th'])}
+
+# seconds to arrange a job without typesetting, per job, measure, chord and
+# distinct chord symbol, fitted on the benchmark charts to within a quarter
+job_cost = {'job': 0.02, 'measure': 0.0022, 'chord': 0.0015, 'figure': 0.003}
+
+def text(el, path, default=None):
+    found = el.find(path)
+    return default if found is None or found.text is None else found.text.strip()
+
+def harmony_label(h):
+    """ A readable name for a <harmony>, e.g. 'Bb dominant/D'. """
+    root = text(h, 'root/root-step', '')
+    alter = int(float(text(h, 'root/root-alter', '0')))
+    kind = h.find('kind')
+    label = root + ('#' * alter if alter > 0 else 'b' * -alter)
+    if kind is not None:
+        label += ' ' + (kind.get('text') or (kind.text or '').strip())
+    for d in h.findall('degree'):
+        label += f' {text(d, "degree-type", "")} {text(d, "degree-value", "")}'
+    bass = text(h, 'bass/bass-step')
+    if bass is not None:
+        bass_alter = int(float(text(h, 'bass/bass-alter', '0')))
+        label += '/' + bass + ('#' * bass_alter if bass_alter > 0 else 'b' * -bass_alter)
+    return label.strip()
+
+def note_pitch(n):
+    """ The spelled (midi, step) of a <note>, None for a rest. """
+    step = text(n, 'pitch/step')
+    if step is None:
+        return None
+    octave = int(text(n, 'pitch/octave', '4'))
+    letter = 'CDEFGAB'.index(step)
+    alter = round(float(text(n, 'pitch/alter', '0')))
+    return (12 * (octave + 1) + step_semitones[letter] + alter, 7 * octave + letter)
+
+class Scan:
+    """ What validate_leadsheet() reads from a file: measures as
+    (number, offset, length, bar length), melody notes and chord symbols
+    as (measure number, offset, ...), all in quarter notes.
+    """
+
+    def __init__(self):
+        self.measures = []
+        self.notes = []
+        self.chords = []
+        self.notated_chords = []
+        self.divisions = 1
+        self.bar = Fraction(4)
+
+    def read_measure(self, m, offset):
+        number = m.get('number')
+        pos = length = Fraction(0)
+        voice = None
+        for el in m:
+            if el.tag == 'attributes':
+                self.read_attributes(el)
+            elif el.tag == 'backup':
+                pos -= self.quarters(el)
+            elif el.tag == 'forward':
+                pos += self.quarters(el)
+            elif el.tag == 'harmony':
+                self.chords.append((number, offset + pos + self.quarters(el, 'offset'), el))
+            elif el.tag == 'note':
+                if el.find('grace') is not None:
+                    continue
+                if el.find('chord') is not None:
+                    if voice == text(el, 'voice', '1'):
+                        self.notated_chords.append(number)
+                    continue
+                # the melody is the first voice of the part
+                if voice is None:
+                    voice = text(el, 'voice', '1')
+                if text(el, 'voice', '1') == voice:
+                    self.notes.append((number, offset + pos, note_pitch(el)))
+                pos += self.note_length(el)
+            length = max(length, pos)
+        self.measures.append((number, offset, length, self.bar))
+        return length
+
+    def quarters(self, el, path='duration'):
+        return Fraction(int(text(el, path, '0')), self.divisions)
+
+    def note_length(self, n):
+        """ The length of a <note> as music21 reads it: from its type,
+        dots and tuplet where it has a type, else from its duration.
+        """
+        rest = n.find('rest')
+        if rest is not None and rest.get('measure') == 'yes':
+            # stretched to the bar
+            return self.bar
+        kind = text(n, 'type')
+        if kind not in type_quarters:
+            return self.quarters(n)
+        dots = len(n.findall('dot'))
+        length = type_quarters[kind] * (2 - Fraction(1, 2 ** dots))
+        tuplet = n.find('time-modification')
+        if tuplet is not None:
+            length *= Fraction(int(text(tuplet, 'normal-notes', '1')), int(text(tuplet, 'actual-notes', '1')))
+        return length
+
+    def read_attributes(self, el):
+        divisions = text(el, 'divisions')
+        if divisions is not None:
+            self.divisions = int(divisions)
+        time = el.find('time')
+        if time is not None and time.find('beats') is not None:
+            beats = sum(int(b) for b in text(time, 'beats').split('+'))
+            self.bar = Fraction(4 * beats, int(text(time, 'beat-type')))
+
+def scan_leadsheet(filepath):
+    """ A Scan of the first part of a partwise MusicXML file, read in one
+    streaming pass. Raises ValueError for files it cannot read.
+    """
+    scan = Scan()
+    offset = Fraction(0)
+    try:
+        document = open_musicxml(filepath)
+    except ReaderUnsupported as e:
+        raise ValueError(str(e)) from e
+    with document as f:
+        try:
+            depth = 0
+            for event, el in ET.iterparse(f, events=('start', 'end')):
+                if event == 'start':
+                    depth += 1
+                    if depth == 1 and el.tag != 'score-partwise':
+                        raise ValueError(f'root element {el.tag}')
+                    continue
+                depth -= 1
+                if depth == 2 and el.tag == 'measure':
+                    offset += scan.read_measure(el, offset)
+                    el.clear()
+                elif depth == 1 and el.tag == 'part':
+                    break
+        except ET.ParseError as e:
+            raise ValueError(f'malformed MusicXML: {e}') from e
+    if not scan.measures:
+        raise ValueError('no measures')
+    return scan
+
+def problem(measure, name, detail):
+    return {'measure': measure, 'problem': name, 'detail': detail}
+
+def measure_problems(scan):
+    errors = []
+    for number, offset, length, bar in scan.measures:
+        # parse_leadsheet() fails on the first of these
+        if length < bar:
+            errors.append(problem(number, 'anacrusis', f'{float(length):g} of {float(bar):g} quarter notes'))
+    for number in sorted(set(scan.notated_chords), key=scan.notated_chords.index):
+        errors.append(problem(number, 'notated_chord', 'chords in the melody are not supported'))
+    return errors
+
+def chord_problems(scan):
+    errors = []
+    warnings = []
+    for number, offset, h in scan.chords:
+        kind = text(h, 'kind', '')
+        label = harmony_label(h)
+        if kind == 'none':
+            warnings.append(problem(number, 'no_chord', 'N.C. is left out'))
+        elif h.find('root') is None:
+            errors.append(problem(number, 'unsupported_chord', f'{label} has no root'))
+        elif kind in failing_kinds:
+            errors.append(problem(number, 'unsupported_chord', f'{label} cannot be voiced'))
+        elif chord_quality(kind, kind) is None:
+            warnings.append(problem(number, 'unsupported_chord', f'{label} gets no interval names'))
+        if h.find('bass') is not None:
+            warnings.append(problem(number, 'slash_chord', f'{label} is voiced without its bass note'))
+    return errors, warnings
+
+def chord_melodies(scan):
+    """ (measure number, melody pitch) for each chord, None for a rest,
+    lined up the way melody_and_chords() does it. Chords before the
+    first note have no melody and are left out.
+    """
+    notes = {o: p for number, o, p in scan.notes}
+    chords = {o: number for number, o, h in scan.chords if text(h, 'kind', '') != 'none'}
+    melodies = []
+    prev_note = ()
+    for o in sorted(set(notes) | set(chords)):
+        if o in notes and o in chords:
+            if notes[o] is not None:
+                prev_note = notes[o]
+            if prev_note != ():
+                melodies.append((chords[o], prev_note))
+        elif o in notes:
+            prev_note = notes[o]
+        elif prev_note != ():
+            melodies.append((chords[o], prev_note))
+    return melodies
+
+def melody_problems(melodies, minimum_fret, maximum_fret, drop_type):
+    """ Chords whose melody note is a rest, which fails, and melody notes
+    that put the chord under them below the minimum fret (or nowhere)
+    or above the maximum fret of the high e string. One problem per
+    measure and kind.
+    """
+    lowest_string = string_notes[drop_string_offsets[drop_type][3]]
+    limits = [
+        ('melody_too_low', lambda p: p < lowest_string, 'is too low for any chord'),
+        ('melody_below_minimum_fret', lambda p: lowest_string <= p < lowest_string + minimum_fret,
+         f'puts the chord below fret {minimum_fret}'),
+        ('melody_above_maximum_fret', lambda p: p > string_notes[-1] + maximum_fret,
+         f'puts the chord above fret {maximum_fret}'),
+    ]
+    errors = []
+    warnings = []
+    seen = set()
+    for number, p in melodies:
+        if p is None:
+            errors.append(problem(number, 'no_melody_note', 'the melody note for this chord is a rest'))
+            continue
+        for name, out, detail in limits:
+            if out(p[0]) and (number, name) not in seen:
+                seen.add((number, name))
+                warnings.append(problem(number, name, f'{pitch_name(p)} {detail}'))
+    return errors, warnings
+
+def estimated_seconds(measures, chords, figures):
+    """ About how long generate_arrangement() takes, without lilypond. """
+    return round(job_cost['job'] + job_cost['measure'] * measures + job_cost['chord'] * chords
+                 + job_cost['figure'] * figures, 2)
+
+def validate_leadsheet(filepath, minimum_fret=5, maximum_fret=15, drop_type='drop2', **options):
+    """ A report on whether a leadsheet can be arranged with these options,
+    as a dict that encodes as JSON. errors would make the arrangement
+    fail, warnings make it come out degraded; ok means no errors. Takes
+    the options of generate_arrangement(); only these three change the
+    report.
+    """
+    if options:
+        # checked against the arranger only when there are others to check
+        from generate_chordmelody import arrange_leadsheet
+        inspect.signature(arrange_leadsheet).bind(None, **options)
+    if drop_type not in drop_string_offsets:
+        raise ValueError(f'unknown drop type {drop_type}')
+    report = {'file': os.path.basename(filepath), 'ok': False, 'errors': [], 'warnings': []}
+    try:
+        scan = scan_leadsheet(filepath)
+    except (ValueError, zipfile.BadZipFile) as e:
+        report['errors'].append(problem(None, 'unreadable', str(e)))
+        return report
+
+    chord_errors, chord_warnings = chord_problems(scan)
+    melody_errors, melody_warnings = melody_problems(chord_melodies(scan), minimum_fret, maximum_fret, drop_type)
+    # in the order of the measures
+    order = {number: k for k, (number, offset, length, bar) in enumerate(scan.measures)}
+    by_measure = lambda p: order[p['measure']]
+    report['errors'] = sorted(measure_problems(scan) + chord_errors + melody_errors, key=by_measure)
+    report['warnings'] = sorted(chord_warnings + melody_warnings, key=by_measure)
+    report['ok'] = not report['errors']
+    pitches = [p for number, o, p in scan.notes if p is not None]
+    chords = [h for number, o, h in scan.chords if text(h, 'kind', '') != 'none']
+    figures = len({harmony_label(h) for h in chords})
+    report.update({
+        'measures': len(scan.measures),
+        'notes': len(pitches),
+        'chords': len(chords),
+        'figures': figures,
+        'melody_range': [pitch_name(min(pitches)), pitch_name(max(pitches))] if pitches else None,
+        'estimated_seconds': estimated_seconds(len(scan.measures), len(chords), figures),
+    })
+    return report
+
+def print_report(filepath, report):
+    if report['ok']:
+        summary = (f'{report["measures"]} measures, {report["chords"]} chords, '
+                   f'about {report["estimated_seconds"]:.1f} s')
+        print(f'ok     {filepath}: {summary}')
+    else:
+        print(f'failed {filepath}')
+    for level in ('errors', 'warnings'):
+        for p in report[level]:
+            where = '' if p['measure'] is None else f'measure {p["measure"]}: '
+            print(f'    {level[:-1]:<8}{where}{p["problem"]}, {p["detail"]}')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Check MusicXML leadsheets before arranging them.')
+    parser.add_argument('paths', nargs='+', help='leadsheet files, directories or glob patterns')
+    parser.add_argument('--minimum-fret', type=int, default=5)
+    parser.add_argument('--maximum-fret', type=int, default=15)
+    parser.add_argument('--drop-type', default='drop2', choices=sorted(drop_string_offsets))
+    parser.add_argument('--json', action='store_true', help='print one JSON report per line')
+    args = parser.parse_args(argv)
+
+    from generate_chordmelody import find_leadsheets
+    failed = 0
+    for filepath in find_leadsheets(args.paths):
+        report = validate_leadsheet(filepath, args.minimum_fret, args.maximum_fret, args.drop_type)
+        failed += not report['ok']
+        if args.json:
+            print(json.dumps(report))
+        else:
+            print_report(filepath, report)
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,22 @@
+import os
+import sys
+import pytest
+
+here = os.path.dirname(os.path.abspath(__file__))
+root = os.path.dirname(here)
+sys.path.insert(0, os.path.join(root, 'src'))
+
+@pytest.fixture
+def arranging(monkeypatch):
+    """ Arrange as from the repository root, where templates and
+    data/output are found, with benchmarks/fake_lilypond for lilypond
+    and no caches.
+    """
+    import generate_chordmelody
+    generate_chordmelody.setup_environment()
+    monkeypatch.chdir(root)
+    monkeypatch.setenv('LILYPOND_PATH', os.path.join(root, 'benchmarks', 'fake_lilypond'))
+    for name in ('PARSE_CACHE', 'OUTPUT_CACHE', 'LEADSHEET_READER', 'VOICING_CACHE', 'METRICS_LOG',
+                 'METRICS_MEMORY', 'JOB_MEMORY_MB', 'PROFILE_DIR'):
+        monkeypatch.delenv(name, raising=False)
+    os.makedirs('data/output', exist_ok=True)
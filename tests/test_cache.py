@@ -0,0 +1,44 @@
+""" The output and parse caches. """
+from metrics_tools import Metrics, measure_job
+import generate_chordmelody
+import os
+import pytest
+import shutil
+
+here = os.path.dirname(os.path.abspath(__file__))
+untitled = os.path.join(here, 'data', 'mid-triplet-chord.xml')
+
+pytestmark = pytest.mark.usefixtures('arranging')
+
+def copies(tmp_path, *names):
+    paths = []
+    for name in names:
+        shutil.copy(untitled, tmp_path / name)
+        paths.append(str(tmp_path / name))
+    return paths
+
+def title(lilyfile):
+    with open(lilyfile) as f:
+        text = f.read()
+    os.remove(lilyfile)
+    return [line.strip() for line in text.splitlines() if line.strip().startswith('title =')]
+
+def test_output_cache_keeps_file_names_apart(tmp_path, monkeypatch):
+    monkeypatch.setenv('OUTPUT_CACHE', str(tmp_path / 'output-cache'))
+    first, second = copies(tmp_path, 'first.xml', 'second.xml')
+    for path, name in [(first, 'first.xml'), (second, 'second.xml'), (first, 'first.xml')]:
+        lilyfile = generate_chordmelody.generate_arrangement(path, output_name='test-cache', pdf=False)
+        assert title(lilyfile) == [f'title = "{name}"']
+
+def test_parse_cache_keeps_file_names_apart(tmp_path, monkeypatch):
+    monkeypatch.setenv('PARSE_CACHE', str(tmp_path / 'parse-cache'))
+    third, fourth = copies(tmp_path, 'third.xml', 'fourth.xml')
+    for path, name, hits in [(third, 'third.xml', 0), (fourth, 'fourth.xml', 0), (third, 'third.xml', 1)]:
+        metrics = Metrics(name)
+        with measure_job(path, metrics):
+            leadsheet = generate_chordmelody.parse_leadsheet(path)
+        assert metrics.counts.get('parse_cache_hits', 0) == hits
+        assert leadsheet.src.metadata.title == name
+        assert leadsheet.src.filePath == path
+        lilyfile = generate_chordmelody.arrange_leadsheet(leadsheet, output_name='test-cache', pdf=False)
+        assert title(lilyfile) == [f'title = "{name}"']
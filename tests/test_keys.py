@@ -0,0 +1,40 @@
+""" Arranging in all twelve keys against arranging each key afresh. """
+from transpose_tools import transposed
+import generate_chordmelody
+import glob
+import os
+import pytest
+
+here = os.path.dirname(os.path.abspath(__file__))
+corpus = sorted(glob.glob(os.path.join(here, 'data', '*.*l')))
+
+pytestmark = pytest.mark.usefixtures('arranging')
+
+def pitches(placement):
+    # spellings may differ between the two, the pitches may not
+    return {o: sorted(v.pitches) if v is not None else None for o, v in placement.chords_drop.items()}
+
+@pytest.mark.parametrize('options', [{}, {'drop_type': 'drop3', 'minimum_fret': 0},
+                                     {'drop_type': 'drop24', 'minimum_fret': 12, 'maj_triad': 'major-six-nine'}],
+                         ids=['drop2', 'drop3', 'drop24'])
+@pytest.mark.parametrize('path', corpus, ids=os.path.basename)
+def test_keys_match_transposed_arrangements(path, options, monkeypatch):
+    leadsheet = generate_chordmelody.parse_leadsheet(path)
+    place_voicings = generate_chordmelody.place_voicings
+    placements = []
+    monkeypatch.setattr(generate_chordmelody, 'place_voicings',
+                        lambda *args: placements.append(place_voicings(*args)) or placements[-1])
+    for name, result in generate_chordmelody.arrange_keys(leadsheet, output_name='test-keys', pdf=False,
+                                                          **options):
+        os.remove(result.lilyfile)
+    monkeypatch.undo()
+
+    keys = generate_chordmelody.leadsheet_keys(leadsheet)
+    assert len(keys) == len(placements) == 12
+    for (name, transposition), placement in zip(keys, placements):
+        with transposed(leadsheet, transposition):
+            expected = generate_chordmelody.place_leadsheet(leadsheet, **options)
+        assert pitches(placement) == pitches(expected), name
+        assert placement.chord_note_frets == expected.chord_note_frets, name
+        assert placement.melody_string_nums == expected.melody_string_nums, name
+        assert placement.chord_interval_names == expected.chord_interval_names, name
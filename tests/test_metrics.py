@@ -0,0 +1,43 @@
+""" Memory budgets for arrangement jobs. """
+from metrics_tools import MemoryBudgetExceeded
+import json
+import os
+import pickle
+import pytest
+import subprocess
+import sys
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+pytestmark = pytest.mark.usefixtures('arranging')
+
+first_job = '''
+import generate_chordmelody
+generate_chordmelody.generate_arrangement('tests/data/aaba.xml', output_name='test-first-job', pdf=False)
+'''
+
+def test_first_job_is_not_charged_for_music21(tmp_path, monkeypatch):
+    # music21 alone is over the budget, so the job fails if its import is
+    # counted in
+    log = tmp_path / 'metrics.jsonl'
+    monkeypatch.setenv('JOB_MEMORY_MB', '20')
+    monkeypatch.setenv('METRICS_LOG', str(log))
+    monkeypatch.setenv('PYTHONPATH', os.path.join(os.path.dirname(here), 'src'))
+    try:
+        subprocess.run([sys.executable, '-c', first_job], check=True, capture_output=True)
+    finally:
+        if os.path.exists('data/output/test-first-job.ly'):
+            os.remove('data/output/test-first-job.ly')
+    job = json.loads(log.read_text())
+    assert job['error'] is None
+    assert job['peak_bytes'] < job['budget_bytes']
+
+@pytest.mark.parametrize('args', [(), ('read_score',), ('read_score', 50 * 2**20, None),
+                                  ('read_score', None, 40 * 2**20)])
+def test_budget_message_without_numbers(args):
+    e = pickle.loads(pickle.dumps(MemoryBudgetExceeded(*args)))
+    assert 'budget' in str(e)
+
+def test_budget_message():
+    e = MemoryBudgetExceeded('read_score', 50 * 2**20, 40 * 2**20)
+    assert str(e) == 'job used 50 MB by the end of read_score, over its budget of 40 MB'
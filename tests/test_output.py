@@ -0,0 +1,69 @@
+""" The direct emitter and the streaming reader against music21's, on the
+leadsheets in tests/data.
+"""
+from fractions import Fraction
+from lilypond_tools import EmitterUnsupported, split_duration
+from metrics_tools import Metrics, measure_job
+import generate_chordmelody
+import glob
+import os
+import pytest
+import xml.etree.ElementTree as ET
+
+here = os.path.dirname(os.path.abspath(__file__))
+corpus = sorted(glob.glob(os.path.join(here, 'data', '*.*l')))
+supported = [path for path in corpus if not os.path.basename(path).startswith('mid-triplet')]
+mid_triplet = os.path.join(here, 'data', 'mid-triplet-chord.xml')
+
+pytestmark = pytest.mark.usefixtures('arranging')
+
+def arrange(path, reader='stream', emitter='direct'):
+    """ The LilyPond text of an arrangement, and its Metrics. """
+    leadsheet = generate_chordmelody.parse_leadsheet(path, reader=reader)
+    metrics = Metrics(os.path.basename(path))
+    with measure_job(path, metrics):
+        lilyfile = generate_chordmelody.arrange_leadsheet(leadsheet, output_name='test-output', emitter=emitter,
+                                                          pdf=False)
+    with open(lilyfile) as f:
+        text = f.read()
+    os.remove(lilyfile)
+    return text, metrics
+
+def test_corpus():
+    assert len(supported) >= 8 and mid_triplet in corpus
+
+@pytest.mark.parametrize('path', supported, ids=os.path.basename)
+def test_direct_emitter_matches_music21(path):
+    direct, metrics = arrange(path, emitter='direct')
+    assert 'emitter_fallbacks' not in metrics.counts
+    assert direct == arrange(path, emitter='music21')[0]
+
+@pytest.mark.parametrize('path', corpus, ids=os.path.basename)
+def test_stream_reader_matches_music21(path):
+    assert arrange(path, reader='stream')[0] == arrange(path, reader='music21')[0]
+
+def test_tuplet_durations_unsupported():
+    assert split_duration(Fraction(3, 2)) == ['4. ']
+    with pytest.raises(EmitterUnsupported):
+        split_duration(Fraction(2, 3))
+
+def test_fallback_for_chord_in_a_triplet():
+    direct, metrics = arrange(mid_triplet, emitter='direct')
+    assert metrics.counts['emitter_fallbacks'] == 1
+    assert direct == arrange(mid_triplet, emitter='music21')[0]
+
+def test_duplicate_chords_counted(tmp_path, capsys):
+    # a second chord symbol on the first beat is skipped by both emitters
+    tree = ET.parse(os.path.join(here, 'data', 'aaba.xml'))
+    m = tree.getroot().find('part').find('measure')
+    m.insert(list(m).index(m.find('harmony')) + 1,
+             ET.fromstring('<harmony><root><root-step>G</root-step></root><kind>dominant</kind></harmony>'))
+    path = str(tmp_path / 'duplicate.xml')
+    tree.write(path)
+    direct, metrics = arrange(path, emitter='direct')
+    assert metrics.counts['duplicate_chords'] == 1
+    assert 'emitter_fallbacks' not in metrics.counts
+    music21, metrics = arrange(path, emitter='music21')
+    assert metrics.counts['duplicate_chords'] == 1
+    assert direct == music21
+    assert 'duplicate' not in capsys.readouterr().out
@@ -0,0 +1,119 @@
+""" Placing drop voicings on the neck. """
+from music21_tools import (NoteTooLowForChord, Voicing, drop_string_offsets, position_for_chord,
+                           positions_for_chords, string_notes)
+import music21_tools
+import itertools
+import pytest
+import random
+
+def voicing(*pitches):
+    return Voicing([(p, 0) for p in pitches], pitches[0] % 12)
+
+def search_position_for_chord(c, min_fret, max_fret, prev_chord, prev_string, drop_type):
+    """ The trial-and-error string set search that placement_index
+    replaced, as it was, to check the index against.
+    """
+    string_offsets = drop_string_offsets[drop_type]
+
+    def out_of_fret_range(pitches, mel_string, min_fret):
+        return any(pitches[3 - k] < string_notes[mel_string - string_offsets[k]] + min_fret for k in range(4))
+
+    def check_valid_string_set(mel_string):
+        if mel_string - string_offsets[3] < 0:
+            raise IndexError
+
+    pitches = sorted(c.pitches)
+    mel_string = 5
+
+    # if the highest voice stayed the same between chords
+    # try to play it on the same string
+    if prev_chord is not None:
+        prev_mel = sorted(prev_chord.pitches)[3]
+        if pitches[3] == prev_mel:
+            mel_string = prev_string
+            try:
+                while out_of_fret_range(pitches, mel_string, min_fret):
+                    mel_string -= 1
+                    check_valid_string_set(mel_string)
+            except IndexError:
+                mel_string = 5
+
+    # normal case, start from the highest string
+    try:
+        while out_of_fret_range(pitches, mel_string, min_fret):
+            mel_string -= 1
+            check_valid_string_set(mel_string)
+    except IndexError:
+        try:
+            mel_string = 5
+            while out_of_fret_range(pitches, mel_string, 0):
+                mel_string -= 1
+                check_valid_string_set(mel_string)
+        except IndexError:
+            raise NoteTooLowForChord
+
+    note_positions = [pitches[3 - k] - string_notes[mel_string - string_offsets[k]] for k in range(4)]
+    return 5 - mel_string, note_positions
+
+def searched(f, *args):
+    try:
+        return f(*args)
+    except NoteTooLowForChord:
+        return None
+
+def sample_voicings(n, seed, low=40, high=88):
+    rng = random.Random(seed)
+    return [voicing(*sorted(rng.randint(low, high) for _ in range(4))) for _ in range(n)]
+
+placements = [(d, f) for d in sorted(drop_string_offsets) for f in (0, 5, 12)]
+
+@pytest.fixture(scope='module')
+def all_voicings():
+    # every sorted four note voicing from the low E string to two octaves
+    # above the high one
+    return [voicing(*p) for p in itertools.combinations_with_replacement(range(40, 89), 4)]
+
+@pytest.mark.parametrize('drop_type, min_fret', placements)
+def test_index_matches_search(drop_type, min_fret, all_voicings):
+    # the same top note as the previous chord, held on each string
+    held = {top: [(voicing(40, 41, 42, top), s) for s in range(drop_string_offsets[drop_type][3], 6)]
+            for top in range(40, 89)}
+    mismatches = []
+    for c in all_voicings:
+        for prev_chord, prev_string in [(None, 5)] + held[c.pitches[3]]:
+            args = (c, min_fret, None, prev_chord, prev_string, drop_type)
+            if searched(position_for_chord, *args) != searched(search_position_for_chord, *args):
+                mismatches.append((c.pitches, prev_string if prev_chord else None))
+    assert mismatches == []
+
+@pytest.mark.parametrize('with_numpy', [True, False])
+@pytest.mark.parametrize('drop_type, min_fret', placements)
+def test_batch_matches_search_in_order(drop_type, min_fret, with_numpy, monkeypatch):
+    if not with_numpy:
+        monkeypatch.setattr(music21_tools, 'optional_numpy', lambda: None)
+    elif music21_tools.optional_numpy() is None:
+        pytest.skip('numpy is not installed')
+    # few distinct top notes, so melody notes are often held
+    chords = [voicing(*(sorted(c.pitches[:3]) + [60 + c.pitches[3] % 5])) for c in sample_voicings(2000, seed=1)]
+    expected = []
+    prev_chord, prev_string = None, 5
+    for c in chords:
+        position = searched(search_position_for_chord, c, min_fret, None, prev_chord, prev_string, drop_type)
+        expected.append(position)
+        prev_chord, prev_string = (None, 5) if position is None else (c, 5 - position[0])
+    assert positions_for_chords(chords, min_fret, None, drop_type) == expected
+
+def test_short_voicing_is_placed_nowhere():
+    with pytest.raises(NoteTooLowForChord):
+        position_for_chord(voicing(60, 64, 67), 5, 15, None, 5, 'drop2')
+
+def test_short_voicing_after_a_placed_chord():
+    prev = voicing(55, 60, 64, 67)
+    with pytest.raises(NoteTooLowForChord):
+        position_for_chord(voicing(60, 64, 67), 5, 15, prev, 5, 'drop2')
+
+def test_positions_skip_short_voicings():
+    chords = [voicing(55, 60, 64, 67), voicing(60, 64, 67), voicing(55, 60, 64, 67)]
+    positions = positions_for_chords(chords, 5, 15, 'drop2')
+    assert positions[1] is None
+    assert positions[0] == positions[2] == position_for_chord(chords[0], 5, 15, None, 5, 'drop2')
@@ -0,0 +1,61 @@
+""" Preview documents against the placement they are drawn from. """
+from preview_tools import optional_msgpack
+import generate_chordmelody
+import glob
+import json
+import os
+import pytest
+
+here = os.path.dirname(os.path.abspath(__file__))
+corpus = sorted(glob.glob(os.path.join(here, 'data', '*.*l')))
+
+pytestmark = pytest.mark.usefixtures('arranging')
+
+def check(document, leadsheet, placement, options):
+    assert document['title'] == leadsheet.src.metadata.title
+    assert document['options'] == options
+    assert [m['number'] for m in document['measures']] == [m.number for m in leadsheet.measures]
+
+    notes = {n['offset']: n for m in document['measures'] for n in m['notes']}
+    # offsets come out as floats, triplets and all
+    assert sorted(notes) == sorted(float(o) for o in leadsheet.all_notes)
+    for o, n in leadsheet.all_notes.items():
+        assert notes[float(o)]['midi'] == (None if n.isRest else n.pitch.midi)
+        assert notes[float(o)]['position'] == placement.melody_neck_positions.get(o)
+
+    chords = {c['offset']: c for m in document['measures'] for c in m['chords']}
+    assert sorted(chords) == sorted(float(o) for o in leadsheet.all_chord_symbols)
+    for o, cs in leadsheet.all_chord_symbols.items():
+        chord = chords[float(o)]
+        voicing = placement.chords_drop[o]
+        assert chord['figure'] == cs.figure
+        assert chord['midi'] == (sorted(voicing.pitches) if voicing is not None else [])
+        if o in placement.chord_note_frets:
+            # low to high, where the placement goes from the melody down
+            assert chord['frets'][:4] == [int(f) for f in reversed(placement.chord_note_frets[o])]
+            assert chord['strings'][3] == placement.melody_string_nums[o]
+            assert chord['intervals'] == placement.chord_interval_names[o]
+        else:
+            assert set(chord['frets']) <= {None}
+
+@pytest.mark.parametrize('options', [{}, {'drop_type': 'drop3', 'minimum_fret': 0}], ids=['drop2', 'drop3'])
+@pytest.mark.parametrize('path', corpus, ids=os.path.basename)
+def test_preview_matches_placement(path, options):
+    document = json.loads(generate_chordmelody.generate_preview(path, **options))
+    leadsheet = generate_chordmelody.parse_leadsheet(path)
+    placement = generate_chordmelody.place_leadsheet(leadsheet, **options)
+    defaults = dict(minimum_fret=5, maximum_fret=15, maj_triad='major-seven', min_triad='minor-seven',
+                    drop_type='drop2')
+    check(document, leadsheet, placement, dict(defaults, **options))
+
+def test_msgpack_matches_json():
+    if optional_msgpack() is None:
+        pytest.skip('msgpack is not installed')
+    path = os.path.join(here, 'data', 'aaba.xml')
+    document = optional_msgpack().unpackb(generate_chordmelody.generate_preview(path, format='msgpack'))
+    assert document == json.loads(generate_chordmelody.generate_preview(path))
+
+def test_preview_writes_no_lilypond():
+    before = set(os.listdir('data/output'))
+    generate_chordmelody.generate_preview(os.path.join(here, 'data', 'aaba.xml'))
+    assert set(os.listdir('data/output')) == before
@@ -0,0 +1,49 @@
+""" The arrangement server over HTTP, with one worker. """
+from arrangement_server import ArrangementHTTPServer, ArrangementService
+from http import client
+import json
+import os
+import pytest
+import threading
+
+here = os.path.dirname(os.path.abspath(__file__))
+untitled = os.path.join(here, 'data', 'mid-triplet-chord.xml')
+
+@pytest.fixture
+def server(arranging):
+    service = ArrangementService(concurrency=1, queue_size=1)
+    httpd = ArrangementHTTPServer(('127.0.0.1', 0), service)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+    service.close()
+
+def post(httpd, url, path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    connection = client.HTTPConnection(*httpd.server_address, timeout=120)
+    connection.request('POST', url, data)
+    response = connection.getresponse()
+    return response.status, response.read()
+
+def test_xml_upload_as_pdf(server):
+    before = set(os.listdir('data/output'))
+    status, body = post(server, '/arrange?format=pdf&filename=mytune.xml', untitled)
+    assert status == 200
+    assert body.startswith(b'%PDF')
+    # both outputs are read back and removed
+    assert set(os.listdir('data/output')) == before
+
+def test_untitled_upload_keeps_its_name(server):
+    status, body = post(server, '/arrange?format=ly&filename=mytune.xml', untitled)
+    assert status == 200
+    assert b'title = "mytune.xml"' in body
+
+def test_health(server):
+    post(server, '/arrange?format=ly&filename=mytune.xml', untitled)
+    connection = client.HTTPConnection(*server.server_address, timeout=10)
+    connection.request('GET', '/health')
+    health = json.loads(connection.getresponse().read())
+    assert health['status'] == 'ok' and health['completed'] == 1
@@ -0,0 +1,71 @@
+""" Arranging again after an edit against arranging from scratch. """
+from arrangement_session import ArrangementSession
+from metrics_tools import Metrics
+import generate_chordmelody
+import os
+import pytest
+import xml.etree.ElementTree as ET
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+pytestmark = pytest.mark.usefixtures('arranging')
+
+def add_harmony(measures):
+    # a chord change on the second note of the third measure
+    m = measures[2]
+    second = m.findall('note')[1]
+    harmony = ET.fromstring('<harmony><root><root-step>G</root-step></root><kind>dominant</kind></harmony>')
+    m.insert(list(m).index(second), harmony)
+
+def remove_harmony(measures):
+    m = measures[5]
+    m.remove(m.findall('harmony')[-1])
+
+def note_to_rest(measures):
+    note = measures[7].findall('note')[0]
+    note.remove(note.find('pitch'))
+    note.insert(0, ET.Element('rest'))
+
+def rest_to_note(measures):
+    note = next(n for m in measures for n in m.findall('note') if n.find('rest') is not None)
+    note.remove(note.find('rest'))
+    note.insert(0, ET.fromstring('<pitch><step>G</step><octave>4</octave></pitch>'))
+
+def octave_change(measures):
+    octave = measures[10].find('note/pitch/octave')
+    octave.text = str(int(octave.text) + 1)
+
+def chord_change(measures):
+    harmony = measures[12].find('harmony')
+    harmony.find('root/root-step').text = 'A'
+    harmony.find('kind').text = 'minor-seventh'
+
+edits = [add_harmony, remove_harmony, note_to_rest, rest_to_note, octave_change, chord_change]
+
+def text(lilyfile):
+    with open(lilyfile) as f:
+        result = f.read()
+    os.remove(lilyfile)
+    return result
+
+@pytest.mark.parametrize('drop_type', ['drop2', 'drop3'])
+def test_session_matches_full_arrangement(tmp_path, drop_type):
+    # written by ElementTree from the start, so only the edits change
+    path = str(tmp_path / 'aaba.xml')
+    tree = ET.parse(os.path.join(here, 'data', 'aaba.xml'))
+    tree.write(path)
+    session = ArrangementSession(drop_type=drop_type, output_name='test-session', pdf=False)
+    assert text(session.arrange(path)) == text(generate_chordmelody.generate_arrangement(
+        path, drop_type=drop_type, output_name='test-full', pdf=False))
+
+    for edit in edits:
+        edit(tree.getroot().find('part').findall('measure'))
+        tree.write(path)
+        metrics = Metrics(edit.__name__)
+        spliced = text(session.arrange(path, metrics=metrics))
+        full = text(generate_chordmelody.generate_arrangement(path, drop_type=drop_type, output_name='test-full',
+                                                              pdf=False))
+        assert spliced == full, edit.__name__
+        # the edit was spliced in, not arranged from scratch
+        assert 'full_arrangements' not in metrics.counts, edit.__name__
+        assert metrics.counts['measures_changed'] == 1, edit.__name__
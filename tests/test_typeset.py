@@ -0,0 +1,82 @@
+""" Typesetting with a lilypond that fails or hangs on some files. """
+from typeset_tools import TypesetError, TypesetTimeout, typeset_batch, typeset_batch_async
+import asyncio
+import os
+import pytest
+import stat
+import time
+
+stub = r'''#!/bin/sh
+# like lilypond, but hangs on hang*.ly and fails on error*.ly
+if [ "$1" = "--version" ]; then
+    echo "GNU LilyPond 2.20.0"
+    exit 0
+fi
+status=0
+failed=""
+for f in "$@"; do
+    echo "Processing \`$f'" >&2
+    name=$(basename "$f" .ly)
+    case "$name" in
+        hang*) sleep 60 ;;
+        error*) echo "$f:1:1: error: syntax error, unexpected end of input" >&2
+                status=1
+                failed="$failed \"$f\"" ;;
+        *) printf '%%PDF-1.4\n' > "$name.pdf" ;;
+    esac
+done
+if [ -n "$failed" ]; then
+    echo "fatal error: failed files:$failed" >&2
+fi
+exit $status
+'''
+
+@pytest.fixture
+def lilyfiles(tmp_path, monkeypatch):
+    lilypond = tmp_path / 'lilypond'
+    lilypond.write_text(stub)
+    lilypond.chmod(lilypond.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv('LILYPOND_PATH', str(lilypond))
+
+    def make(*names):
+        paths = []
+        for name in names:
+            (tmp_path / f'{name}.ly').write_text('{ c }\n')
+            paths.append(str(tmp_path / f'{name}.ly'))
+        return paths
+    return make
+
+def check(results, files):
+    first, error, hang, after, last = results
+    for r in (first, after, last):
+        assert r.error is None and open(r.pdf, 'rb').read().startswith(b'%PDF')
+    assert type(error.error) is TypesetError and 'syntax error' in error.stderr
+    assert isinstance(hang.error, TypesetTimeout) and hang.pdf is None
+    assert [r.lilyfile for r in results] == files
+
+def test_timeout_is_per_file(lilyfiles):
+    files = lilyfiles('first', 'error', 'hang', 'after', 'last')
+    start = time.perf_counter()
+    results = typeset_batch(files, timeout=1)
+    # one timeout for the hung file, the files after it run again
+    assert time.perf_counter() - start < 5
+    check(results, files)
+
+def test_timeout_is_per_file_async(lilyfiles):
+    files = lilyfiles('first', 'error', 'hang', 'after', 'last')
+    start = time.perf_counter()
+    results = asyncio.run(typeset_batch_async(files, timeout=1))
+    assert time.perf_counter() - start < 5
+    check(results, files)
+
+def test_slow_batch_within_timeout(lilyfiles):
+    # the limit is per file, not for the whole batch
+    files = lilyfiles(*[f'tune{i}' for i in range(5)])
+    results = typeset_batch(files, timeout=1)
+    assert all(r.error is None for r in results)
+
+def test_errors_without_timeout(lilyfiles):
+    files = lilyfiles('first', 'error')
+    first, error = typeset_batch(files)
+    assert first.error is None and os.path.exists(first.pdf)
+    assert type(error.error) is TypesetError and error.error.returncode == 1
@@ -0,0 +1,61 @@
+""" Checking leadsheets before arranging them. """
+from validate_tools import validate_leadsheet
+import copy
+import generate_chordmelody
+import glob
+import os
+import pytest
+import xml.etree.ElementTree as ET
+
+here = os.path.dirname(os.path.abspath(__file__))
+corpus = sorted(glob.glob(os.path.join(here, 'data', '*.*l')))
+
+pytestmark = pytest.mark.usefixtures('arranging')
+
+def pickup(measures):
+    m = measures[0]
+    m.remove(m.findall('note')[-1])
+
+def notated_chord(measures):
+    m = measures[1]
+    note = m.findall('note')[0]
+    chord = copy.deepcopy(note)
+    chord.insert(0, ET.Element('chord'))
+    m.insert(list(m).index(note) + 1, chord)
+
+def rootless_chord(measures):
+    harmony = measures[2].find('harmony')
+    harmony.remove(harmony.find('root'))
+
+def other_chord(measures):
+    measures[2].find('harmony/kind').text = 'other'
+
+@pytest.mark.parametrize('path', corpus, ids=os.path.basename)
+def test_corpus_is_accepted(path):
+    report = validate_leadsheet(path)
+    assert report['ok'] and report['errors'] == []
+    assert report['measures'] == len(generate_chordmelody.parse_leadsheet(path).measures)
+
+@pytest.mark.parametrize('edit, measure, name', [(pickup, '1', 'anacrusis'), (notated_chord, '2', 'notated_chord'),
+                                                 (rootless_chord, '3', 'unsupported_chord'),
+                                                 (other_chord, '3', 'unsupported_chord')],
+                         ids=lambda v: getattr(v, '__name__', None))
+def test_malformed_leadsheet_is_flagged(tmp_path, edit, measure, name):
+    path = str(tmp_path / 'malformed.xml')
+    tree = ET.parse(os.path.join(here, 'data', 'aaba.xml'))
+    edit(tree.getroot().find('part').findall('measure'))
+    tree.write(path)
+    report = validate_leadsheet(path)
+    assert not report['ok']
+    assert [(p['measure'], p['problem']) for p in report['errors']] == [(measure, name)]
+    # an error is something the arranger fails on
+    with pytest.raises(Exception):
+        generate_chordmelody.generate_arrangement(path, output_name='test-malformed', pdf=False)
+
+def test_unreadable_leadsheet_is_flagged(tmp_path):
+    path = tmp_path / 'truncated.xml'
+    with open(os.path.join(here, 'data', 'aaba.xml'), 'rb') as f:
+        path.write_bytes(f.read()[:500])
+    report = validate_leadsheet(str(path))
+    assert not report['ok']
+    assert [p['problem'] for p in report['errors']] == ['unreadable']
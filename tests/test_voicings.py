@@ -0,0 +1,33 @@
+""" The voicing pipeline on integer pitches against the music21 one it
+replaced. data/voicings.json holds what the music21 pipeline made of
+every chord of the leadsheets in data/, under several option sets: the
+pitches of its voicing, and its frets, interval names and melody string,
+or null for a voicing that fits nowhere on the neck.
+"""
+import generate_chordmelody
+import json
+import os
+import pytest
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+with open(os.path.join(here, 'data', 'voicings.json')) as f:
+    expected = json.load(f)
+
+@pytest.mark.parametrize('case', sorted(expected))
+def test_voicings_match_music21_pipeline(case):
+    name, drop_type, minimum_fret, maj_triad, min_triad = case.split()
+    minimum_fret = int(minimum_fret)
+    leadsheet = generate_chordmelody.parse_leadsheet(os.path.join(here, 'data', name))
+    voicings = generate_chordmelody.leadsheet_voicings(leadsheet, minimum_fret, maj_triad, min_triad, drop_type)
+    pitches = {o: sorted(v.pitches) for o, v in voicings.items()}
+    placement = generate_chordmelody.place_voicings(leadsheet, voicings, minimum_fret, 15, drop_type)
+
+    rows = []
+    for o in sorted(voicings):
+        if placement.chords_drop[o] is None:
+            rows.append([float(o), pitches[o], None, None, None])
+        else:
+            rows.append([float(o), pitches[o], [int(f) for f in placement.chord_note_frets[o]],
+                         placement.chord_interval_names[o], placement.melody_string_nums[o]])
+    assert rows == expected[case]